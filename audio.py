@@ -0,0 +1,160 @@
+"""
+Audio preparation for renders.
+
+An upload's soundtrack is probed once and the result kept next to it in
+``audio.json``. Before encoding, the track is cut to the reel's length and
+transcoded to AAC once; the result is cached by the audio bytes and the
+length, so every reel with the same soundtrack and length reuses it and
+the encode only muxes it with ``-c:a copy``.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+
+from precompose import FileCache, file_digest
+from profiling import BENCHMARK_ARGS, on_cache_hit, parse_benchmark
+
+AUDIO_CACHE_DIR = os.environ.get("AUDIO_CACHE_DIR", os.path.join("cache", "audio"))
+AUDIO_CACHE_MAX_BYTES = int(
+    os.environ.get("AUDIO_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+AUDIO_INFO_FILE = "audio.json"
+AUDIO_ENCODER_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+
+logger = logging.getLogger(__name__)
+
+
+def probe_audio(path):
+    """
+    Duration, bitrate, sample rate, channels and codec of an audio file
+    from ffprobe, or None if it cannot be read
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "format=duration,bit_rate:stream=codec_name,sample_rate,channels",
+                "-of",
+                "json",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+        probed = json.loads(result.stdout)
+    except (OSError, ValueError):
+        return None
+    if result.returncode != 0 or not probed.get("streams"):
+        return None
+
+    stream = probed["streams"][0]
+    fmt = probed.get("format", {})
+
+    def number(value, kind):
+        try:
+            return kind(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "duration": number(fmt.get("duration"), float),
+        "bit_rate": number(fmt.get("bit_rate"), int),
+        "sample_rate": number(stream.get("sample_rate"), int),
+        "channels": number(stream.get("channels"), int),
+        "codec": stream.get("codec_name"),
+    }
+
+
+def audio_info(target_dir):
+    """Probe ``target_dir/audio.mp3`` on first use and remember the result"""
+    info_path = os.path.join(target_dir, AUDIO_INFO_FILE)
+    try:
+        with open(info_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    info = probe_audio(os.path.join(target_dir, "audio.mp3"))
+    if info is not None:
+        tmp_path = f"{info_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(info, f, indent=2)
+        os.replace(tmp_path, info_path)
+    return info
+
+
+class AudioCache(FileCache):
+    """AAC soundtracks keyed by the source audio bytes and the trimmed length"""
+
+    suffix = ".m4a"
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        super().__init__(
+            cache_dir or AUDIO_CACHE_DIR,
+            AUDIO_CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+        )
+
+    def key(self, audio_path, seconds):
+        encoder = " ".join(AUDIO_ENCODER_ARGS)
+        return hashlib.sha256(
+            f"{file_digest(audio_path)}|{seconds:.3f}|{encoder}".encode("utf-8")
+        ).hexdigest()
+
+    def get_or_create(self, audio_path, seconds, record=None):
+        """
+        Return the AAC track of the first ``seconds`` of ``audio_path``.
+        ``record`` gets the -benchmark stats of a transcode on a miss, or
+        CACHE_HIT.
+        """
+        return self.fetch(
+            self.key(audio_path, seconds),
+            lambda tmp_path: self._render(audio_path, seconds, tmp_path, record),
+            on_cache_hit(record),
+        )
+
+    def _render(self, audio_path, seconds, tmp_path, record=None):
+        # -t on the input stops decoding at the reel's length
+        command = [
+            "ffmpeg",
+            "-y",
+            *(BENCHMARK_ARGS if record is not None else []),
+            "-t",
+            f"{seconds:.3f}",
+            "-i",
+            os.path.abspath(audio_path),
+            "-vn",
+            *AUDIO_ENCODER_ARGS,
+            tmp_path,
+        ]
+        result = subprocess.run(
+            command, capture_output=True, text=True, encoding="utf-8", errors="replace"
+        )
+        if result.returncode != 0:
+            logger.error(
+                "Audio transcode failed",
+                extra={"audio": audio_path, "stderr": result.stderr[-4000:]},
+            )
+            raise Exception(
+                f"Transcoding the audio failed with return code {result.returncode}"
+            )
+        if record is not None:
+            record(parse_benchmark(result.stderr))
+
+
+audio_cache = AudioCache()
+
+
+def prepare_audio(target_dir, seconds, cache=None, record=None):
+    """Path of the cached AAC soundtrack for a reel ``seconds`` long"""
+    cache = cache or audio_cache
+    return cache.get_or_create(os.path.join(target_dir, "audio.mp3"), seconds, record)
@@ -0,0 +1,180 @@
+"""
+Batch submissions: one upload of images and audio rendered as several
+variants, such as every aspect ratio or a handful of effects.
+
+The uploaded files are kept once in ``user_uploads/<batch_id>``. Each
+variant gets its own upload folder of hard links to them plus its own
+input.txt and settings.txt, so it renders, caches and reports exactly like
+a reel sent to /create.
+"""
+
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from ingest import IMAGE_INFO_FILE, UploadRejected
+from jobs import claim_folder
+from render_engine import ASPECT_RATIOS, FILTER_EFFECTS, write_concat_list
+
+BATCH_FILE = "batch.json"
+BATCH_MAX_VARIANTS = int(os.environ.get("BATCH_MAX_VARIANTS", "24"))
+MIN_IMAGE_DURATION = 0.5
+MAX_IMAGE_DURATION = 10
+
+
+def parse_manifest(text):
+    """
+    Validate a JSON manifest of variants and return them as dicts with
+    reel_name, aspect_ratio, filter_effect, text_overlay and duration.
+
+    The manifest is a list of variants or ``{"variants": [...]}``. Raises
+    UploadRejected with a message naming the offending variant.
+    """
+    try:
+        manifest = json.loads(text or "")
+    except ValueError:
+        raise UploadRejected("The manifest is not valid JSON.")
+    if isinstance(manifest, dict):
+        manifest = manifest.get("variants")
+    if not isinstance(manifest, list) or not manifest:
+        raise UploadRejected("The manifest must list at least one variant.")
+    if len(manifest) > BATCH_MAX_VARIANTS:
+        raise UploadRejected(
+            f"A batch can have at most {BATCH_MAX_VARIANTS} variants.", 413
+        )
+
+    variants = []
+    names = set()
+    for i, entry in enumerate(manifest, start=1):
+        if not isinstance(entry, dict):
+            raise UploadRejected(f"Variant {i} must be an object.")
+
+        reel_name = secure_filename(str(entry.get("reel_name") or "").strip())
+        if not reel_name:
+            raise UploadRejected(f"Variant {i} needs a valid reel_name.")
+        if reel_name in names:
+            raise UploadRejected(f"Variant {i} repeats the reel name '{reel_name}'.")
+        names.add(reel_name)
+
+        aspect_ratio = entry.get("aspect_ratio", "9:16")
+        if aspect_ratio not in ASPECT_RATIOS:
+            raise UploadRejected(
+                f"Variant {i} has an unknown aspect_ratio '{aspect_ratio}'."
+            )
+        filter_effect = entry.get("filter_effect", "none")
+        if filter_effect not in FILTER_EFFECTS:
+            raise UploadRejected(
+                f"Variant {i} has an unknown filter_effect '{filter_effect}'."
+            )
+
+        try:
+            duration = float(entry.get("duration", 1))
+        except (TypeError, ValueError):
+            raise UploadRejected(f"Variant {i} has an invalid duration.")
+        if not MIN_IMAGE_DURATION <= duration <= MAX_IMAGE_DURATION:
+            raise UploadRejected(
+                f"Variant {i}: image duration must be between "
+                f"{MIN_IMAGE_DURATION} and {MAX_IMAGE_DURATION} seconds."
+            )
+
+        variants.append(
+            {
+                "reel_name": reel_name,
+                "aspect_ratio": aspect_ratio,
+                "filter_effect": filter_effect,
+                "text_overlay": str(entry.get("text_overlay") or "").strip(),
+                "duration": duration,
+            }
+        )
+    return variants
+
+
+def schedule_order(variants):
+    """
+    Variants grouped so that those sharing a filter chain (aspect ratio,
+    effect and overlay) are queued next to each other and reuse the same
+    pre-composed stills while they are hot. Groups keep manifest order.
+    """
+    groups = {}
+    for variant in variants:
+        chain = (
+            variant["aspect_ratio"],
+            variant["filter_effect"],
+            variant["text_overlay"],
+        )
+        groups.setdefault(chain, []).append(variant)
+    return [variant for group in groups.values() for variant in group]
+
+
+def link_assets(source_dir, target_dir, names):
+    """Hard-link ``names`` from ``source_dir``, copying if linking is not possible"""
+    os.makedirs(target_dir, exist_ok=True)
+    for name in names:
+        source = os.path.join(source_dir, name)
+        target = os.path.join(target_dir, name)
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+
+def stage_variant(batch_dir, variant_dir, images, variant):
+    """
+    Create a variant's upload folder from the batch's shared files. It is
+    claimed for the job queue before its input.txt is written.
+    """
+    shared = [*images, "audio.mp3"]
+    if os.path.exists(os.path.join(batch_dir, IMAGE_INFO_FILE)):
+        shared.append(IMAGE_INFO_FILE)
+    os.makedirs(variant_dir, exist_ok=True)
+    claim_folder(variant_dir, variant["job_id"])
+    link_assets(batch_dir, variant_dir, shared)
+    write_concat_list(
+        os.path.join(variant_dir, "input.txt"),
+        [(name, variant["duration"]) for name in images],
+    )
+
+
+def new_batch(batch_id, images, variants):
+    """A batch record with a fresh job id for every variant"""
+    return {
+        "id": batch_id,
+        "created_at": datetime.now().isoformat(),
+        "image_count": len(images),
+        "variants": [dict(variant, job_id=str(uuid.uuid4())) for variant in variants],
+    }
+
+
+def save_batch(batch_dir, batch):
+    path = os.path.join(batch_dir, BATCH_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(batch, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_batch(batch_dir):
+    """Return the batch record saved in ``batch_dir``, or None"""
+    try:
+        with open(os.path.join(batch_dir, BATCH_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(statuses):
+    """Overall batch status from its variants' job statuses"""
+    counts = {}
+    for status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    if counts.get("queued", 0) + counts.get("running", 0):
+        overall = "running" if len(counts) > 1 or "running" in counts else "queued"
+    elif counts.get("failed"):
+        overall = "failed" if len(counts) == 1 else "partial"
+    else:
+        overall = "done"
+    return overall, counts
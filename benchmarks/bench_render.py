@@ -0,0 +1,289 @@
+"""
+Time create_reel() over a matrix of synthetic and real uploads.
+
+Generates image sets of mixed sizes and aspect ratios plus a tone or silent
+MP3, then renders every aspect ratio, every effect in FILTER_EFFECTS, with
+and without a text overlay, across image counts, and the laila-majnu demo
+set. Each render runs in its own Python process with an empty still cache,
+so wall time, CPU time (including FFmpeg) and peak RSS are per case.
+Results are written as JSON for comparison between commits.
+
+    python benchmarks/bench_render.py --quick
+    python benchmarks/bench_render.py --compare benchmarks/results/old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import render_engine  # noqa: E402
+
+FIXTURE_DIR = os.path.join(ROOT, "create-demo-reel", "laila-majnu")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Source images cycle through these sizes so every aspect gets scaled and padded
+IMAGE_SIZES = [(1600, 1200), (1200, 1600), (1080, 1080), (4000, 3000), (640, 480)]
+ASPECT_RATIOS = list(render_engine.ASPECT_RATIOS)
+TEXT = "Benchmark: Laila & Majnu"
+
+
+def ffmpeg(args, cwd):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True, cwd=cwd)
+
+
+def make_audio(target_dir, seconds, kind):
+    source = (
+        f"sine=frequency=440:duration={seconds}"
+        if kind == "tone"
+        else f"anullsrc=r=44100:cl=stereo:d={seconds}"
+    )
+    ffmpeg(["-f", "lavfi", "-i", source, "-c:a", "libmp3lame", "audio.mp3"], target_dir)
+
+
+def make_synthetic_set(root, count, duration, audio):
+    folder = f"synthetic_{count}"
+    target_dir = os.path.join(root, "user_uploads", folder)
+    os.makedirs(target_dir, exist_ok=True)
+
+    entries = []
+    for i in range(count):
+        width, height = IMAGE_SIZES[i % len(IMAGE_SIZES)]
+        ext = ".png" if i % 4 == 3 else ".jpg"
+        name = f"img_{i:03d}{ext}"
+        ffmpeg(
+            [
+                "-f",
+                "lavfi",
+                "-i",
+                f"testsrc2=size={width}x{height}:rate=1,hue=h={i * 37}",
+                "-frames:v",
+                "1",
+                name,
+            ],
+            target_dir,
+        )
+        entries.append((name, duration))
+    render_engine.write_concat_list(os.path.join(target_dir, "input.txt"), entries)
+    make_audio(target_dir, count * duration + 1, audio)
+    return folder
+
+
+def make_fixture_set(root, duration):
+    """Copy the laila-majnu demo images and music as an upload folder"""
+    folder = "laila_majnu"
+    target_dir = os.path.join(root, "user_uploads", folder)
+    os.makedirs(target_dir, exist_ok=True)
+
+    images = sorted(
+        name
+        for name in os.listdir(FIXTURE_DIR)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    entries = []
+    for i, name in enumerate(images):
+        new_name = f"img_{i:03d}{os.path.splitext(name)[1].lower()}"
+        shutil.copy(os.path.join(FIXTURE_DIR, name), os.path.join(target_dir, new_name))
+        entries.append((new_name, duration))
+    render_engine.write_concat_list(os.path.join(target_dir, "input.txt"), entries)
+    shutil.copy(
+        os.path.join(FIXTURE_DIR, "music.mp3"), os.path.join(target_dir, "audio.mp3")
+    )
+    return folder, len(entries)
+
+
+def build_cases(counts, effects, quick):
+    """The benchmark matrix as a list of dicts; the first count is the baseline"""
+    base = {
+        "images": "synthetic",
+        "count": counts[0],
+        "aspect_ratio": "9:16",
+        "filter_effect": "none",
+        "text_overlay": "",
+    }
+    cases = [dict(base, images="laila-majnu")]
+    cases += [dict(base, aspect_ratio=ratio) for ratio in ASPECT_RATIOS]
+    cases += [
+        dict(base, filter_effect=effect) for effect in effects if effect != "none"
+    ]
+    cases += [dict(base, text_overlay=TEXT)]
+    cases += [dict(base, count=count) for count in counts[1:]]
+    if quick:
+        cases = (
+            cases[:1] + [case for case in cases if case["images"] == "synthetic"][:3]
+        )
+
+    for case in cases:
+        case["name"] = "/".join(
+            [
+                (
+                    case["images"]
+                    if case["images"] != "synthetic"
+                    else f"synthetic{case['count']}"
+                ),
+                case["aspect_ratio"],
+                case["filter_effect"],
+                "text" if case["text_overlay"] else "notext",
+            ]
+        )
+    return cases
+
+
+def run_case(case):
+    """Render one case in this process and measure it; prints a JSON line"""
+    output = os.path.join("static", "reels", "bench.mp4")
+    error = None
+    start = time.perf_counter()
+    try:
+        render_engine.create_reel(
+            case["folder"],
+            "bench",
+            text_overlay=case["text_overlay"],
+            aspect_ratio=case["aspect_ratio"],
+            filter_effect=case["filter_effect"],
+        )
+    except Exception as e:
+        error = str(e)
+    wall = time.perf_counter() - start
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    result = {
+        "wall_s": round(wall, 3),
+        "cpu_s": round(
+            own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3
+        ),
+        "peak_rss_mb": round(
+            max(own.ru_maxrss, children.ru_maxrss) * rss_unit / (1024 * 1024), 1
+        ),
+        "output_bytes": os.path.getsize(output) if os.path.exists(output) else 0,
+        "error": error,
+    }
+    print(json.dumps(result))
+
+
+def measure(root, case):
+    """Run a case in a fresh interpreter with its own empty still cache"""
+    env = dict(os.environ)
+    env["PRECOMPOSE_CACHE_DIR"] = tempfile.mkdtemp(dir=root, prefix="stills_")
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    shutil.rmtree(env["PRECOMPOSE_CACHE_DIR"], ignore_errors=True)
+    lines = completed.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, ValueError):
+        return {"error": completed.stderr.strip()[-500:] or "no result"}
+
+
+def environment():
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+    return {
+        "commit": commit or "unknown",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": version.stdout.split("\n", 1)[0],
+    }
+
+
+def compare(previous_path, results):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = {case["name"]: case for case in json.load(f)["results"]}
+
+    print(f"\n{'case':<40} {'before (s)':>10} {'after (s)':>10} {'change':>8}")
+    for case in results:
+        before = previous.get(case["name"], {}).get("wall_s")
+        after = case.get("wall_s")
+        if before and after:
+            change = (after - before) / before * 100
+            print(f"{case['name']:<40} {before:>10.2f} {after:>10.2f} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[8, 24, 60])
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--audio", choices=["tone", "silent"], default="tone")
+    parser.add_argument(
+        "--effects", nargs="+", default=list(render_engine.FILTER_EFFECTS)
+    )
+    parser.add_argument("--quick", action="store_true", help="only a few cases")
+    parser.add_argument(
+        "--output", help="JSON file (default benchmarks/results/<commit>.json)"
+    )
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(json.loads(args.run_case))
+        return
+
+    cases = build_cases(args.counts, args.effects, args.quick)
+    report = {"environment": environment(), "results": []}
+
+    with tempfile.TemporaryDirectory() as root:
+        folders = {}
+        fixture_images = None
+        for case in cases:
+            key = (case["images"], case["count"])
+            if key not in folders:
+                if case["images"] == "laila-majnu":
+                    folders[key], fixture_images = make_fixture_set(root, args.duration)
+                else:
+                    folders[key] = make_synthetic_set(
+                        root, case["count"], args.duration, args.audio
+                    )
+            if case["images"] == "laila-majnu":
+                case["count"] = fixture_images
+
+            result = {**case, **measure(root, dict(case, folder=folders[key]))}
+            report["results"].append(result)
+            if result.get("error"):
+                print(f"{case['name']:<40} FAILED: {result['error']}")
+            else:
+                print(
+                    f"{case['name']:<40} {result['wall_s']:>7.2f}s wall "
+                    f"{result['cpu_s']:>7.2f}s cpu {result['peak_rss_mb']:>7.1f}MB "
+                    f"{result['output_bytes'] / (1024 * 1024):>6.2f}MB out"
+                )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{report['environment']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(args.compare, report["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compare single-pass and segmented encoding across image counts.
+
+Builds synthetic uploads under a temporary directory, renders each one both
+ways and prints the wall time per mode together with the first image count
+where segmenting wins. Use the result to tune SEGMENT_MIN_IMAGES.
+
+    python benchmarks/bench_segmented.py --counts 4 8 12 24 48
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio  # noqa: E402
+import precompose  # noqa: E402
+import render_engine  # noqa: E402
+
+
+def make_upload(root, folder, image_count, duration):
+    target_dir = os.path.join(root, "user_uploads", folder)
+    os.makedirs(target_dir, exist_ok=True)
+
+    entries = []
+    for i in range(image_count):
+        name = f"img_{i:03d}.jpg"
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-v",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                f"testsrc2=size=1600x1200:rate=1,hue=h={i * 37}",
+                "-frames:v",
+                "1",
+                name,
+            ],
+            check=True,
+            cwd=target_dir,
+        )
+        entries.append((name, duration))
+    render_engine.write_concat_list(os.path.join(target_dir, "input.txt"), entries)
+
+    total = image_count * duration + 1
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:duration={total}",
+            "-c:a",
+            "libmp3lame",
+            "audio.mp3",
+        ],
+        check=True,
+        cwd=target_dir,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[4, 8, 12, 24, 48])
+    parser.add_argument("--duration", type=float, default=1.0)
+    parser.add_argument("--aspect-ratio", default="9:16")
+    parser.add_argument("--filter-effect", default="none")
+    args = parser.parse_args()
+
+    crossover = None
+    print(f"{'images':>6} {'single (s)':>11} {'segmented (s)':>14} {'speedup':>8}")
+
+    with tempfile.TemporaryDirectory() as root:
+        # Keep the still and audio caches with the throwaway uploads
+        precompose.still_cache = precompose.StillCache(os.path.join(root, "stills"))
+        audio.audio_cache = audio.AudioCache(os.path.join(root, "audio"))
+        for count in args.counts:
+            folder = f"bench_{count}"
+            make_upload(root, folder, count, args.duration)
+
+            timings = {}
+            for segmented in (False, True):
+                start = time.perf_counter()
+                render_engine.render(
+                    render_engine.RenderSpec.for_folder(
+                        folder,
+                        f"{folder}_{'seg' if segmented else 'single'}",
+                        base_dir=root,
+                        aspect_ratio=args.aspect_ratio,
+                        filter_effect=args.filter_effect,
+                        segmented=segmented,
+                    )
+                )
+                timings[segmented] = time.perf_counter() - start
+
+            speedup = timings[False] / timings[True]
+            if crossover is None and speedup > 1:
+                crossover = count
+            print(
+                f"{count:>6} {timings[False]:>11.2f} {timings[True]:>14.2f} {speedup:>7.2f}x"
+            )
+
+    print(
+        f"cores: {os.cpu_count()}, segmenting pays off from: {crossover or 'never'} images"
+    )
+
+
+if __name__ == "__main__":
+    main()
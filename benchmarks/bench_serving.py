@@ -0,0 +1,119 @@
+"""
+Measure cold start and requests per second of the web app as it is served.
+
+Starts the server command in a fresh process, times how long until the
+first request to / succeeds, then hits each route from several client
+threads for a few seconds and reports requests per second.
+
+    python benchmarks/bench_serving.py --server gunicorn
+    python benchmarks/bench_serving.py --server flask --output before.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "flask": [sys.executable, "main.py"],
+    "gunicorn": [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "-c",
+        "gunicorn.conf.py",
+        "wsgi:app",
+    ],
+}
+ROUTES = ["/", "/gallery", "/api/reels", "/jobs", "/metrics", "/api/capabilities"]
+
+
+def fetch(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def cold_start(command, base_url, env, timeout=60):
+    """Start the server and return (process, seconds until / answers 200)"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    while time.perf_counter() - started < timeout:
+        if fetch(f"{base_url}/") == 200:
+            return process, time.perf_counter() - started
+        if process.poll() is not None:
+            raise SystemExit(f"{' '.join(command)} exited with {process.returncode}")
+        time.sleep(0.02)
+    process.terminate()
+    raise SystemExit(f"{' '.join(command)} did not answer within {timeout}s")
+
+
+def throughput(url, seconds, concurrency):
+    """Requests per second and error count for ``url`` under load"""
+    deadline = time.perf_counter() + seconds
+    counts = {"ok": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def client():
+        while time.perf_counter() < deadline:
+            status = fetch(url)
+            with lock:
+                counts["ok" if status == 200 else "errors"] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    return counts["ok"] / seconds, counts["errors"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", choices=sorted(SERVERS), default="gunicorn")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, PORT=str(args.port), LOG_LEVEL="WARNING")
+    process, startup = cold_start(SERVERS[args.server], base_url, env)
+    results = {"server": args.server, "cold_start_seconds": round(startup, 3)}
+    print(f"cold start: {startup:.2f}s")
+    try:
+        for route in ROUTES:
+            rps, errors = throughput(
+                f"{base_url}{route}", args.seconds, args.concurrency
+            )
+            results[route] = {"requests_per_second": round(rps, 1), "errors": errors}
+            print(f"{route:<20} {rps:>8.1f} req/s  {errors} errors")
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
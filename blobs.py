@@ -0,0 +1,172 @@
+"""
+Content-addressed store for uploaded images and audio.
+
+Uploads are hashed while they stream in. Each file is then hard-linked
+into ``BLOB_STORE_DIR/<ab>/<sha256>``, or, when those bytes are already
+stored, replaced by a hard link to the stored copy. So a soundtrack used
+by a hundred reels takes its space on disk once. Job folders keep their
+usual ``img_000.jpg`` and ``audio.mp3`` names, and everything that reads
+them is unchanged.
+
+The link count of a blob is its reference count: one link for the store
+plus one per job folder using it. A blob is freed once the store's link
+is the only one left. This is safe without locks. A folder that links a
+blob while it is being freed keeps the bytes through its own link, and
+the next upload of the same bytes stores them again. Each folder lists
+the digests it uses in ``blobs.json``, so deleting a reel can free its
+blobs straight away. The lifecycle sweep frees the rest.
+
+Files in a job folder must be replaced, never rewritten in place, since
+other reels may share them.
+"""
+
+import json
+import logging
+import os
+import shutil
+import uuid
+
+from metrics import registry
+from precompose import remember_digest
+
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", os.path.join("cache", "blobs"))
+BLOB_MANIFEST = "blobs.json"
+
+DEDUPLICATED_BYTES = registry.counter(
+    "reel_upload_deduplicated_bytes_total",
+    "Uploaded bytes that were already in the blob store",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Hard-linked, content-addressed copies of uploaded files"""
+
+    def __init__(self, root=None):
+        self.root = root or BLOB_STORE_DIR
+        self.enabled = True
+
+    def path_for(self, digest):
+        return os.path.join(os.path.abspath(self.root), digest[:2], digest)
+
+    def store(self, path, digest):
+        """
+        Make ``path`` a link to the blob for ``digest``, adding the blob if
+        it is new. Returns True if a copy of the bytes was replaced by a link.
+        """
+        if not self.enabled:
+            return False
+        blob_path = self.path_for(digest)
+        while True:
+            try:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.link(path, blob_path)
+                return False
+            except FileExistsError:
+                pass
+            except OSError as e:
+                # Another filesystem, or one without hard links: keep the copy
+                logger.warning(
+                    "Blob store disabled", extra={"root": self.root, "error": str(e)}
+                )
+                self.enabled = False
+                return False
+
+            if os.path.samefile(path, blob_path):
+                return False
+            tmp_path = f"{path}.{uuid.uuid4().hex}.blob"
+            try:
+                os.link(blob_path, tmp_path)
+            except FileNotFoundError:
+                # Freed since the check above; store these bytes again
+                continue
+            os.replace(tmp_path, path)
+            DEDUPLICATED_BYTES.inc(os.path.getsize(path))
+            return True
+
+    def adopt(self, folder, digests):
+        """
+        Store the files of ``folder`` named in ``{name: digest}`` and list
+        the digests in its blobs.json. Returns the bytes that were deduplicated.
+        """
+        saved = 0
+        for name, digest in digests.items():
+            path = os.path.join(folder, name)
+            if self.store(path, digest):
+                saved += os.path.getsize(path)
+            # Renders fingerprint their inputs; they need not read them again
+            remember_digest(path, digest)
+        self.reference(folder, digests.values())
+        return saved
+
+    def reference(self, folder, digests):
+        """Add ``digests`` to the blobs.json of ``folder``"""
+        digests = set(digests)
+        if not digests:
+            return
+        path = os.path.join(folder, BLOB_MANIFEST)
+        listed = set(self.referenced(folder)) | digests
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sha256": sorted(listed)}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def referenced(self, folder):
+        """The digests listed in the blobs.json of ``folder``"""
+        try:
+            with open(os.path.join(folder, BLOB_MANIFEST), "r", encoding="utf-8") as f:
+                return json.load(f).get("sha256", [])
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    def release(self, digests):
+        """Free the blobs among ``digests`` that no folder links to. Returns bytes freed."""
+        freed = 0
+        for digest in digests:
+            freed += self._free(self.path_for(digest))
+        return freed
+
+    def _free(self, blob_path):
+        try:
+            stat = os.lstat(blob_path)
+        except OSError:
+            return 0
+        if stat.st_nlink > 1:
+            return 0
+        try:
+            os.remove(blob_path)
+        except FileNotFoundError:
+            return 0
+        return stat.st_size
+
+    def remove_folder(self, folder):
+        """Delete a job folder and free the blobs only it used. Returns bytes freed."""
+        digests = self.referenced(folder)
+        shutil.rmtree(folder, ignore_errors=True)
+        return self.release(digests)
+
+    def collect(self):
+        """Free every blob no folder links to. Returns bytes freed."""
+        freed = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                freed += self._free(os.path.join(root, name))
+        return freed
+
+    def usage(self):
+        """Blobs stored, their bytes, and the links job folders hold to them"""
+        blobs = size = links = 0
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                try:
+                    stat = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                blobs += 1
+                size += stat.st_size
+                links += stat.st_nlink - 1
+        return {"blobs": blobs, "bytes": size, "references": links}
+
+
+blob_store = BlobStore()
@@ -0,0 +1,410 @@
+"""
+Render project directories to reels from the command line, several at once.
+
+A project is a folder of JPEG or PNG images in file name order plus a
+soundtrack (``music.mp3`` or ``audio.mp3``), like create-demo-reel/laila-majnu.
+``thumbnail.*`` is not part of the reel. An optional settings.txt sets
+text_overlay, aspect_ratio, filter_effect, quality and duration, in the
+format the web app writes.
+
+    python bulk_render.py create-demo-reel/* --jobs 4
+    python bulk_render.py --manifest projects.json --output-dir renders
+
+A manifest is a JSON list of project paths, or of objects with a "path"
+and any of "name", "images" (the order to show them in) and the settings
+above. Paths are relative to the manifest.
+
+Projects whose output is up to date are skipped. Each output's inputs are
+remembered in ``<output-dir>/.bulk_render.json``: when their sizes and
+mtimes are unchanged nothing is read, and when only mtimes changed the
+contents are hashed to tell whether the reel really is stale.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from batches import MAX_IMAGE_DURATION, MIN_IMAGE_DURATION
+from logs import configure_logging
+from precompose import file_digest
+from render_engine import (
+    ASPECT_RATIOS,
+    DEFAULT_QUALITY,
+    FILTER_EFFECTS,
+    QUALITY_PROFILES,
+    RenderSpec,
+    render,
+    write_concat_list,
+)
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+AUDIO_NAMES = ("music.mp3", "audio.mp3")
+STATE_FILE = ".bulk_render.json"
+WORK_DIR = os.path.join("cache", "bulk")
+DEFAULT_SETTINGS = {
+    "text_overlay": "",
+    "aspect_ratio": "9:16",
+    "filter_effect": "none",
+    "quality": DEFAULT_QUALITY,
+    "duration": 1.0,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectError(ValueError):
+    """A project directory or manifest entry that cannot be rendered"""
+
+
+def _read_settings_file(project_dir):
+    settings = {}
+    path = os.path.join(project_dir, "settings.txt")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    if key in DEFAULT_SETTINGS:
+                        settings[key] = value
+    return settings
+
+
+def _check_settings(settings, where):
+    if settings["aspect_ratio"] not in ASPECT_RATIOS:
+        raise ProjectError(f"{where}: unknown aspect ratio {settings['aspect_ratio']}")
+    if settings["filter_effect"] not in FILTER_EFFECTS:
+        raise ProjectError(f"{where}: unknown effect {settings['filter_effect']}")
+    if settings["quality"] not in QUALITY_PROFILES:
+        raise ProjectError(f"{where}: unknown quality {settings['quality']}")
+    try:
+        settings["duration"] = float(settings["duration"])
+    except (TypeError, ValueError):
+        raise ProjectError(f"{where}: invalid duration {settings['duration']!r}")
+    if not MIN_IMAGE_DURATION <= settings["duration"] <= MAX_IMAGE_DURATION:
+        raise ProjectError(
+            f"{where}: image duration must be between "
+            f"{MIN_IMAGE_DURATION} and {MAX_IMAGE_DURATION} seconds"
+        )
+    return settings
+
+
+def load_project(path, defaults=None, **overrides):
+    """
+    Describe the project in ``path`` as a dict with its name, images,
+    audio and settings. Settings come from ``defaults``, then the project's
+    settings.txt, then ``overrides``.
+    """
+    path = os.path.abspath(path)
+    if not os.path.isdir(path):
+        raise ProjectError(f"{path}: not a directory")
+    names = sorted(os.listdir(path))
+
+    images = overrides.pop("images", None)
+    if images is None:
+        images = [
+            name
+            for name in names
+            if name.lower().endswith(IMAGE_SUFFIXES)
+            and os.path.splitext(name)[0].lower() != "thumbnail"
+        ]
+    missing = [name for name in images if name not in names]
+    if missing:
+        raise ProjectError(f"{path}: no image named {missing[0]}")
+    if not images:
+        raise ProjectError(f"{path}: no JPEG or PNG images")
+
+    audio = next((name for name in AUDIO_NAMES if name in names), None)
+    if audio is None:
+        mp3s = [name for name in names if name.lower().endswith(".mp3")]
+        if len(mp3s) != 1:
+            raise ProjectError(f"{path}: needs music.mp3 or a single .mp3 file")
+        audio = mp3s[0]
+
+    name = overrides.pop("name", None) or os.path.basename(path)
+    settings = dict(DEFAULT_SETTINGS, **(defaults or {}))
+    settings.update(_read_settings_file(path))
+    settings.update(
+        {key: value for key, value in overrides.items() if key in DEFAULT_SETTINGS}
+    )
+    return {
+        "name": secure_filename(name) or "reel",
+        "path": path,
+        "images": images,
+        "audio": audio,
+        "settings": _check_settings(settings, path),
+    }
+
+
+def load_manifest(manifest_path, defaults=None):
+    """Projects listed in a JSON manifest, see the module docstring"""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        try:
+            entries = json.load(f)
+        except ValueError as e:
+            raise ProjectError(f"{manifest_path}: not valid JSON ({e})")
+    if not isinstance(entries, list):
+        raise ProjectError(f"{manifest_path}: expected a list of projects")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    projects = []
+    for i, entry in enumerate(entries, start=1):
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("path"), str):
+            raise ProjectError(f"{manifest_path}: entry {i} needs a path")
+        options = {key: value for key, value in entry.items() if key != "path"}
+        projects.append(
+            load_project(os.path.join(base_dir, entry["path"]), defaults, **options)
+        )
+    return projects
+
+
+def _inputs(project):
+    return [*project["images"], project["audio"]]
+
+
+def stat_signature(project):
+    """Cheap signature of a project: sizes and mtimes of its inputs and its settings"""
+    parts = [json.dumps(project["settings"], sort_keys=True)]
+    for name in _inputs(project):
+        stat = os.stat(os.path.join(project["path"], name))
+        parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def content_fingerprint(project):
+    """Fingerprint of the image bytes in order, the audio bytes and the settings"""
+    parts = [json.dumps(project["settings"], sort_keys=True)]
+    for name in _inputs(project):
+        parts.append(file_digest(os.path.join(project["path"], name)))
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def _output_stamp(output_path):
+    try:
+        stat = os.stat(output_path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class BuildState:
+    """
+    What each output was last rendered from, saved as JSON in the output
+    directory after every render so an interrupted run keeps its progress.
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, STATE_FILE)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, project, output_path):
+        """
+        True when ``output_path`` was rendered from the project as it is now.
+        Hashes the inputs only if their sizes or mtimes changed.
+        """
+        entry = self.entries.get(project["name"])
+        if not entry or entry.get("output") != _output_stamp(output_path):
+            return False
+        signature = stat_signature(project)
+        if entry.get("signature") == signature:
+            return True
+        if entry.get("fingerprint") != content_fingerprint(project):
+            return False
+        self.record(project, output_path, signature=signature)
+        return True
+
+    def record(self, project, output_path, signature=None):
+        entry = {
+            "path": project["path"],
+            "signature": signature or stat_signature(project),
+            "fingerprint": content_fingerprint(project),
+            "output": _output_stamp(output_path),
+        }
+        with self._lock:
+            self.entries[project["name"]] = entry
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def stage_project(project, work_dir):
+    """
+    Lay a project out as an upload folder in a new directory under
+    ``work_dir``: images linked as img_000.jpg and so on, the soundtrack as
+    audio.mp3 and an input.txt. Any file name works, quotes included.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    target_dir = tempfile.mkdtemp(prefix=f"{project['name']}.", dir=work_dir)
+    entries = []
+    for i, name in enumerate(project["images"]):
+        staged = f"img_{i:03d}{os.path.splitext(name)[1].lower()}"
+        _link(os.path.join(project["path"], name), os.path.join(target_dir, staged))
+        entries.append((staged, project["settings"]["duration"]))
+    _link(
+        os.path.join(project["path"], project["audio"]),
+        os.path.join(target_dir, "audio.mp3"),
+    )
+    write_concat_list(os.path.join(target_dir, "input.txt"), entries)
+    return target_dir
+
+
+def render_project(project, output_path, work_dir, threads=None):
+    """Render one project to ``output_path`` and return the seconds it took"""
+    started = time.perf_counter()
+    target_dir = stage_project(project, work_dir)
+    try:
+        settings = project["settings"]
+        render(
+            RenderSpec(
+                upload_dir=target_dir,
+                output_path=output_path,
+                text_overlay=settings["text_overlay"],
+                aspect_ratio=settings["aspect_ratio"],
+                filter_effect=settings["filter_effect"],
+                quality=settings["quality"],
+                threads=threads,
+            )
+        )
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    return time.perf_counter() - started
+
+
+def run(projects, output_dir, jobs=1, force=False, work_dir=WORK_DIR, report=print):
+    """
+    Render ``projects`` into ``output_dir`` on ``jobs`` threads, skipping
+    those that are up to date unless ``force``. Every render gets an equal
+    share of the cores. Returns a summary dict.
+    """
+    output_dir = os.path.abspath(output_dir)
+    work_dir = os.path.abspath(work_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    names = [project["name"] for project in projects]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ProjectError(f"several projects would render to {duplicates[0]}.mp4")
+
+    state = BuildState(output_dir)
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    summary = {"rendered": [], "skipped": [], "failed": {}}
+    totals = {"images": 0, "video_seconds": 0.0}
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def build(project):
+        output_path = os.path.join(output_dir, f"{project['name']}.mp4")
+        if not force and state.is_current(project, output_path):
+            with lock:
+                summary["skipped"].append(project["name"])
+            report(f"up to date  {project['name']}")
+            return
+        try:
+            seconds = render_project(project, output_path, work_dir, threads)
+            state.record(project, output_path)
+        except Exception as e:
+            logger.exception("Bulk render failed", extra={"project": project["path"]})
+            with lock:
+                summary["failed"][project["name"]] = str(e)
+            report(f"failed      {project['name']}: {e}")
+            return
+        images = len(project["images"])
+        with lock:
+            summary["rendered"].append(project["name"])
+            totals["images"] += images
+            totals["video_seconds"] += images * project["settings"]["duration"]
+        report(f"rendered    {project['name']} ({images} images, {seconds:.1f}s)")
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(build, projects))
+
+    wall = time.perf_counter() - started
+    summary.update(
+        totals,
+        wall_seconds=round(wall, 3),
+        jobs=jobs,
+        threads_per_job=threads,
+        reels_per_minute=round(len(summary["rendered"]) * 60 / wall, 2),
+        images_per_second=round(totals["images"] / wall, 2),
+        realtime_factor=round(totals["video_seconds"] / wall, 2),
+    )
+    return summary
+
+
+def print_summary(summary, out=sys.stdout):
+    out.write(
+        f"\n{len(summary['rendered'])} rendered, {len(summary['skipped'])} up to date, "
+        f"{len(summary['failed'])} failed in {summary['wall_seconds']:.1f}s "
+        f"({summary['jobs']} jobs x {summary['threads_per_job']} threads)\n"
+    )
+    if summary["rendered"]:
+        out.write(
+            f"{summary['reels_per_minute']} reels/min, "
+            f"{summary['images_per_second']} images/s, "
+            f"{summary['realtime_factor']}x realtime\n"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("projects", nargs="*", help="project directories")
+    parser.add_argument("--manifest", help="JSON list of projects")
+    parser.add_argument("-o", "--output-dir", default="renders")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=max(1, (os.cpu_count() or 1) // 4)
+    )
+    parser.add_argument("--force", action="store_true", help="render everything")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--json", help="write the summary as JSON")
+    for key, value in DEFAULT_SETTINGS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, default=value)
+    args = parser.parse_args(argv)
+    if not args.projects and not args.manifest:
+        parser.error("give project directories or --manifest")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    configure_logging()
+    defaults = {key: getattr(args, key) for key in DEFAULT_SETTINGS}
+    try:
+        projects = [load_project(path, defaults) for path in args.projects]
+        if args.manifest:
+            projects += load_manifest(args.manifest, defaults)
+        summary = run(
+            projects, args.output_dir, args.jobs, args.force, work_dir=args.work_dir
+        )
+    except ProjectError as e:
+        parser.exit(2, f"error: {e}\n")
+
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Edits to an existing reel: replace, insert, remove or move images and
+change how long they are shown.
+
+An edit rewrites the reel's upload folder in place: new images are added
+next to the old ones, input.txt and images.json are rewritten in the new
+order and images no longer used are deleted. The reel is then rendered
+again, and the segment cache makes that cost only the changed images.
+"""
+
+import json
+import os
+import re
+
+from batches import MAX_IMAGE_DURATION, MIN_IMAGE_DURATION
+from ingest import UploadRejected, load_image_info, save_image_info
+from render_engine import write_concat_list
+
+EDIT_OPERATIONS = ("replace", "insert", "remove", "move", "duration")
+MAX_EDITS = 100
+
+
+def parse_edits(text):
+    """
+    Read a JSON list of edits, or ``{"edits": [...]}``, as dicts. Each is
+    checked for its shape here; indexes are checked when it is applied.
+    """
+    try:
+        edits = json.loads(text or "") if isinstance(text, str) else text
+    except ValueError:
+        raise UploadRejected("The edits are not valid JSON.")
+    if isinstance(edits, dict):
+        edits = edits.get("edits")
+    if not isinstance(edits, list) or not edits:
+        raise UploadRejected("Please send at least one edit.")
+    if len(edits) > MAX_EDITS:
+        raise UploadRejected(f"At most {MAX_EDITS} edits can be sent at once.", 413)
+    for i, edit in enumerate(edits, start=1):
+        if not isinstance(edit, dict) or edit.get("op") not in EDIT_OPERATIONS:
+            raise UploadRejected(
+                f"Edit {i} needs an op: one of {', '.join(EDIT_OPERATIONS)}."
+            )
+    return edits
+
+
+def _duration(edit, i, default=None):
+    value = edit.get("duration", default)
+    try:
+        duration = float(value)
+    except (TypeError, ValueError):
+        raise UploadRejected(f"Edit {i} has an invalid duration.")
+    if not MIN_IMAGE_DURATION <= duration <= MAX_IMAGE_DURATION:
+        raise UploadRejected(
+            f"Edit {i}: image duration must be between "
+            f"{MIN_IMAGE_DURATION} and {MAX_IMAGE_DURATION} seconds."
+        )
+    return duration
+
+
+def _index(edit, i, key, size):
+    value = edit.get(key)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < size:
+        raise UploadRejected(f"Edit {i} needs a {key} between 0 and {size - 1}.")
+    return value
+
+
+def apply_edits(entries, edits, upload_count):
+    """
+    Apply ``edits`` in order to [(source, duration)] and return the result.
+
+    Existing images are referred to by their position at the time of each
+    edit. ``"upload": n`` names the n-th uploaded image (file1 is 0), and
+    appears in the result as the integer ``n`` until it is stored.
+    """
+    entries = list(entries)
+    for i, edit in enumerate(edits, start=1):
+        op = edit["op"]
+        if op in ("replace", "insert"):
+            if not upload_count:
+                raise UploadRejected(f"Edit {i} needs an uploaded image.")
+            upload = _index(edit, i, "upload", upload_count)
+
+        if op == "insert":
+            index = _index(edit, i, "index", len(entries) + 1)
+            neighbour = entries[min(index, len(entries) - 1)][1] if entries else 1
+            entries.insert(index, (upload, _duration(edit, i, neighbour)))
+        elif op == "duration" and "index" not in edit:
+            duration = _duration(edit, i)
+            entries = [(source, duration) for source, _ in entries]
+        else:
+            index = _index(edit, i, "index", len(entries))
+            source, duration = entries[index]
+            if op == "replace":
+                entries[index] = (upload, _duration(edit, i, duration))
+            elif op == "duration":
+                entries[index] = (source, _duration(edit, i))
+            elif op == "remove":
+                del entries[index]
+            elif op == "move":
+                to = _index(edit, i, "to", len(entries))
+                entries.insert(to, entries.pop(index))
+
+    if not entries:
+        raise UploadRejected("A reel needs at least one image.")
+    return entries
+
+
+def _next_image_number(names):
+    numbers = [
+        int(match.group(1))
+        for match in map(re.compile(r"img_(\d+)\.").match, names)
+        if match
+    ]
+    return max(numbers, default=-1) + 1
+
+
+def stage_edit(target_dir, staging, upload, entries):
+    """
+    Store an edit's uploaded images in ``target_dir`` and rewrite its
+    concat list and images.json for ``entries``. Returns the new entries
+    as [(filename, duration)].
+    """
+    info = {image["name"]: image for image in load_image_info(target_dir)}
+    number = _next_image_number(os.listdir(target_dir))
+    stored = {}
+    for k, name in enumerate(upload["images"]):
+        if not any(source == k for source, _ in entries):
+            continue
+        new_name = f"img_{number:03d}{os.path.splitext(name)[1]}"
+        number += 1
+        os.replace(os.path.join(staging, name), os.path.join(target_dir, new_name))
+        stored[k] = new_name
+        info[new_name] = dict(upload["image_info"][k], name=new_name)
+
+    entries = [
+        (stored[source] if isinstance(source, int) else source, duration)
+        for source, duration in entries
+    ]
+    write_concat_list(os.path.join(target_dir, "input.txt"), entries)
+    save_image_info(target_dir, [info[name] for name, _ in entries if name in info])
+
+    # Images the reel no longer shows are not needed to render it again
+    used = {name for name, _ in entries}
+    for name in os.listdir(target_dir):
+        if name.startswith("img_") and name not in used:
+            os.remove(os.path.join(target_dir, name))
+    return entries
+
+
+def common_duration(entries):
+    """The duration every image is shown for, or None if they differ"""
+    durations = {duration for _, duration in entries}
+    return durations.pop() if len(durations) == 1 else None
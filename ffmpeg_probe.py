@@ -0,0 +1,243 @@
+"""
+One-off probe of the installed FFmpeg build.
+
+The version, encoders and filters are read once per process. Every effect
+in FILTER_EFFECTS, and the text overlay, is then dry-run on a tiny
+synthetic frame, so an effect the build cannot run is hidden from the
+create form instead of failing after the upload. Results are cached in
+``cache/ffmpeg_probe.json`` and reused until the binary or the effect
+registry changes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from render_engine import FILTER_EFFECTS, build_video_filter
+
+FFMPEG_PROBE_CACHE = os.environ.get(
+    "FFMPEG_PROBE_CACHE", os.path.join("cache", "ffmpeg_probe.json")
+)
+PROBE_FRAME = "color=c=gray:s=64x64:d=0.1"
+
+logger = logging.getLogger(__name__)
+
+
+def _run(args, binary="ffmpeg"):
+    return subprocess.run(
+        [binary, "-hide_banner", *args],
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+
+
+def _parse_table(output):
+    """Names from the table printed by ``ffmpeg -encoders`` or ``-filters``"""
+    names = []
+    in_table = False
+    for line in output.splitlines():
+        if line.strip().startswith("---"):
+            in_table = True
+            continue
+        parts = line.split()
+        if in_table and len(parts) >= 2:
+            names.append(parts[1])
+    return sorted(names)
+
+
+def filter_names(vf_string):
+    """Filter names used by a -vf chain, ignoring quoted option values"""
+    names = []
+    quoted = False
+    current = ""
+    for char in vf_string + ",":
+        if char == "'":
+            quoted = not quoted
+        if char == "," and not quoted:
+            name = current.split("=", 1)[0].strip()
+            if name:
+                names.append(name)
+            current = ""
+        else:
+            current += char
+    return names
+
+
+class FFmpegProbe:
+    """Lazily probe FFmpeg once and answer capability questions from memory"""
+
+    def __init__(self, binary="ffmpeg", cache_path=None):
+        self.binary = binary
+        self.cache_path = cache_path or FFMPEG_PROBE_CACHE
+        self._lock = threading.Lock()
+        self._result = None
+
+    def _cache_key(self, path):
+        stat = os.stat(path)
+        registry = json.dumps(FILTER_EFFECTS, sort_keys=True)
+        return hashlib.sha256(
+            f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{registry}".encode("utf-8")
+        ).hexdigest()
+
+    def _load_cached(self, key):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached if cached.get("cache_key") == key else None
+
+    def _save(self, result):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def _dry_run(self, vf_string):
+        """Run ``vf_string`` on one synthetic frame; return an error or None"""
+        result = _run(
+            [
+                "-v",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                PROBE_FRAME,
+                "-vf",
+                vf_string,
+                "-frames:v",
+                "1",
+                "-f",
+                "null",
+                "-",
+            ],
+            self.binary,
+        )
+        if result.returncode == 0:
+            return None
+        lines = result.stderr.strip().splitlines()
+        return lines[-1] if lines else f"return code {result.returncode}"
+
+    def _check_effect(self, name, filters):
+        vf_string = FILTER_EFFECTS[name]
+        missing = [f for f in filter_names(vf_string) if f not in filters]
+        if missing:
+            return {"supported": False, "reason": f"missing filter {missing[0]}"}
+        error = self._dry_run(build_video_filter(64, 64, name))
+        return {"supported": error is None, "reason": error}
+
+    def _probe(self):
+        path = shutil.which(self.binary)
+        if path is None:
+            return {"available": False, "binary": self.binary}
+
+        key = self._cache_key(path)
+        cached = self._load_cached(key)
+        if cached is not None:
+            return cached
+
+        try:
+            version = _run(["-version"], self.binary)
+            encoders = _run(["-encoders"], self.binary)
+            filters = _run(["-filters"], self.binary)
+        except OSError:
+            return {"available": False, "binary": self.binary}
+        if version.returncode != 0:
+            return {"available": False, "binary": self.binary}
+
+        lines = version.stdout.splitlines()
+        first = lines[0].split() if lines else []
+        configuration = next(
+            (
+                line.split(":", 1)[1].strip()
+                for line in lines
+                if line.startswith("configuration:")
+            ),
+            "",
+        )
+        filter_list = _parse_table(filters.stdout)
+        available = set(filter_list)
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            checks = dict(
+                zip(
+                    FILTER_EFFECTS,
+                    pool.map(
+                        lambda name: self._check_effect(name, available),
+                        FILTER_EFFECTS,
+                    ),
+                )
+            )
+            text_error = self._dry_run(build_video_filter(64, 64, "none", "Test"))
+
+        result = {
+            "available": True,
+            "binary": path,
+            "version": first[2] if len(first) > 2 else "",
+            "configuration": configuration,
+            "encoders": _parse_table(encoders.stdout),
+            "filters": filter_list,
+            "effects": checks,
+            "text_overlay": {"supported": text_error is None, "reason": text_error},
+            "probed_at": time.time(),
+            "cache_key": key,
+        }
+        try:
+            self._save(result)
+        except OSError as e:
+            logger.warning("Could not cache the FFmpeg probe", extra={"error": str(e)})
+        return result
+
+    def get(self):
+        """
+        Return the probe result, probing on first use. A missing binary is
+        looked up again each time, which costs no subprocess.
+        """
+        with self._lock:
+            if self._result is None or not self._result["available"]:
+                self._result = self._probe()
+            return self._result
+
+    def refresh(self):
+        with self._lock:
+            self._result = None
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+        return self.get()
+
+    def start(self):
+        """Probe on a background thread so the first request doesn't wait"""
+        thread = threading.Thread(target=self.get, name="ffmpeg-probe", daemon=True)
+        thread.start()
+        return thread
+
+    def available(self):
+        return self.get()["available"]
+
+    def supports_effect(self, name):
+        # "none" and unknown effects render without an effect filter, and
+        # without FFmpeg nothing is known; /create refuses to render then
+        result = self.get()
+        if not FILTER_EFFECTS.get(name) or not result["available"]:
+            return True
+        effect = result["effects"].get(name)
+        return bool(effect and effect["supported"])
+
+    def supports_text_overlay(self):
+        result = self.get()
+        return not result["available"] or result["text_overlay"]["supported"]
+
+    def unsupported_effects(self):
+        return sorted(name for name in FILTER_EFFECTS if not self.supports_effect(name))
+
+
+ffmpeg_probe = FFmpegProbe()
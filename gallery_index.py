@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+GALLERY_INDEX_DB = os.environ.get("GALLERY_INDEX_DB", "gallery_index.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reels (
+    name TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    created_at TEXT NOT NULL,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reels_created_at ON reels (created_at);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO state (key, value) VALUES ('generation', 0);
+"""
+
+
+class GalleryIndex:
+    """
+    Persistent, sorted index of the reels in ``static/reels``.
+
+    Rows hold everything the gallery shows, so a page view is one indexed
+    query instead of a directory scan plus a JSON parse per reel. Every
+    change bumps a generation counter that is used to build ETags.
+    """
+
+    def __init__(self, db_path=None, reels_dir=None, metadata_dir=None):
+        self.db_path = db_path or GALLERY_INDEX_DB
+        self.reels_dir = reels_dir or os.path.join("static", "reels")
+        self.metadata_dir = metadata_dir or os.path.join("static", "metadata")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._reconciled = False
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(
+                self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _bump(self):
+        self._conn.execute(
+            "UPDATE state SET value = value + 1 WHERE key = 'generation'"
+        )
+
+    def _read_info(self, name, stat):
+        info = {
+            "filename": f"{name}.mp4",
+            "name": name,
+            "size": stat.st_size,
+            # Same token as media.reel_version(), used in cacheable URLs
+            "version": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            "created_at": datetime.fromtimestamp(stat.st_ctime).strftime(
+                "%Y-%m-%d %H:%M"
+            ),
+        }
+
+        # Load metadata if exists
+        metadata_path = os.path.join(self.metadata_dir, f"{name}.json")
+        if os.path.exists(metadata_path):
+            try:
+                with open(metadata_path, "r", encoding="utf-8") as f:
+                    info.update(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return info
+
+    def _upsert(self, name, stat, info):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO reels "
+            "(name, filename, size, mtime, created_at, info) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                info["filename"],
+                stat.st_size,
+                stat.st_mtime,
+                str(info.get("created_at", "")),
+                json.dumps(info),
+            ),
+        )
+
+    def add(self, name, metadata=None):
+        """Index (or re-index) ``<reels_dir>/<name>.mp4``"""
+        try:
+            stat = os.stat(os.path.join(self.reels_dir, f"{name}.mp4"))
+        except FileNotFoundError:
+            return self.remove(name)
+
+        info = self._read_info(name, stat)
+        if metadata:
+            info.update(metadata)
+        with self._lock:
+            self._connect()
+            self._upsert(name, stat, info)
+            self._bump()
+        return True
+
+    def remove(self, name):
+        with self._lock:
+            cursor = self._connect().execute(
+                "DELETE FROM reels WHERE name = ?", (name,)
+            )
+            if cursor.rowcount:
+                self._bump()
+        return False
+
+    def reconcile(self):
+        """
+        Bring the index in line with the reels on disk. Only new or changed
+        MP4s have their metadata re-read.
+        """
+        on_disk = {}
+        if os.path.isdir(self.reels_dir):
+            with os.scandir(self.reels_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".mp4") and entry.is_file():
+                        on_disk[entry.name[: -len(".mp4")]] = entry.stat()
+
+        with self._lock:
+            conn = self._connect()
+            indexed = {
+                row["name"]: (row["size"], row["mtime"])
+                for row in conn.execute("SELECT name, size, mtime FROM reels")
+            }
+            conn.execute("BEGIN")
+            changed = 0
+            for name in indexed.keys() - on_disk.keys():
+                conn.execute("DELETE FROM reels WHERE name = ?", (name,))
+                changed += 1
+            for name, stat in on_disk.items():
+                if indexed.get(name) != (stat.st_size, stat.st_mtime):
+                    self._upsert(name, stat, self._read_info(name, stat))
+                    changed += 1
+            if changed:
+                self._bump()
+            conn.execute("COMMIT")
+            self._reconciled = True
+        return changed
+
+    def ensure_reconciled(self):
+        """Reconcile once per process"""
+        if not self._reconciled:
+            self.reconcile()
+
+    def generation(self):
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT value FROM state WHERE key = 'generation'")
+                .fetchone()
+            )
+        return row["value"]
+
+    def count(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM reels").fetchone()[0]
+
+    def page(self, page=1, per_page=24):
+        """Return one page of reels, newest first, and the total count"""
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute("SELECT COUNT(*) FROM reels").fetchone()[0]
+            rows = conn.execute(
+                "SELECT info FROM reels ORDER BY created_at DESC, name "
+                "LIMIT ? OFFSET ?",
+                (per_page, (page - 1) * per_page),
+            ).fetchall()
+        return [json.loads(row["info"]) for row in rows], total
+
+
+gallery_index = GalleryIndex()
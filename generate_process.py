@@ -1,6 +1,28 @@
+import logging
 import os
-import time
-import subprocess
+import sys
+import threading
+
+from gallery_index import gallery_index
+from logs import configure_logging
+from media import HLS_ENABLED, package_hls
+from render_engine import RenderSpec, render
+from render_queue import RenderQueue
+from thumbnails import generate_thumbnails, record_thumbnails
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional, fall back to cheap stat polling
+    FileSystemEventHandler = object
+    Observer = None
+
+UPLOAD_FOLDER = "user_uploads"
+QUEUE_DB = os.environ.get("RENDER_QUEUE_DB", "render_queue.db")
+POLL_INTERVAL = 1.0
+IDLE_TIMEOUT = 30.0
+
+logger = logging.getLogger(__name__)
 
 
 def has_required_assets(folder: str) -> bool:
@@ -9,209 +31,219 @@ def has_required_assets(folder: str) -> bool:
     input_path = os.path.join(base, "input.txt")
 
     if not os.path.exists(audio_path):
-        print(f"Missing audio.mp3 for {folder}")
+        logger.warning("Missing audio.mp3", extra={"folder": folder})
         return False
     if not os.path.exists(input_path):
-        print(f"Missing input.txt for {folder}")
+        logger.warning("Missing input.txt", extra={"folder": folder})
         return False
 
     try:
         with open(input_path, "r", encoding="utf-8") as f:
             content = f.read().strip()
         if "file '" not in content:
-            print(f"input.txt has no image entries for {folder}")
+            logger.warning("input.txt has no image entries", extra={"folder": folder})
             return False
     except Exception as e:
-        print(f"Error reading input.txt for {folder}: {e}")
+        logger.warning(
+            "Error reading input.txt", extra={"folder": folder, "error": str(e)}
+        )
         return False
 
     return True
 
 
-def get_filter_string(filter_effect):
-    """
-    Return FFmpeg filter string based on selected effect
+def read_settings(folder):
     """
-    filters = {
-        # Basic Filters
-        "none": "",
-        "grayscale": "hue=s=0",
-        "sepia": "eq=gamma=1.0:saturation=1.2:contrast=1.0,colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131:0",
-        # Color Adjustments
-        "vibrant": "eq=saturation=1.6:contrast=1.2",
-        "warm": "colorbalance=rs=.3:gs=.1:bs=-.3,eq=saturation=1.1",
-        "cool": "colorbalance=rs=-.3:gs=-.1:bs=.3,eq=saturation=1.1",
-        "vintage": "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131,vignette=angle=PI/3",
-        # Dramatic Filters
-        "noir": "hue=s=0,eq=contrast=1.5:brightness=-0.05",
-        "dramatic": "eq=contrast=1.4:brightness=-0.1:saturation=0.8",
-        "cinematic": "eq=contrast=1.3:brightness=-0.05:saturation=1.1,colorbalance=rs=.1:gs=-.05:bs=.15",
-        # Bright & Light
-        "bright": "eq=brightness=0.1:contrast=1.1:saturation=1.2",
-        "soft": "eq=gamma=1.2:saturation=0.9,gblur=sigma=0.5",
-        "dream": "eq=gamma=1.3:saturation=0.8,gblur=sigma=1",
-        # Instagram-style Filters
-        "nashville": "colorchannelmixer=.6:.4:.15:0:.45:.45:.3:0:.2:.2:.15,eq=contrast=1.2:brightness=0.05",
-        "lofi": "eq=contrast=1.5:saturation=1.2,colorbalance=rs=.2:bs=-.1",
-        "xpro": "eq=contrast=1.3:saturation=1.2,colorbalance=rs=-.1:gs=.05:bs=.2,curves=all='0/0.1 0.5/0.58 1/0.9'",
-        # Modern Filters
-        "fade": "eq=saturation=0.7:contrast=0.9:brightness=0.05",
-        "sharp": "unsharp=5:5:1.0:5:5:0.0,eq=contrast=1.1",
-        "vignette": "vignette=angle=PI/3",
-        "blur_edges": "boxblur=luma_radius=3:luma_power=1,pad=iw:ih:0:0:color=black",
-    }
-
-    return filters.get(filter_effect, "")
-
-
-def create_reel(
-    folder, reel_name=None, text_overlay="", aspect_ratio="9:16", filter_effect="none"
-):
+    Read the customization options saved next to the uploaded assets
     """
-    Create a reel from the given folder with customization options
+    settings = {"text_overlay": "", "aspect_ratio": "9:16", "filter_effect": "none"}
+    settings_path = os.path.join(UPLOAD_FOLDER, folder, "settings.txt")
+
+    if os.path.exists(settings_path):
+        with open(settings_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    if key in settings:
+                        settings[key] = value
+    return settings
+
+
+def is_ready(folder):
+    """Cheap readiness check used before the full has_required_assets()"""
+    base = os.path.join(UPLOAD_FOLDER, folder)
+    if os.path.exists(os.path.join(base, "job.json")):
+        # Rendered by the web app's own job pool
+        return False
+    return os.path.exists(os.path.join(base, "audio.mp3")) and os.path.exists(
+        os.path.join(base, "input.txt")
+    )
+
+
+def offer(queue, folder):
+    """Enqueue a folder once its assets are complete. Returns True when ready."""
+    if not is_ready(folder) or not has_required_assets(folder):
+        return False
+    if queue.enqueue(folder):
+        logger.info("Queued", extra={"folder": folder})
+    return True
+
+
+class UploadEventHandler(FileSystemEventHandler):
+    """Enqueue upload folders as soon as their assets land on disk"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def _handle(self, path):
+        relative = os.path.relpath(path, UPLOAD_FOLDER)
+        folder = relative.split(os.sep, 1)[0]
+        if folder and folder not in (".", ".."):
+            offer(self.queue, folder)
+
+    def on_created(self, event):
+        self._handle(event.src_path)
+
+    def on_moved(self, event):
+        self._handle(event.dest_path)
+
+    def on_closed(self, event):
+        self._handle(event.src_path)
+
+
+def poll_uploads(queue, stop):
     """
-    if reel_name is None:
-        reel_name = folder
-
-    # Get the absolute path to the output file
-    original_dir = os.getcwd()
-    output_dir = os.path.join(original_dir, "static", "reels")
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{reel_name}.mp4")
-
-    # Set dimensions based on aspect ratio
-    if aspect_ratio == "9:16":
-        width, height = 1080, 1920
-    elif aspect_ratio == "16:9":
-        width, height = 1920, 1080
-    elif aspect_ratio == "1:1":
-        width, height = 1080, 1080
-    else:
-        width, height = 1080, 1920
-
-    # Build single filter string (combine all filters)
-    vf_parts = [
-        f"scale={width}:{height}:force_original_aspect_ratio=decrease",
-        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black",
-    ]
-
-    # Add video filter effect
-    filter_string = get_filter_string(filter_effect)
-    if filter_string:
-        vf_parts.append(filter_string)
-
-    # Add text overlay if provided
-    if text_overlay:
-        text_clean = text_overlay.replace("'", "'\\''").replace(":", "\\:")
-        text_filter = f"drawtext=text='{text_clean}':fontsize=60:fontcolor=white:x=(w-text_w)/2:y=h-150:box=1:boxcolor=black@0.5:boxborderw=10"
-        vf_parts.append(text_filter)
-
-    vf_string = ",".join(vf_parts)
-
-    # Build FFmpeg command
-    command = [
-        "ffmpeg",
-        "-y",
-        "-f",
-        "concat",
-        "-safe",
-        "0",
-        "-i",
-        "input.txt",
-        "-i",
-        "audio.mp3",
-        "-vf",
-        vf_string,
-        "-c:v",
-        "libx264",
-        "-c:a",
-        "aac",
-        "-shortest",
-        "-r",
-        "30",
-        "-pix_fmt",
-        "yuv420p",
-        output_path,
-    ]
-
-    # Change to target directory
-    target_dir = os.path.join(original_dir, "user_uploads", folder)
+    Fallback watcher when watchdog is not installed.
 
+    Only stats the upload root and the folders still waiting for assets, so
+    each pass costs O(new folders) instead of re-checking every upload.
+    """
+    root_mtime = None
+    waiting = {}
+
+    while not stop.is_set():
+        try:
+            mtime = os.stat(UPLOAD_FOLDER).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime != root_mtime:
+            root_mtime = mtime
+            known = {job["folder"] for job in queue.list()}
+            for folder in os.listdir(UPLOAD_FOLDER):
+                if folder not in known and folder not in waiting:
+                    waiting[folder] = None
+
+        for folder, folder_mtime in list(waiting.items()):
+            try:
+                current = os.stat(os.path.join(UPLOAD_FOLDER, folder)).st_mtime_ns
+            except FileNotFoundError:
+                del waiting[folder]
+                continue
+            if current != folder_mtime:
+                waiting[folder] = current
+                if offer(queue, folder):
+                    del waiting[folder]
+
+        stop.wait(POLL_INTERVAL)
+
+
+def start_watcher(queue):
+    """Watch user_uploads with watchdog if available, else with a polling thread"""
+    if Observer is not None:
+        observer = Observer()
+        observer.schedule(UploadEventHandler(queue), UPLOAD_FOLDER, recursive=True)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=poll_uploads, args=(queue, stop), name="upload-poller", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def process_job(queue, job):
+    folder = job["folder"]
     try:
-        os.chdir(target_dir)
-
-        result = subprocess.run(
-            command, capture_output=True, text=True, encoding="utf-8", errors="replace"
+        if not has_required_assets(folder):
+            raise Exception("Missing audio.mp3 or input.txt with images")
+        render(
+            RenderSpec.for_folder(
+                folder, folder, upload_folder=UPLOAD_FOLDER, **read_settings(folder)
+            )
+        )
+        try:
+            record_thumbnails(folder, generate_thumbnails(folder))
+        except Exception as e:
+            logger.warning(
+                "Could not create thumbnails", extra={"folder": folder, "error": str(e)}
+            )
+        if HLS_ENABLED:
+            try:
+                record_thumbnails(folder, {"hls": package_hls(folder)})
+            except Exception as e:
+                logger.warning(
+                    "Could not package HLS", extra={"folder": folder, "error": str(e)}
+                )
+        gallery_index.add(folder)
+        queue.complete(folder)
+    except Exception as e:
+        logger.exception("Error creating reel", extra={"folder": folder})
+        status = queue.fail(folder, e)
+        logger.info(
+            "Render failed",
+            extra={"folder": folder, "status": status, "attempts": job["attempts"]},
         )
 
-        if result.returncode != 0:
-            print(f"FFmpeg Error for {folder}:")
-            print("STDOUT:", result.stdout)
-            print("STDERR:", result.stderr)
-            raise Exception(f"FFmpeg failed with return code {result.returncode}")
 
-        print(f"Successfully created reel: {reel_name}")
+def run_worker(queue):
+    queue.recover()
+    queue.import_done_file("done.txt")
+
+    # Pick up anything uploaded while the worker was down
+    for folder in os.listdir(UPLOAD_FOLDER):
+        if queue.get(folder) is None:
+            offer(queue, folder)
 
-    finally:
-        os.chdir(original_dir)
+    start_watcher(queue)
+    logger.info("Render worker ready", extra={"counts": queue.counts()})
+
+    while True:
+        job = queue.claim()
+        if job is None:
+            due_in = queue.next_due_in()
+            timeout = IDLE_TIMEOUT if due_in is None else min(due_in, IDLE_TIMEOUT)
+            queue.wait_for_work(timeout)
+            continue
+        logger.info(
+            "Rendering", extra={"folder": job["folder"], "attempts": job["attempts"]}
+        )
+        process_job(queue, job)
 
 
 if __name__ == "__main__":
     # Create necessary directories
     os.makedirs("static/reels", exist_ok=True)
-
-    while True:
-        print("Processing queue...")
-
-        done_file = "done.txt"
-        if not os.path.exists(done_file):
-            with open(done_file, "w", encoding="utf-8") as f:
-                pass
-
-        with open(done_file, "r", encoding="utf-8") as f:
-            done_folders = f.readlines()
-
-        done_folders = [f.strip() for f in done_folders]
-
-        if not os.path.exists("user_uploads"):
-            os.makedirs("user_uploads", exist_ok=True)
-
-        folders = os.listdir("user_uploads")
-
-        for folder in folders:
-            if folder not in done_folders:
-                if has_required_assets(folder):
-                    try:
-                        # Read settings if available
-                        settings_path = f"user_uploads/{folder}/settings.txt"
-                        text_overlay = ""
-                        aspect_ratio = "9:16"
-                        filter_effect = "none"
-
-                        if os.path.exists(settings_path):
-                            with open(settings_path, "r", encoding="utf-8") as f:
-                                for line in f:
-                                    if "=" in line:
-                                        key, value = line.strip().split("=", 1)
-                                        if key == "text_overlay":
-                                            text_overlay = value
-                                        elif key == "aspect_ratio":
-                                            aspect_ratio = value
-                                        elif key == "filter_effect":
-                                            filter_effect = value
-                        create_reel(
-                            folder, folder, text_overlay, aspect_ratio, filter_effect
-                        )
-                        with open(done_file, "a", encoding="utf-8") as f:
-                            f.write(folder + "\n")
-                    except Exception as e:
-                        print(f"Error creating reel for {folder}: {e}")
-                        import traceback
-
-                        traceback.print_exc()
-                else:
-                    print(
-                        f"Skipping {folder} until audio.mp3 and input.txt with images are available"
-                    )
-
-        time.sleep(4)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    queue = RenderQueue(QUEUE_DB)
+    command = sys.argv[1] if len(sys.argv) > 1 else "work"
+
+    if command == "enqueue":
+        for folder in sys.argv[2:]:
+            print(f"{folder}: {'queued' if queue.enqueue(folder) else 'already known'}")
+    elif command == "retry":
+        for folder in sys.argv[2:]:
+            print(f"{folder}: {'requeued' if queue.requeue(folder) else 'not found'}")
+    elif command == "status":
+        print(queue.counts())
+        for job in queue.list("dead"):
+            print(
+                f"dead: {job['folder']} after {job['attempts']} attempts: {job['last_error']}"
+            )
+    else:
+        configure_logging()
+        run_worker(queue)
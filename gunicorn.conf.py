@@ -0,0 +1,63 @@
+"""
+Gunicorn settings for serving the app:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Render jobs and their queue live in the memory of the process that
+accepted them, so the default is one worker process with a thread per
+concurrent request. Extra workers (WEB_CONCURRENCY) each run their own
+render pool on a share of the cores. They see each other's jobs, progress
+included, through job.json, so a job's event stream can be served by any
+worker.
+"""
+
+import os
+
+cpus = os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+worker_class = "gthread"
+# Uploads stream for as long as the client's link needs and every open
+# /jobs/<id>/events stream holds a thread, but both mostly wait on sockets
+threads = int(os.environ.get("GUNICORN_THREADS", str(min(64, max(8, 4 * cpus)))))
+# With gthread this is the worker heartbeat; requests are not timed out
+timeout = 120
+keepalive = 5
+
+# Import the app, configure it, create its folders and probe FFmpeg once in
+# the master; workers fork with all of it ready
+preload_app = True
+
+# Workers are not recycled by default: their render queue lives in their
+# memory, and a leaving worker only finishes the renders already running,
+# for up to graceful_timeout seconds. Its queued jobs are marked as failed
+max_requests = int(os.environ.get("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "600"))
+
+# Each worker's render pool gets an equal share of the cores
+os.environ.setdefault("RENDER_CPUS", str(max(1, cpus // workers)))
+
+
+def post_worker_init(worker):
+    # Threads started in the master would not exist in the forked workers,
+    # so the log writer and the sweeper start here
+    from main import start_background
+
+    start_background()
+
+
+def worker_exit(server, worker):
+    from main import job_manager
+
+    job_manager.shutdown(wait=True, cancel_queued=True)
+
+
+def child_exit(server, worker):
+    # Runs in the master. A worker killed after graceful_timeout, or one
+    # that crashed, leaves its jobs running in job.json
+    from main import job_manager
+
+    if job_manager is not None:
+        job_manager.recover()
@@ -0,0 +1,152 @@
+"""
+Read an image's format, dimensions and EXIF orientation from the first
+bytes of the file, without decoding any pixels.
+
+``parse_image_header`` is fed the bytes received so far. It returns None
+while it needs more, a dict once the header is complete, and raises
+InvalidImage for anything that is not a well-formed JPEG or PNG header.
+"""
+
+import os
+import struct
+
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(50_000_000)))
+# EXIF blocks with embedded thumbnails can push a JPEG's frame header tens
+# of kilobytes into the file; give up beyond this
+MAX_HEADER_BYTES = 256 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPES = {0: "gray", 2: "rgb", 3: "palette", 4: "gray_alpha", 6: "rgba"}
+JPEG_COLOR_TYPES = {1: "gray", 3: "ycbcr", 4: "cmyk"}
+# Start-of-frame markers; C4, C8 and CC share the range but are not frames
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class InvalidImage(ValueError):
+    """The bytes are not a JPEG or PNG whose header can be read"""
+
+
+def _png_header(head):
+    if len(head) < 26:
+        return None
+    length, chunk = struct.unpack(">I4s", head[8:16])
+    if chunk != b"IHDR" or length != 13:
+        raise InvalidImage("PNG does not start with an IHDR chunk")
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", head[16:26])
+    if color_type not in PNG_COLOR_TYPES or bit_depth not in (1, 2, 4, 8, 16):
+        raise InvalidImage("PNG has an unknown color type or bit depth")
+    return {
+        "format": "png",
+        "width": width,
+        "height": height,
+        "bit_depth": bit_depth,
+        "color_type": PNG_COLOR_TYPES[color_type],
+        "orientation": 1,
+    }
+
+
+def _exif_orientation(segment):
+    """Orientation tag (1-8) from an APP1 segment's payload, or None"""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return None
+    tiff = segment[6:]
+    if tiff[:4] == b"II*\x00":
+        order = "<"
+    elif tiff[:4] == b"MM\x00*":
+        order = ">"
+    else:
+        return None
+    try:
+        (ifd,) = struct.unpack(order + "I", tiff[4:8])
+        (count,) = struct.unpack(order + "H", tiff[ifd : ifd + 2])
+        for i in range(count):
+            entry = tiff[ifd + 2 + 12 * i : ifd + 14 + 12 * i]
+            tag, kind, _, value = struct.unpack(order + "HHI4s", entry)
+            if tag == EXIF_ORIENTATION_TAG and kind == 3:
+                (orientation,) = struct.unpack(order + "H", value[:2])
+                return orientation if 1 <= orientation <= 8 else None
+    except struct.error:
+        return None
+    return None
+
+
+def _jpeg_header(head):
+    orientation = 1
+    pos = 2
+    while True:
+        # Markers may be preceded by any number of 0xFF fill bytes
+        while pos < len(head) and head[pos] == 0xFF:
+            pos += 1
+        if pos >= len(head):
+            return None
+        if head[pos - 1] != 0xFF:
+            raise InvalidImage("JPEG marker expected")
+        marker = head[pos]
+        pos += 1
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImage("JPEG has no frame header before its image data")
+        if pos + 2 > len(head):
+            return None
+        (length,) = struct.unpack(">H", head[pos : pos + 2])
+        if length < 2:
+            raise InvalidImage("JPEG segment has an invalid length")
+        end = pos + length
+        if marker in JPEG_SOF_MARKERS:
+            if end > len(head):
+                return None
+            precision, height, width, components = struct.unpack(
+                ">BHHB", head[pos + 2 : pos + 8]
+            )
+            return {
+                "format": "jpeg",
+                "width": width,
+                "height": height,
+                "bit_depth": precision,
+                "color_type": JPEG_COLOR_TYPES.get(components, "other"),
+                "progressive": marker in (0xC2, 0xC6, 0xCA, 0xCE),
+                "orientation": orientation,
+            }
+        if marker == 0xE1:
+            if end > len(head):
+                return None
+            orientation = _exif_orientation(head[pos + 2 : end]) or orientation
+        pos = end
+
+
+def parse_image_header(head, max_pixels=None):
+    """
+    Parse the header at the start of ``head``. Returns None if more bytes
+    are needed, or {"format", "width", "height", "bit_depth", "color_type",
+    "orientation"}. Raises InvalidImage if the header is malformed, has no
+    size, or the image has more than ``max_pixels`` pixels.
+    """
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    if head.startswith(PNG_SIGNATURE):
+        info = _png_header(head)
+    elif head.startswith(b"\xff\xd8"):
+        info = _jpeg_header(head)
+    elif len(head) >= len(PNG_SIGNATURE):
+        raise InvalidImage("not a JPEG or PNG image")
+    else:
+        info = None
+
+    if info is None:
+        if len(head) >= MAX_HEADER_BYTES:
+            raise InvalidImage("the image header could not be found")
+        return None
+    if not info["width"] or not info["height"]:
+        raise InvalidImage("the image has no size")
+    if info["width"] * info["height"] > max_pixels:
+        raise InvalidImage(
+            f"the image is {info['width']}x{info['height']}; "
+            f"the limit is {max_pixels // 1_000_000} megapixels"
+        )
+    # Orientations 5-8 are stored on their side
+    if info["orientation"] >= 5:
+        info["display_width"], info["display_height"] = info["height"], info["width"]
+    else:
+        info["display_width"], info["display_height"] = info["width"], info["height"]
+    return info
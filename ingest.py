@@ -0,0 +1,415 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+from werkzeug.utils import secure_filename
+
+from imageinfo import InvalidImage, parse_image_header
+
+CHUNK_FOLDER = "upload_chunks"
+READ_SIZE = 64 * 1024
+MAX_FORM_FIELD_SIZE = 64 * 1024
+SNIFF_BYTES = 8
+
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n")
+IMAGE_EXTENSIONS = {"jpeg": ".jpg", "png": ".png"}
+IMAGE_INFO_FILE = "images.json"
+
+
+class UploadRejected(Exception):
+    """An upload was refused while it was being received"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def looks_like_image(head):
+    return head.startswith(IMAGE_SIGNATURES)
+
+
+def looks_like_mp3(head):
+    # Either an ID3 tag or a bare MPEG audio frame sync
+    return head.startswith(b"ID3") or (
+        len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0
+    )
+
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+class _PartWriter:
+    """
+    Write one file part to disk, enforcing its size and type as bytes arrive.
+
+    With ``inspect``, bytes are held in memory until ``inspect(head)``
+    returns the parsed header, so nothing is written for a file that turns
+    out to be unreadable or too large. The header ends up in ``info``.
+    The SHA-256 of what was written is ``sha256()``.
+    """
+
+    def __init__(self, path, max_size, too_large, sniff, bad_type, inspect=None):
+        self.path = path
+        self.max_size = max_size
+        self.too_large = too_large
+        self.sniff = sniff
+        self.bad_type = bad_type
+        self.inspect = inspect
+        self.info = None
+        self.size = 0
+        self.head = b""
+        self.file = None
+        self.digest = hashlib.sha256()
+
+    def _inspect(self):
+        try:
+            self.info = self.inspect(self.head)
+        except InvalidImage as e:
+            raise UploadRejected(f"{self.bad_type[:-1]}: {e}.")
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise UploadRejected(self.too_large, 413)
+        if self.inspect is not None and self.info is None:
+            self.head += data
+            self._inspect()
+            if self.info is None:
+                return
+            data, self.head = self.head, self.head[:SNIFF_BYTES]
+        elif len(self.head) < SNIFF_BYTES:
+            self.head += data[: SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES and not self.sniff(self.head):
+                raise UploadRejected(self.bad_type)
+        if self.file is None:
+            self.file = open(self.path, "wb")
+        self.file.write(data)
+        self.digest.update(data)
+
+    def sha256(self):
+        return self.digest.hexdigest()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        if self.inspect is not None and self.info is None:
+            raise UploadRejected(self.bad_type)
+        if not self.size:
+            return
+        if len(self.head) < SNIFF_BYTES and not self.sniff(self.head):
+            raise UploadRejected(self.bad_type)
+
+
+def receive_upload(
+    request,
+    folder,
+    allowed_extensions,
+    max_file_size,
+    max_audio_size,
+):
+    """
+    Stream a /create form straight into ``folder``.
+
+    File parts are written to disk as they arrive instead of being buffered
+    by Werkzeug and copied again by ``FileStorage.save()``. Each part's size
+    and file signature are checked on the fly, so an oversized or mislabelled
+    file aborts the request at the first offending chunk.
+
+    Returns ``{"form": {...}, "audio": bool, "images": [filenames],
+    "image_info": [...], "digests": {filename: sha256}, "bytes": int}`` with
+    the images renamed to ``img_000.jpg``... in form key order and the
+    number of body bytes read. Files are hashed as they are written. Raises
+    UploadRejected; the caller owns ``folder`` and should remove it then.
+    """
+    mimetype, options = parse_options_header(request.content_type or "")
+    if mimetype != "multipart/form-data" or "boundary" not in options:
+        return {
+            "form": request.form.to_dict(),
+            "audio": False,
+            "images": [],
+            "image_info": [],
+            "digests": {},
+            "bytes": request.content_length or 0,
+        }
+
+    os.makedirs(folder, exist_ok=True)
+    decoder = MultipartDecoder(
+        options["boundary"].encode("latin-1"), max_form_memory_size=MAX_FORM_FIELD_SIZE
+    )
+    form = {}
+    images = []
+    has_audio = False
+    audio_writer = None
+    part = None
+    writer = None
+    field_data = []
+    received = 0
+
+    def start_file(event):
+        nonlocal has_audio, audio_writer
+        filename = secure_filename(event.filename or "")
+        ext = os.path.splitext(filename)[1]
+
+        if event.name == "audio":
+            if not filename:
+                return None
+            if ext.lower() != ".mp3":
+                raise UploadRejected(
+                    "Invalid audio format. Only MP3 files are allowed."
+                )
+            has_audio = True
+            audio_writer = _PartWriter(
+                os.path.join(folder, "audio.mp3"),
+                max_audio_size,
+                f"Audio file is too large. Maximum size is {max_audio_size // (1024*1024)}MB.",
+                looks_like_mp3,
+                "Invalid audio format. Only MP3 files are allowed.",
+            )
+            return audio_writer
+
+        if event.name.startswith("file") and filename:
+            if ext.lower().lstrip(".") not in allowed_extensions:
+                # Unsupported images are skipped, as before
+                return None
+            incoming = f"incoming_{len(images):03d}"
+            writer = _PartWriter(
+                os.path.join(folder, incoming),
+                max_file_size,
+                f"One or more images are too large. Maximum size per image is {max_file_size // (1024*1024)}MB.",
+                looks_like_image,
+                f"{filename} is not a valid JPG or PNG image.",
+                inspect=parse_image_header,
+            )
+            images.append((event.name, incoming, writer))
+            return writer
+        return None
+
+    try:
+        stream = request.stream
+        while True:
+            data = stream.read(READ_SIZE)
+            received += len(data)
+            decoder.receive_data(data or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, Field):
+                    part = event
+                    field_data = []
+                elif isinstance(event, File):
+                    part = event
+                    writer = start_file(event)
+                elif isinstance(event, Data):
+                    if isinstance(part, Field):
+                        field_data.append(event.data)
+                        if sum(map(len, field_data)) > MAX_FORM_FIELD_SIZE:
+                            raise UploadRejected("Form field is too large.", 413)
+                    elif writer is not None:
+                        writer.write(event.data)
+
+                    if not event.more_data:
+                        if isinstance(part, Field):
+                            form.setdefault(
+                                part.name,
+                                b"".join(field_data).decode("utf-8", "replace"),
+                            )
+                        elif writer is not None:
+                            writer.close()
+                            writer = None
+                event = decoder.next_event()
+            if not data or isinstance(event, Epilogue):
+                break
+    finally:
+        if writer is not None and writer.file is not None:
+            writer.file.close()
+
+    # Put images in form key order (file1, file2, ..., file10), named after
+    # the format found in their header rather than the uploaded extension
+    saved = []
+    image_info = []
+    digests = {}
+    for _, incoming, image in sorted(images, key=lambda item: _natural_key(item[0])):
+        ext = IMAGE_EXTENSIONS[image.info["format"]]
+        new_filename = f"img_{len(saved):03d}{ext}"
+        os.replace(os.path.join(folder, incoming), os.path.join(folder, new_filename))
+        saved.append(new_filename)
+        digests[new_filename] = image.sha256()
+        image_info.append(
+            dict(image.info, name=new_filename, bytes=image.size, sha256=image.sha256())
+        )
+    if audio_writer is not None and audio_writer.size:
+        digests["audio.mp3"] = audio_writer.sha256()
+
+    return {
+        "form": form,
+        "audio": has_audio,
+        "images": saved,
+        "image_info": image_info,
+        "digests": digests,
+        "bytes": received,
+    }
+
+
+def save_image_info(folder, image_info):
+    """Keep the headers read while receiving next to the images"""
+    path = os.path.join(folder, IMAGE_INFO_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(image_info, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_image_info(folder):
+    """The image headers saved by ``save_image_info``, or an empty list"""
+    try:
+        with open(os.path.join(folder, IMAGE_INFO_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def move_upload(staging, target):
+    """Move everything received into ``staging`` into ``target``"""
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(staging):
+        os.replace(os.path.join(staging, name), os.path.join(target, name))
+    os.rmdir(staging)
+
+
+class ChunkedUploads:
+    """
+    Resumable uploads sent as a series of PATCH requests.
+
+    Each session is ``<id>.json`` (declared filename and size) plus the
+    bytes received so far in ``<id>.part``. The file size is the resume
+    offset, so an interrupted client asks for it and continues from there.
+    """
+
+    def __init__(self, folder=CHUNK_FOLDER, max_size=50 * 1024 * 1024):
+        self.folder = folder
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Uploads with a chunk being received; guarded by _lock
+        self._receiving = set()
+
+    def _paths(self, upload_id):
+        upload_id = secure_filename(upload_id)
+        base = os.path.join(self.folder, upload_id)
+        return f"{base}.json", f"{base}.part"
+
+    def create(self, filename, size):
+        filename = secure_filename(filename or "")
+        if os.path.splitext(filename)[1].lower() != ".mp3":
+            raise UploadRejected("Invalid audio format. Only MP3 files are allowed.")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadRejected("Upload size must be a positive number of bytes.")
+        if size > self.max_size:
+            raise UploadRejected(
+                f"Audio file is too large. Maximum size is {self.max_size // (1024*1024)}MB.",
+                413,
+            )
+
+        os.makedirs(self.folder, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"filename": filename, "size": size, "created_at": time.time()}, f
+            )
+        open(part_path, "wb").close()
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        meta_path, part_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return {
+            "upload_id": secure_filename(upload_id),
+            "filename": meta["filename"],
+            "size": meta["size"],
+            "offset": offset,
+            "complete": offset == meta["size"],
+        }
+
+    def append(self, upload_id, offset, stream):
+        """
+        Append a chunk that starts at ``offset``. A stale offset, or a chunk
+        sent while another one of the same upload is still arriving, is
+        refused with 409 so the client can resume from the real offset.
+
+        The lock is only held to check and reserve the upload; the chunk is
+        read from the client without it, so a slow upload holds up no other.
+        """
+        upload_id = secure_filename(upload_id)
+        with self._lock:
+            status = self.status(upload_id)
+            if status is None:
+                raise UploadRejected("Upload not found.", 404)
+            if upload_id in self._receiving or offset != status["offset"]:
+                raise UploadRejected("Upload offset does not match.", 409)
+            self._receiving.add(upload_id)
+
+        try:
+            self._receive(upload_id, offset, status["size"] - offset, stream)
+        finally:
+            with self._lock:
+                self._receiving.discard(upload_id)
+        return self.status(upload_id)
+
+    def _receive(self, upload_id, offset, remaining, stream):
+        _, part_path = self._paths(upload_id)
+        head = b""
+        with open(part_path, "ab") as f:
+            while True:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                if len(data) > remaining:
+                    f.truncate(offset)
+                    raise UploadRejected("Chunk goes past the declared size.", 413)
+                if offset == 0 and len(head) < SNIFF_BYTES:
+                    head += data[: SNIFF_BYTES - len(head)]
+                f.write(data)
+                remaining -= len(data)
+
+        if offset == 0 and head and not looks_like_mp3(head):
+            self.discard(upload_id)
+            raise UploadRejected("Invalid audio format. Only MP3 files are allowed.")
+
+    def claim(self, upload_id, destination):
+        """Move a completed upload to ``destination``. Returns False if it is not complete."""
+        with self._lock:
+            status = self.status(upload_id)
+            if (
+                status is None
+                or not status["complete"]
+                or secure_filename(upload_id) in self._receiving
+            ):
+                return False
+            meta_path, part_path = self._paths(upload_id)
+            shutil.move(part_path, destination)
+            os.remove(meta_path)
+        return True
+
+    def discard(self, upload_id):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
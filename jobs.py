@@ -0,0 +1,514 @@
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from metrics import registry
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_FILE = "job.json"
+
+# Lower runs first; jobs of equal priority run in submission order
+PRIORITIES = {"interactive": 0, "normal": 1, "bulk": 2}
+DEFAULT_PRIORITY = "normal"
+
+# Queued jobs beyond this are refused with QueueFull (HTTP 429)
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "32"))
+RETRY_AFTER_MAX = 600
+
+# Progress within a stage is written to job.json at most this often
+PROGRESS_WRITE_SECONDS = 0.5
+# How often a job run by another process is re-read from its job.json
+JOB_POLL_SECONDS = 0.25
+# Error of jobs whose process exited before they finished
+INTERRUPTED = "Interrupted by a server restart"
+
+logger = logging.getLogger(__name__)
+
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "reel_job_queue_wait_seconds", "Time render jobs wait for a worker"
+)
+JOB_SECONDS = registry.histogram(
+    "reel_job_seconds", "Time from a job starting to finishing", ("status",)
+)
+
+
+def claim_folder(folder, job_id):
+    """
+    Write a queued job.json for ``job_id`` into an upload folder before its
+    assets are complete, so the standalone watcher (generate_process.py)
+    never picks up a folder a JobManager is about to render. ``submit``
+    replaces the record.
+    """
+    with open(os.path.join(folder, JOB_FILE), "w", encoding="utf-8") as f:
+        json.dump({"id": job_id, "status": QUEUED, "pid": os.getpid()}, f)
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+class QueueFull(Exception):
+    """The backlog is too deep to accept more work; try again later"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"The render queue is full; retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobManager:
+    """
+    Run render jobs on a bounded pool of worker threads.
+
+    Queued jobs wait in a priority heap, so interactive previews overtake
+    bulk renders. Each worker gets an equal share of the CPU cores as its
+    ``thread_budget``, which jobs pass on to FFmpeg instead of letting every
+    render use every core. Once ``max_queue_depth`` jobs are waiting,
+    ``submit`` raises QueueFull with an estimate of when to retry.
+
+    Each job record is a plain dict kept in memory and mirrored to
+    ``<upload_folder>/<job_id>/job.json``, progress included, so its status
+    can be read after a restart and followed from other server processes.
+    Every change bumps a version counter that ``wait_for_change`` blocks on;
+    jobs of other processes are followed by polling their job.json.
+    Records name the process that owns them (``pid``), so ``recover`` can
+    tell the jobs of a process that has exited.
+    """
+
+    def __init__(
+        self, upload_folder, max_workers=2, max_queue_depth=None, cpu_count=None
+    ):
+        self.upload_folder = upload_folder
+        self.max_workers = max_workers
+        self.max_queue_depth = (
+            MAX_QUEUE_DEPTH if max_queue_depth is None else max_queue_depth
+        )
+        self.thread_budget = max(1, (cpu_count or os.cpu_count() or 1) // max_workers)
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Condition()
+        # Serialises job.json writes; taken before _lock, never inside it
+        self._write_lock = threading.Lock()
+        self._progress_written = {}
+        self._version = 0
+        self._heap = []
+        self._order = itertools.count()
+        self._work = threading.Condition()
+        # Queue slots held by reserve() for jobs about to be submitted
+        self._reserved = 0
+        self._workers = []
+        self._closing = False
+        # Running average of job durations, for Retry-After estimates
+        self._average_seconds = 30.0
+
+    def _start_workers(self):
+        # Started lazily so importing the app never spawns threads
+        if self._workers:
+            return
+        self._closing = False
+        for i in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._work_loop, name=f"render_{i}", daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _work_loop(self):
+        while True:
+            with self._work:
+                self._work.wait_for(lambda: self._heap or self._closing)
+                if not self._heap:
+                    return
+                *_, call = heapq.heappop(self._heap)
+            call()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.upload_folder, job_id, JOB_FILE)
+
+    def _persist(self, job_id):
+        # Writes the record as it is now, so a late writer never puts back
+        # an older state
+        with self._write_lock:
+            with self._lock:
+                job = self._jobs.get(job_id)
+                snapshot = dict(job) if job is not None else None
+            if snapshot is not None:
+                self._write(job_id, snapshot)
+
+    def _write(self, job_id, record):
+        # Called with _write_lock held
+        path = self._job_path(job_id)
+        if not os.path.isdir(os.path.dirname(path)):
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            snapshot = dict(job)
+            self._changed()
+        self._persist(job_id)
+        return snapshot
+
+    def _changed(self):
+        # Called with the lock held
+        self._version += 1
+        self._lock.notify_all()
+
+    def queued_count(self):
+        with self._work:
+            return len(self._heap)
+
+    def retry_after(self):
+        """Seconds until a worker is likely to be free for a new job"""
+        waves = math.ceil((self.queued_count() + 1) / self.max_workers)
+        return max(1, min(RETRY_AFTER_MAX, round(waves * self._average_seconds)))
+
+    def admit(self, count=1):
+        """Raise QueueFull unless ``count`` more jobs fit in the queue"""
+        with self._work:
+            if len(self._heap) + self._reserved + count > self.max_queue_depth:
+                raise QueueFull(self.retry_after())
+
+    def reserve(self, count):
+        """
+        Hold queue room for ``count`` jobs, or raise QueueFull. Each
+        ``submit(..., reserved=True)`` uses one slot; ``release`` hands back
+        the slots left unused.
+        """
+        with self._work:
+            self.admit(count)
+            self._reserved += count
+
+    def release(self, count):
+        with self._work:
+            self._reserved = max(0, self._reserved - count)
+
+    def submit(
+        self,
+        job_id,
+        fn,
+        *args,
+        reel_name=None,
+        batch_id=None,
+        priority=DEFAULT_PRIORITY,
+        reserved=False,
+        **kwargs,
+    ):
+        """
+        Queue ``fn(*args, **kwargs)`` as job ``job_id`` and return its record.
+        ``batch_id`` ties the job to a batch submission and ``priority``
+        names a PRIORITIES entry.
+
+        Submitting a job id that is already queued or running returns the
+        existing record instead of starting a second render. Raises
+        QueueFull when the queue is already max_queue_depth deep, unless
+        ``reserved`` says the job takes a slot held by reserve().
+        """
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing and existing["status"] in (QUEUED, RUNNING):
+                if reserved:
+                    self.release(1)
+                return dict(existing)
+            if not reserved:
+                self.admit()
+
+            job = {
+                "id": job_id,
+                "reel_name": reel_name,
+                "batch_id": batch_id,
+                "priority": priority,
+                "status": QUEUED,
+                "created_at": datetime.now().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+                "metadata": None,
+                "progress": None,
+                "pid": os.getpid(),
+            }
+            self._jobs[job_id] = job
+            snapshot = dict(job)
+            self._changed()
+
+        self._persist(job_id)
+        future = Future()
+        submitted = time.monotonic()
+        with self._lock:
+            self._futures[job_id] = future
+
+        def call():
+            future.set_running_or_notify_cancel()
+            try:
+                self._run(job_id, fn, args, kwargs, submitted)
+            except Exception as e:
+                # Keep the worker alive and let wait() see the error
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+        with self._work:
+            if reserved:
+                self._reserved = max(0, self._reserved - 1)
+            self._start_workers()
+            heapq.heappush(
+                self._heap,
+                (
+                    PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY]),
+                    next(self._order),
+                    job_id,
+                    call,
+                ),
+            )
+            self._work.notify()
+        return snapshot
+
+    def _run(self, job_id, fn, args, kwargs, submitted):
+        started = time.monotonic()
+        QUEUE_WAIT_SECONDS.observe(started - submitted)
+        self._update(job_id, status=RUNNING, started_at=datetime.now().isoformat())
+        try:
+            metadata = fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception("Job failed", extra={"job_id": job_id})
+            self._record_duration(time.monotonic() - started)
+            JOB_SECONDS.observe(time.monotonic() - started, status=FAILED)
+            self._update(
+                job_id,
+                status=FAILED,
+                error=str(e),
+                finished_at=datetime.now().isoformat(),
+            )
+            return
+
+        self._record_duration(time.monotonic() - started)
+        JOB_SECONDS.observe(time.monotonic() - started, status=DONE)
+        self._update(
+            job_id,
+            status=DONE,
+            metadata=metadata,
+            progress={"stage": "done", "fraction": 1.0},
+            finished_at=datetime.now().isoformat(),
+        )
+
+    def _record_duration(self, seconds):
+        with self._work:
+            self._average_seconds += 0.2 * (seconds - self._average_seconds)
+
+    def report_progress(self, job_id, stage, fraction):
+        """
+        Record how far a running job is. A new stage is written to job.json
+        at once, progress within a stage at most every PROGRESS_WRITE_SECONDS.
+        """
+        now = time.monotonic()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != RUNNING:
+                return
+            previous = job["progress"] or {}
+            job["progress"] = {"stage": stage, "fraction": round(fraction, 4)}
+            self._changed()
+            if (
+                previous.get("stage") == stage
+                and now - self._progress_written.get(job_id, 0) < PROGRESS_WRITE_SECONDS
+            ):
+                return
+            self._progress_written[job_id] = now
+        self._persist(job_id)
+
+    def mark_used(self, job_id):
+        """
+        Record in job.json that the job's uploads are being used again, by
+        an edit or a promotion, so their retention counts from now. Jobs
+        known only from job.json are updated there.
+        """
+        now = datetime.now().isoformat()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["last_used_at"] = now
+        if job is not None:
+            self._persist(job_id)
+            return
+        with self._write_lock:
+            try:
+                with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                return
+            record["last_used_at"] = now
+            self._write(job_id, record)
+
+    def recover(self):
+        """
+        Mark as failed every job.json under upload_folder left queued or
+        running by a process that is gone, and return their ids. Their
+        render function is not recorded, so they cannot be run again.
+
+        Run it before this process serves requests: until then, a record
+        naming this process (a reused pid) can only be a stale one.
+        """
+        if not os.path.isdir(self.upload_folder):
+            return []
+        recovered = []
+        for job_id in sorted(os.listdir(self.upload_folder)):
+            with self._lock:
+                if job_id.startswith(".") or job_id in self._jobs:
+                    continue
+            with self._write_lock:
+                try:
+                    with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                        record = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                pid = record.get("pid")
+                if record.get("status") not in (QUEUED, RUNNING) or (
+                    pid != os.getpid() and _process_alive(pid)
+                ):
+                    continue
+                record.update(
+                    status=FAILED,
+                    error=INTERRUPTED,
+                    finished_at=datetime.now().isoformat(),
+                )
+                self._write(job_id, record)
+            recovered.append(job_id)
+        if recovered:
+            logger.warning(
+                "Marked interrupted jobs as failed", extra={"jobs": recovered}
+            )
+        return recovered
+
+    def is_active(self, job_id):
+        """
+        Whether this process has the job queued or running. Unlike get(),
+        a job.json left queued or running by another process does not count.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job is not None and job["status"] in (QUEUED, RUNNING)
+
+    def get(self, job_id):
+        """Return a copy of the job record, falling back to job.json on disk"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def wait_for_change(self, job_id, version=None, timeout=None):
+        """
+        Block until something changed since ``version`` and return the job
+        record and the current version. Returns at once if ``version`` is
+        None. Jobs run by another process are followed through their
+        job.json, whose inode and modification time are then the version.
+        """
+        with self._lock:
+            if job_id not in self._jobs:
+                return self._wait_on_file(job_id, version, timeout)
+            if version is not None:
+                self._lock.wait_for(lambda: self._version != version, timeout)
+            job = self._jobs.get(job_id)
+            version = self._version
+            if job is not None:
+                return dict(job), version
+        return self.get(job_id), version
+
+    def _job_file_version(self, job_id):
+        # job.json is replaced on every write, so a new inode also marks a
+        # change on filesystems with coarse timestamps
+        try:
+            stat = os.stat(self._job_path(job_id))
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _wait_on_file(self, job_id, version, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        current = self._job_file_version(job_id)
+        while version is not None and current == version:
+            wait = JOB_POLL_SECONDS
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    break
+            # Called with the lock held; waiting releases it
+            self._lock.wait(wait)
+            current = self._job_file_version(job_id)
+        return self.get(job_id), current
+
+    def list(self):
+        """Return the jobs known to this process, newest first"""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()]
+        jobs.sort(key=lambda job: job["created_at"], reverse=True)
+        return jobs
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job finishes and return its final record"""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+        return self.get(job_id)
+
+    def shutdown(self, wait=True, cancel_queued=False):
+        """
+        Stop the workers once the queued jobs have run. With
+        ``cancel_queued`` only the running jobs finish, and the queued ones
+        are marked as failed.
+        """
+        with self._work:
+            self._closing = True
+            cancelled = []
+            if cancel_queued:
+                cancelled = [job_id for *_, job_id, _ in self._heap]
+                self._heap = []
+            self._work.notify_all()
+            workers, self._workers = self._workers, []
+        for job_id in cancelled:
+            self._update(
+                job_id,
+                status=FAILED,
+                error=INTERRUPTED,
+                finished_at=datetime.now().isoformat(),
+            )
+            with self._lock:
+                future = self._futures.get(job_id)
+            if future is not None:
+                future.set_result(None)
+        if wait:
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,410 @@
+"""
+Storage lifecycle: retention, quota and garbage collection for upload
+folders and finished reels.
+
+A sweep, run every LIFECYCLE_INTERVAL seconds on a background thread:
+
+* removes upload folders UPLOAD_RETENTION_HOURS after their render
+  finished or they were last edited or promoted (``last_used_at`` in
+  job.json), along with any preview draft;
+* removes staging folders, stale resumable uploads, half-written ``.part``
+  files, upload folders no job knows about and those whose job.json was
+  left queued or running by a process that exited, once they are
+  ORPHAN_MAX_AGE_HOURS old;
+* deletes the least recently served reels while ``static/reels`` is over
+  REELS_QUOTA_BYTES;
+* drops finished render-queue rows and ``done.txt`` lines whose folder is
+  gone;
+* frees stored upload blobs that no folder links to any more.
+
+Sizes count only files with no other hard link, so the reported bytes are
+what the disk actually got back.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sweeps are not coordinated between processes
+    fcntl = None
+
+from ingest import CHUNK_FOLDER
+from metrics import registry
+from render_queue import RenderQueue
+
+UPLOAD_RETENTION_HOURS = float(os.environ.get("UPLOAD_RETENTION_HOURS", "24"))
+ORPHAN_MAX_AGE_HOURS = float(os.environ.get("ORPHAN_MAX_AGE_HOURS", "6"))
+REELS_QUOTA_BYTES = int(os.environ.get("REELS_QUOTA_BYTES", "0"))  # 0 = no quota
+LIFECYCLE_INTERVAL = float(os.environ.get("LIFECYCLE_INTERVAL", "600"))
+QUEUE_DB = os.environ.get("RENDER_QUEUE_DB", "render_queue.db")
+DONE_FILE = "done.txt"
+# Held during a sweep so that only one of several server processes sweeps
+LIFECYCLE_LOCK = os.environ.get(
+    "LIFECYCLE_LOCK", os.path.join("cache", "lifecycle.lock")
+)
+
+# Reels served less than this long ago are not touched again, which keeps
+# the LRU clock to one utime() call per reel per hour
+ACCESS_RESOLUTION = 60 * 60
+
+RECLAIMED_KINDS = ("uploads", "orphans", "reels", "blobs")
+RECLAIMED_BYTES = registry.counter(
+    "reel_storage_reclaimed_bytes_total",
+    "Bytes freed by the storage lifecycle sweep",
+    ("kind",),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def reclaimable_size(path):
+    """Bytes freed by deleting ``path``: files with no other hard link"""
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(root, name)
+            for root, _, files in os.walk(path)
+            for name in files
+        ]
+    total = 0
+    for file_path in paths:
+        try:
+            stat = os.lstat(file_path)
+        except OSError:
+            continue
+        if stat.st_nlink <= 1:
+            total += stat.st_size
+    return total
+
+
+def touch_access(path):
+    """
+    Record that a reel was served by moving its atime forward. The mtime,
+    and with it the reel's URL version, is left alone.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    if time.time() - stat.st_atime > ACCESS_RESOLUTION:
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+
+
+def _age(path, now):
+    try:
+        return now - os.lstat(path).st_mtime
+    except OSError:
+        return 0
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _timestamp(value, default):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+
+@contextlib.contextmanager
+def _exclusive(path):
+    """Yield whether this process got the advisory lock on ``path``"""
+    if path is None or fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class StorageLifecycle:
+    """
+    Periodic clean-up of ``upload_folder`` and ``static_dir``.
+
+    ``is_active(folder)`` tells whether a job of this process is still
+    queued or running for an upload folder. ``remove_reel(name)`` deletes
+    a reel with its metadata, thumbnails and index entries. With
+    ``lock_path``, a sweep is skipped while another process holds the lock.
+    ``blob_store`` is the blobs.BlobStore whose unused blobs are freed.
+    """
+
+    def __init__(
+        self,
+        upload_folder,
+        static_dir="static",
+        is_active=None,
+        remove_reel=None,
+        retention_hours=None,
+        orphan_hours=None,
+        quota_bytes=None,
+        chunk_folder=CHUNK_FOLDER,
+        queue_db=QUEUE_DB,
+        done_file=DONE_FILE,
+        lock_path=None,
+        blob_store=None,
+    ):
+        self.upload_folder = upload_folder
+        self.static_dir = static_dir
+        self.is_active = is_active or (lambda folder: False)
+        self.remove_reel = remove_reel
+        self.retention = 3600 * (
+            UPLOAD_RETENTION_HOURS if retention_hours is None else retention_hours
+        )
+        self.orphan_age = 3600 * (
+            ORPHAN_MAX_AGE_HOURS if orphan_hours is None else orphan_hours
+        )
+        self.quota_bytes = REELS_QUOTA_BYTES if quota_bytes is None else quota_bytes
+        self.chunk_folder = chunk_folder
+        self.queue_db = queue_db
+        self.done_file = done_file
+        self.lock_path = lock_path
+        self.blob_store = blob_store
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _queue(self):
+        # The standalone worker's queue, if it has ever run here
+        return RenderQueue(self.queue_db) if os.path.exists(self.queue_db) else None
+
+    def _remove(self, path, kind, report):
+        size = reclaimable_size(path)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        report[kind] = report.get(kind, 0) + size
+        logger.info("Removed", extra={"path": path, "kind": kind, "bytes": size})
+
+    def _folder_finished_at(self, name, path, queue, now):
+        """
+        When the folder's last render finished or it was last used since,
+        None while a render may still be running, or "unknown" if no job or
+        batch refers to it
+        """
+        if self.is_active(name):
+            return None
+
+        job = _read_json(os.path.join(path, "job.json"))
+        if job is not None:
+            if job.get("status") in ("done", "failed"):
+                return max(
+                    _timestamp(job.get("finished_at"), now),
+                    _timestamp(job.get("last_used_at"), 0),
+                )
+            # Left queued or running by a process that has since exited
+            mtime = os.path.getmtime(os.path.join(path, "job.json"))
+            return mtime if now - mtime > self.orphan_age else None
+
+        if os.path.exists(os.path.join(path, "batch.json")):
+            batch = _read_json(os.path.join(path, "batch.json")) or {}
+            variants = [v.get("job_id", "") for v in batch.get("variants", [])]
+            if any(
+                os.path.exists(os.path.join(self.upload_folder, job_id))
+                for job_id in variants
+            ):
+                return None
+            return os.path.getmtime(os.path.join(path, "batch.json"))
+
+        row = queue.get(name) if queue is not None else None
+        if row is not None:
+            return row["updated_at"] if row["status"] in ("done", "dead") else None
+        return "unknown"
+
+    def expire_uploads(self, report, now=None):
+        """Remove finished upload folders past retention and orphaned ones"""
+        now = now or time.time()
+        if not os.path.isdir(self.upload_folder):
+            return
+        queue = self._queue()
+        try:
+            for name in sorted(os.listdir(self.upload_folder)):
+                path = os.path.join(self.upload_folder, name)
+                if not os.path.isdir(path):
+                    continue
+                if name.startswith("."):
+                    # Staging folder of a request that never finished
+                    if _age(path, now) > self.orphan_age:
+                        self._remove(path, "orphans", report)
+                    continue
+
+                finished_at = self._folder_finished_at(name, path, queue, now)
+                if finished_at == "unknown":
+                    if _age(path, now) > self.orphan_age:
+                        self._remove(path, "orphans", report)
+                elif finished_at is not None and now - finished_at > self.retention:
+                    self._remove(path, "uploads", report)
+                    draft = os.path.join(self.static_dir, "drafts", f"{name}.mp4")
+                    if os.path.exists(draft):
+                        self._remove(draft, "uploads", report)
+        finally:
+            if queue is not None:
+                queue.close()
+
+    def sweep_orphans(self, report, now=None):
+        """Remove stale resumable uploads and half-written output files"""
+        now = now or time.time()
+        candidates = []
+        if os.path.isdir(self.chunk_folder):
+            candidates += [
+                os.path.join(self.chunk_folder, name)
+                for name in os.listdir(self.chunk_folder)
+            ]
+        for subdir in ("reels", "drafts", "posters", "previews", "hls"):
+            folder = os.path.join(self.static_dir, subdir)
+            if os.path.isdir(folder):
+                candidates += [
+                    os.path.join(folder, name)
+                    for name in os.listdir(folder)
+                    if name.endswith(".part") or ".tmp-" in name or ".old-" in name
+                ]
+        for path in candidates:
+            if _age(path, now) > self.orphan_age:
+                self._remove(path, "orphans", report)
+
+    def _reel_files(self, name):
+        files = [
+            os.path.join(self.static_dir, "reels", f"{name}.mp4"),
+            os.path.join(self.static_dir, "posters", f"{name}.jpg"),
+            os.path.join(self.static_dir, "previews", f"{name}.mp4"),
+            os.path.join(self.static_dir, "hls", name),
+        ]
+        return [path for path in files if os.path.exists(path)]
+
+    def enforce_quota(self, report):
+        """Delete the least recently served reels until under quota_bytes"""
+        reels_dir = os.path.join(self.static_dir, "reels")
+        if not self.quota_bytes or not os.path.isdir(reels_dir):
+            return
+
+        reels = []
+        usage = 0
+        seen = set()
+        for entry in os.scandir(reels_dir):
+            if not entry.name.endswith(".mp4") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                usage += stat.st_size
+            reels.append(
+                (max(stat.st_atime, stat.st_mtime), entry.name[: -len(".mp4")])
+            )
+
+        for _, name in sorted(reels):
+            if usage <= self.quota_bytes:
+                break
+            reel_path = os.path.join(reels_dir, f"{name}.mp4")
+            usage -= reclaimable_size(reel_path)
+            freed = sum(reclaimable_size(path) for path in self._reel_files(name))
+            if self.remove_reel is not None:
+                self.remove_reel(name)
+            else:
+                for path in self._reel_files(name):
+                    self._remove(path, "reels", {})
+            report["reels"] = report.get("reels", 0) + freed
+            logger.info("Evicted reel over quota", extra={"reel": name, "bytes": freed})
+
+    def compact_records(self, report):
+        """Forget processed jobs whose upload folder no longer exists"""
+
+        def gone(folder):
+            return not os.path.exists(os.path.join(self.upload_folder, folder))
+
+        queue = self._queue()
+        if queue is not None:
+            try:
+                report["queue_rows"] = queue.compact(gone)
+            finally:
+                queue.close()
+
+        if os.path.exists(self.done_file):
+            with open(self.done_file, "r", encoding="utf-8") as f:
+                lines = [line.strip() for line in f if line.strip()]
+            kept = [line for line in lines if not gone(line)]
+            if len(kept) != len(lines):
+                tmp_path = f"{self.done_file}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(f"{line}\n" for line in kept)
+                os.replace(tmp_path, self.done_file)
+            report["done_lines"] = len(lines) - len(kept)
+
+    def collect_blobs(self, report):
+        """Free the blobs of uploads removed by this or earlier sweeps"""
+        if self.blob_store is not None:
+            report["blobs"] = self.blob_store.collect()
+
+    def sweep(self):
+        """
+        Run every clean-up step once and return bytes reclaimed by kind, or
+        None if another process is sweeping
+        """
+        with self._lock, _exclusive(self.lock_path) as acquired:
+            if not acquired:
+                logger.debug("Another process is sweeping storage")
+                return None
+            started = time.perf_counter()
+            report = {}
+            for step in (
+                self.expire_uploads,
+                self.sweep_orphans,
+                self.enforce_quota,
+                self.compact_records,
+                self.collect_blobs,
+            ):
+                try:
+                    step(report)
+                except Exception:
+                    logger.exception("Storage sweep step failed")
+
+            for kind in RECLAIMED_KINDS:
+                if report.get(kind):
+                    RECLAIMED_BYTES.inc(report[kind], kind=kind)
+            report["reclaimed_bytes"] = sum(
+                report.get(kind, 0) for kind in RECLAIMED_KINDS
+            )
+            report["seconds"] = round(time.perf_counter() - started, 3)
+            report["finished_at"] = datetime.now().isoformat()
+            self.last_report = report
+        logger.info("Storage sweep finished", extra=report)
+        return report
+
+    def _loop(self, interval):
+        while True:
+            self.sweep()
+            if self._stop.wait(interval):
+                return
+
+    def start(self, interval=LIFECYCLE_INTERVAL):
+        """Sweep now and then every ``interval`` seconds on a daemon thread"""
+        if self._thread is None and interval > 0:
+            self._thread = threading.Thread(
+                target=self._loop, args=(interval,), name="lifecycle", daemon=True
+            )
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
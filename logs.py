@@ -0,0 +1,81 @@
+"""
+Structured, non-blocking logging.
+
+Records are put on an in-memory queue by the thread that logs them and
+written by a single background listener, so a slow stderr or disk never
+stalls a request or a render. Output is one JSON object per line by
+default; set LOG_FORMAT=text for plain lines while developing.
+
+Fields passed with ``extra={...}`` become keys of the JSON object.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# Attributes every LogRecord has; anything else came from ``extra``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_lock = threading.Lock()
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Route the root logger through a queue to one writer thread. Safe to
+    call more than once; only the first call installs the handlers.
+
+    The writer is a thread, so a server that forks calls this in each
+    worker after the fork, never in the master before it.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return _listener
+
+        handler = logging.StreamHandler(stream or sys.stderr)
+        if (fmt or LOG_FORMAT) == "json":
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(
+                logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+            )
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(
+            log_queue, handler, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _listener
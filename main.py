@@ -1,475 +1,1234 @@
-from flask import Flask, render_template, request, jsonify
+from flask import (
+    Blueprint,
+    Flask,
+    Response,
+    current_app,
+    g,
+    render_template,
+    request,
+    jsonify,
+    make_response,
+    stream_with_context,
+)
+import functools
+import logging
+import math
+import time
 import uuid
 from werkzeug.utils import secure_filename
 import os
-import subprocess
 import json
+import shutil
 from datetime import datetime
 
+from audio import audio_info
+from blobs import blob_store
+from batches import (
+    MAX_IMAGE_DURATION,
+    MIN_IMAGE_DURATION,
+    load_batch,
+    new_batch,
+    parse_manifest,
+    save_batch,
+    schedule_order,
+    stage_variant,
+    summarize,
+)
+from edits import apply_edits, common_duration, parse_edits, stage_edit
+from ffmpeg_probe import ffmpeg_probe
+from gallery_index import gallery_index
+from ingest import (
+    ChunkedUploads,
+    UploadRejected,
+    load_image_info,
+    move_upload,
+    receive_upload,
+    save_image_info,
+)
+from jobs import QUEUED, RUNNING, JobManager, QueueFull, claim_folder
+from lifecycle import LIFECYCLE_LOCK, StorageLifecycle, touch_access
+from logs import configure_logging
+from media import HLS_ENABLED, package_hls, remove_hls, reuse_hls, send_reel
+from metrics import DISK_USAGE_TTL, cached, directory_size, registry
+from precompose import file_digest
+from profiling import RENDER_PROFILING, ProfileCache, RenderStats
+from render_cache import render_cache, render_fingerprint
+from render_engine import (
+    DEFAULT_QUALITY,
+    INCREMENTAL_RENDER,
+    QUALITY_PROFILES,
+    create_reel,
+    get_filter_string,
+    parse_concat_list,
+)
+from thumbnails import generate_thumbnails, remove_thumbnails, reuse_thumbnails
+
 UPLOAD_FOLDER = "user_uploads"
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB for images
 MAX_AUDIO_SIZE = 50 * 1024 * 1024  # 50MB for audio
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+# Cores this process's renders may use; gunicorn.conf.py splits them
+# between worker processes
+RENDER_CPUS = int(os.environ.get("RENDER_CPUS", "0")) or None
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB per resumable upload request
+JOB_EVENTS_HEARTBEAT = 15
+GALLERY_PAGE_SIZE = 24
+GALLERY_MAX_PAGE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+HTTP_SECONDS = registry.histogram(
+    "reel_http_request_seconds",
+    "Time to build each HTTP response",
+    ("endpoint", "method", "status"),
+)
+UPLOAD_BYTES = registry.counter(
+    "reel_upload_bytes_total", "Request body bytes received", ("kind",)
+)
+UPLOAD_SECONDS = registry.histogram(
+    "reel_upload_seconds", "Time to receive a /create upload"
+)
+VALIDATION_SECONDS = registry.histogram(
+    "reel_validation_seconds",
+    "Time to validate and stage a received /create form",
+    ("outcome",),
+)
+METADATA_WRITE_SECONDS = registry.histogram(
+    "reel_metadata_write_seconds", "Time to write reel metadata and index it"
+)
+GALLERY_RENDER_SECONDS = registry.histogram(
+    "reel_gallery_render_seconds", "Time to build a gallery page", ("view",)
+)
+
+
+def env_config():
+    """App settings that can be overridden from the environment"""
+    return {
+        "UPLOAD_FOLDER": UPLOAD_FOLDER,
+        "MAX_CONTENT_LENGTH": int(
+            os.environ.get("MAX_CONTENT_LENGTH", str(100 * 1024 * 1024))  # 100MB
+        ),
+        # Let a front server such as nginx send reel files
+        "USE_X_SENDFILE": os.environ.get("USE_X_SENDFILE", "0") == "1",
+    }
+
 
-app = Flask(__name__)
-app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
-app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100MB total
+views = Blueprint("reels", __name__)
+
+GALLERY_TEMPLATE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "templates", "gallery.html"
+)
+
+# Built by create_app() for its UPLOAD_FOLDER; a process serves one app
+job_manager = None
+lifecycle = None
+chunked_uploads = ChunkedUploads(max_size=MAX_AUDIO_SIZE)
+profile_cache = ProfileCache(os.path.join("static", "metadata"))
 
 
 def check_ffmpeg():
-    """Check if FFmpeg is installed"""
-    try:
-        subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    """Check if FFmpeg is installed, from the cached startup probe"""
+    return ffmpeg_probe.available()
+
+
+def unsupported_option(filter_effect, text_overlay):
+    """Error message for an option the installed FFmpeg cannot render, or None"""
+    if not ffmpeg_probe.supports_effect(filter_effect):
+        return f"The '{filter_effect}' filter is not available on this server. Please choose another one."
+    if text_overlay and not ffmpeg_probe.supports_text_overlay():
+        return "Text overlays are not available on this server."
+    return None
+
+
+@views.app_context_processor
+def inject_capabilities():
+    # Lets the create form hide options the installed FFmpeg cannot render
+    if request.endpoint != "reels.create":
+        return {}
+    return {
+        "unsupported_effects": ffmpeg_probe.unsupported_effects(),
+        "text_overlay_supported": ffmpeg_probe.supports_text_overlay(),
+    }
+
+
+@views.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@views.after_app_request
+def record_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        HTTP_SECONDS.observe(
+            time.perf_counter() - started,
+            # Labelled without the blueprint, as before it existed
+            endpoint=(request.endpoint or "unknown").rpartition(".")[2],
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
 
 
-@app.route("/")
+@views.route("/")
 def home():
     return render_template("index.html")
 
 
-@app.route("/create", methods=["GET", "POST"])
+@views.route("/create", methods=["GET", "POST"])
 def create():
     myid = uuid.uuid1()
     if request.method == "POST":
-        print("=== Starting Reel Creation ===")
-        print("Form data:", request.form)
-        print("Files:", list(request.files.keys()))
+        # Stream the files into a staging folder. It is moved into place once
+        # the form is valid and removed otherwise, so rejected requests don't
+        # leave folders behind.
+        staging = os.path.join(current_app.config["UPLOAD_FOLDER"], f".incoming-{myid}")
+        try:
+            with UPLOAD_SECONDS.time():
+                upload = receive_upload(
+                    request, staging, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, MAX_AUDIO_SIZE
+                )
+            UPLOAD_BYTES.inc(upload["bytes"], kind="form")
+
+            started = time.perf_counter()
+            response = create_from_upload(myid, staging, upload)
+            queued = isinstance(response, tuple) and response[1] == 202
+            outcome = "queued" if queued else "rejected"
+            VALIDATION_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+            return response
+        except UploadRejected as e:
+            logger.info(
+                "Upload rejected", extra={"reason": e.message, "status": e.status}
+            )
+            return render_template("create.html", myid=myid, error=e.message)
+        except QueueFull as e:
+            return (
+                render_template(
+                    "create.html",
+                    myid=myid,
+                    error=f"The server is busy. Please try again in {e.retry_after} seconds.",
+                ),
+                429,
+                {"Retry-After": str(e.retry_after)},
+            )
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    return render_template("create.html", myid=myid)
 
-        rec_id = request.form.get("uuid")
-        reel_name = request.form.get("reel_name", "").strip()
 
-        # Get customization options
-        image_duration = request.form.get("image_duration", "1")
-        text_overlay = request.form.get("text_overlay", "").strip()
-        aspect_ratio = request.form.get("aspect_ratio", "9:16")
-        filter_effect = request.form.get("filter_effect", "none")
+def create_from_upload(myid, staging, upload):
+    """
+    Validate a received /create form and queue its render
+    """
+    form = upload["form"]
+    logger.info(
+        "Upload received",
+        extra={
+            "images": len(upload["images"]),
+            "audio": upload["audio"],
+            "upload_bytes": upload["bytes"],
+        },
+    )
+
+    # The upload folder doubles as the job id, so only accept real UUIDs
+    try:
+        rec_id = str(uuid.UUID(form.get("uuid", "")))
+    except ValueError:
+        rec_id = str(myid)
+    reel_name = form.get("reel_name", "").strip()
+
+    # Get customization options
+    image_duration = form.get("image_duration", "1")
+    text_overlay = form.get("text_overlay", "").strip()
+    aspect_ratio = form.get("aspect_ratio", "9:16")
+    filter_effect = form.get("filter_effect", "none")
+    quality = form.get("quality", DEFAULT_QUALITY)
+    if quality not in QUALITY_PROFILES:
+        quality = DEFAULT_QUALITY
+
+    # Validate reel name
+    if not reel_name:
+        return render_template(
+            "create.html", myid=myid, error="Please provide a name for your reel."
+        )
 
-        input_files = []
+    # Sanitize reel name
+    reel_name = secure_filename(reel_name)
+    if not reel_name:
+        return render_template(
+            "create.html",
+            myid=myid,
+            error="Invalid reel name. Please use only letters, numbers, and underscores.",
+        )
 
-        # Validate reel name
-        if not reel_name:
+    # Validate image duration
+    try:
+        duration = float(image_duration)
+        if duration < MIN_IMAGE_DURATION or duration > MAX_IMAGE_DURATION:
             return render_template(
-                "create.html", myid=myid, error="Please provide a name for your reel."
+                "create.html",
+                myid=myid,
+                error="Image duration must be between 0.5 and 10 seconds.",
             )
+    except ValueError:
+        return render_template(
+            "create.html", myid=myid, error="Invalid image duration value."
+        )
 
-        # Sanitize reel name
-        reel_name = secure_filename(reel_name)
-        if not reel_name:
+    # Check if FFmpeg is installed
+    if not check_ffmpeg():
+        return render_template(
+            "create.html",
+            myid=myid,
+            error="FFmpeg is not installed. Please install FFmpeg to create reels.",
+        )
+    error = unsupported_option(filter_effect, text_overlay)
+    if error:
+        return render_template("create.html", myid=myid, error=error)
+
+    # Audio either came with the form or was sent earlier as a resumable upload
+    has_audio = upload["audio"]
+    audio_upload_id = form.get("audio_upload_id")
+    if not has_audio and audio_upload_id:
+        os.makedirs(staging, exist_ok=True)
+        has_audio = chunked_uploads.claim(
+            audio_upload_id, os.path.join(staging, "audio.mp3")
+        )
+        if not has_audio:
             return render_template(
                 "create.html",
                 myid=myid,
-                error="Invalid reel name. Please use only letters, numbers, and underscores.",
+                error="The audio upload is not complete. Please try again.",
             )
+    if not has_audio:
+        return render_template(
+            "create.html", myid=myid, error="Please upload an audio file."
+        )
 
-        # Validate image duration
-        try:
-            duration = float(image_duration)
-            if duration < 0.5 or duration > 10:
-                return render_template(
-                    "create.html",
-                    myid=myid,
-                    error="Image duration must be between 0.5 and 10 seconds.",
-                )
-        except ValueError:
-            return render_template(
-                "create.html", myid=myid, error="Invalid image duration value."
-            )
+    input_files = upload["images"]
+    if not input_files:
+        return render_template(
+            "create.html",
+            myid=myid,
+            error="Please upload at least one image (JPG, JPEG, or PNG).",
+        )
 
-        # Check if FFmpeg is installed
-        if not check_ffmpeg():
-            return render_template(
+    # Refuse before anything is stored when the backlog is already full
+    job_manager.admit()
+    target_folder = os.path.join(current_app.config["UPLOAD_FOLDER"], rec_id)
+    try:
+        # Creating the folder takes the id, so a repeated submit or a reused
+        # uuid never overwrites the uploads of another job
+        os.mkdir(target_folder)
+    except FileExistsError:
+        return (
+            render_template(
                 "create.html",
                 myid=myid,
-                error="FFmpeg is not installed. Please install FFmpeg to create reels.",
-            )
+                error="This reel was already submitted. Reload the page to create another one.",
+            ),
+            409,
+        )
+    # Claimed before input.txt exists, so generate_process.py never sees a
+    # complete folder that is not marked as ours
+    claim_folder(target_folder, rec_id)
+    save_image_info(staging, upload["image_info"])
+    digests = dict(upload["digests"])
+    if "audio.mp3" not in digests:
+        # Sent as a resumable upload, so it is hashed once here
+        digests["audio.mp3"] = file_digest(os.path.join(staging, "audio.mp3"))
+    blob_store.adopt(staging, digests)
+    move_upload(staging, target_folder)
+
+    # Create input.txt for FFmpeg concat
+    input_txt_path = os.path.join(target_folder, "input.txt")
+    with open(input_txt_path, "w", encoding="utf-8") as f:
+        for fl in input_files:
+            f.write(f"file '{fl}'\n")
+            f.write(f"duration {duration}\n")
+        # Add the last file again without duration
+        f.write(f"file '{input_files[-1]}'\n")
+
+    logger.info("Assets staged", extra={"job_id": rec_id, "images": len(input_files)})
+
+    # Save customization settings
+    write_settings(target_folder, text_overlay, aspect_ratio, filter_effect)
+
+    # Ensure reels directory exists
+    reels_dir = os.path.join("static", "reels")
+    if not os.path.exists(reels_dir):
+        os.makedirs(reels_dir, exist_ok=True)
 
-        target_folder = os.path.join(app.config["UPLOAD_FOLDER"], str(rec_id))
-        if not os.path.exists(target_folder):
-            os.makedirs(target_folder, exist_ok=True)
+    # Create metadata file for gallery
+    metadata_dir = os.path.join("static", "metadata")
+    if not os.path.exists(metadata_dir):
+        os.makedirs(metadata_dir, exist_ok=True)
 
-        # Process audio file
-        audio_file = request.files.get("audio")
-        has_audio = False
-        if audio_file and audio_file.filename:
-            audio_file.seek(0, os.SEEK_END)
-            audio_size = audio_file.tell()
-            audio_file.seek(0)
+    # Queue the render and return straight away
+    if not has_required_assets(rec_id):
+        shutil.rmtree(target_folder, ignore_errors=True)
+        return render_template(
+            "create.html",
+            myid=myid,
+            error="Missing required assets for reel creation.",
+        )
 
-            if audio_size > MAX_AUDIO_SIZE:
-                return render_template(
-                    "create.html",
-                    myid=myid,
-                    error=f"Audio file is too large. Maximum size is {MAX_AUDIO_SIZE // (1024*1024)}MB.",
-                )
+    try:
+        job = job_manager.submit(
+            rec_id,
+            render_preview_job if quality == "preview" else render_job,
+            rec_id,
+            reel_name,
+            text_overlay,
+            aspect_ratio,
+            filter_effect,
+            len(input_files),
+            duration,
+            reel_name=reel_name,
+            # Someone is waiting on a preview; let it overtake full renders
+            priority="interactive" if quality == "preview" else "normal",
+            progress=functools.partial(job_manager.report_progress, rec_id),
+            threads=job_manager.thread_budget,
+            upload_folder=current_app.config["UPLOAD_FOLDER"],
+        )
+    except QueueFull:
+        shutil.rmtree(target_folder, ignore_errors=True)
+        raise
+    if quality == "preview":
+        success = f"A quick preview of '{reel_name}' is on its way. You can render it in full quality once you like it."
+    else:
+        success = f"Reel '{reel_name}' is queued for rendering with {len(input_files)} images. You can follow its progress below."
+    return (
+        render_template(
+            "create.html",
+            myid=myid,
+            job_id=job["id"],
+            success=success,
+        ),
+        202,
+    )
+
+
+@views.route("/batches", methods=["POST"])
+def create_batch():
+    """
+    Upload one set of images and audio with a ``manifest`` of variants and
+    queue a render for each. The files are stored once and shared.
+    """
+    batch_id = str(uuid.uuid4())
+    staging = os.path.join(current_app.config["UPLOAD_FOLDER"], f".incoming-{batch_id}")
+    try:
+        with UPLOAD_SECONDS.time():
+            upload = receive_upload(
+                request, staging, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, MAX_AUDIO_SIZE
+            )
+        UPLOAD_BYTES.inc(upload["bytes"], kind="batch")
 
-            audio_filename = secure_filename(audio_file.filename)
-            audio_ext = os.path.splitext(audio_filename)[1].lower()
-            if audio_ext == ".mp3":
-                audio_path = os.path.join(target_folder, "audio.mp3")
-                audio_file.save(audio_path)
-                has_audio = True
-                print(f"Saved audio.mp3 at {audio_path}")
-            else:
-                return render_template(
-                    "create.html",
-                    myid=myid,
-                    error="Invalid audio format. Only MP3 files are allowed.",
-                )
-        else:
-            return render_template(
-                "create.html", myid=myid, error="Please upload an audio file."
+        variants = parse_manifest(upload["form"].get("manifest"))
+        if not check_ffmpeg():
+            raise UploadRejected("FFmpeg is not installed on this server.", 503)
+        for variant in variants:
+            error = unsupported_option(
+                variant["filter_effect"], variant["text_overlay"]
+            )
+            if error:
+                raise UploadRejected(f"{variant['reel_name']}: {error}")
+        if not upload["audio"]:
+            raise UploadRejected("Please upload an audio file.")
+        if not upload["images"]:
+            raise UploadRejected(
+                "Please upload at least one image (JPG, JPEG, or PNG)."
             )
+        # Held for the whole batch, so it is queued entirely or not at all
+        job_manager.reserve(len(variants))
+    except UploadRejected as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        return jsonify({"success": False, "message": e.message}), e.status
+    except QueueFull as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        return busy_response(e)
+
+    batch_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], batch_id)
+    batch = new_batch(batch_id, upload["images"], schedule_order(variants))
+    unsubmitted = len(batch["variants"])
+    try:
+        save_image_info(staging, upload["image_info"])
+        blob_store.adopt(staging, upload["digests"])
+        move_upload(staging, batch_dir)
+        save_batch(batch_dir, batch)
+        os.makedirs(os.path.join("static", "reels"), exist_ok=True)
+        os.makedirs(os.path.join("static", "metadata"), exist_ok=True)
+
+        for variant in batch["variants"]:
+            job_id = variant["job_id"]
+            variant_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], job_id)
+            stage_variant(batch_dir, variant_dir, upload["images"], variant)
+            write_settings(
+                variant_dir,
+                variant["text_overlay"],
+                variant["aspect_ratio"],
+                variant["filter_effect"],
+            )
+            job_manager.submit(
+                job_id,
+                render_job,
+                job_id,
+                variant["reel_name"],
+                variant["text_overlay"],
+                variant["aspect_ratio"],
+                variant["filter_effect"],
+                len(upload["images"]),
+                variant["duration"],
+                reel_name=variant["reel_name"],
+                batch_id=batch_id,
+                priority="bulk",
+                reserved=True,
+                progress=functools.partial(job_manager.report_progress, job_id),
+                threads=job_manager.thread_budget,
+                upload_folder=current_app.config["UPLOAD_FOLDER"],
+            )
+            unsubmitted -= 1
+    finally:
+        job_manager.release(unsubmitted)
+
+    logger.info(
+        "Batch queued",
+        extra={
+            "batch_id": batch_id,
+            "variants": len(batch["variants"]),
+            "images": len(upload["images"]),
+        },
+    )
+    return jsonify(batch_status(batch)), 202
+
+
+def busy_response(error):
+    """429 telling the client when the render queue should have room"""
+    response = jsonify(
+        {
+            "success": False,
+            "message": "The render queue is full. Please try again later.",
+            "retry_after": error.retry_after,
+        }
+    )
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 429
+
+
+def batch_status(batch):
+    """The batch record with every variant's current job"""
+    variants = []
+    for variant in batch["variants"]:
+        job = job_manager.get(variant["job_id"])
+        variants.append({**variant, "job": job})
+    status, counts = summarize(
+        v["job"]["status"] if v["job"] else "failed" for v in variants
+    )
+    return {**batch, "status": status, "counts": counts, "variants": variants}
+
+
+@views.route("/batches/<batch_id>")
+def get_batch(batch_id):
+    batch = load_batch(
+        os.path.join(current_app.config["UPLOAD_FOLDER"], secure_filename(batch_id))
+    )
+    if batch is None:
+        return jsonify({"success": False, "message": "Batch not found"}), 404
+    return jsonify(batch_status(batch))
+
+
+def write_settings(target_folder, text_overlay, aspect_ratio, filter_effect):
+    settings_path = os.path.join(target_folder, "settings.txt")
+    with open(settings_path, "w", encoding="utf-8") as f:
+        f.write(f"text_overlay={text_overlay}\n")
+        f.write(f"aspect_ratio={aspect_ratio}\n")
+        f.write(f"filter_effect={filter_effect}\n")
+
+
+@views.route("/uploads", methods=["POST"])
+def start_chunked_upload():
+    """Start a resumable audio upload; the file is then sent with PATCH"""
+    data = request.get_json(silent=True) or {}
+    try:
+        status = chunked_uploads.create(data.get("filename"), data.get("size"))
+    except UploadRejected as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+    response = jsonify({**status, "chunk_size": UPLOAD_CHUNK_SIZE})
+    response.headers["Upload-Offset"] = str(status["offset"])
+    return response, 201
+
 
-        # Process image files - collect them in order
-        file_keys = sorted(
-            [key for key in request.files.keys() if key.startswith("file")]
+@views.route("/uploads/<upload_id>", methods=["GET", "PATCH"])
+def chunked_upload(upload_id):
+    if request.method == "PATCH":
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            status = chunked_uploads.append(upload_id, offset, request.stream)
+            UPLOAD_BYTES.inc(status["offset"] - offset, kind="chunked")
+        except ValueError:
+            return (
+                jsonify({"success": False, "message": "Missing Upload-Offset header"}),
+                400,
+            )
+        except UploadRejected as e:
+            status = chunked_uploads.status(upload_id)
+            response = jsonify({"success": False, "message": e.message})
+            if status:
+                response.headers["Upload-Offset"] = str(status["offset"])
+            return response, e.status
+    else:
+        status = chunked_uploads.status(upload_id)
+        if status is None:
+            return jsonify({"success": False, "message": "Upload not found"}), 404
+
+    response = jsonify(status)
+    response.headers["Upload-Offset"] = str(status["offset"])
+    return response
+
+
+def render_job(
+    folder,
+    reel_name,
+    text_overlay,
+    aspect_ratio,
+    filter_effect,
+    image_count,
+    duration,
+    progress=None,
+    threads=None,
+    incremental=None,
+    upload_folder=UPLOAD_FOLDER,
+):
+    """
+    Render a queued reel and write its gallery metadata. Runs on a render worker.
+
+    Identical submissions reuse the existing MP4 instead of running FFmpeg.
+    ``progress(stage, fraction)`` and the ``threads`` budget are passed on
+    to create_reel. ``incremental`` encodes per-image cached clips; it
+    defaults to INCREMENTAL_RENDER. ``folder`` is in ``upload_folder``, the
+    app's UPLOAD_FOLDER, passed in since jobs run outside any request. With
+    RENDER_PROFILING the cost of the render is kept in the metadata under
+    "profiling".
+    """
+    progress = progress or (lambda stage, fraction: None)
+    stats = RenderStats() if RENDER_PROFILING else None
+    upload_dir = os.path.join(upload_folder, folder)
+    fingerprint = render_fingerprint(upload_dir)
+    cached_name = render_cache.lookup(fingerprint)
+    if cached_name:
+        logger.info(
+            "Render cache hit", extra={"reel": reel_name, "cached_from": cached_name}
         )
-        print(f"Processing {len(file_keys)} image files")
-
-        for key in file_keys:
-            file = request.files[key]
-            if file and file.filename:
-                file.seek(0, os.SEEK_END)
-                file_size = file.tell()
-                file.seek(0)
-
-                if file_size > MAX_FILE_SIZE:
-                    return render_template(
-                        "create.html",
-                        myid=myid,
-                        error=f"One or more images are too large. Maximum size per image is {MAX_FILE_SIZE // (1024*1024)}MB.",
-                    )
-
-                filename = secure_filename(file.filename)
-                ext = os.path.splitext(filename)[1].lower().lstrip(".")
-                if ext in ALLOWED_EXTENSIONS:
-                    # Save with index to maintain order
-                    new_filename = (
-                        f"img_{len(input_files):03d}{os.path.splitext(filename)[1]}"
-                    )
-                    file_path = os.path.join(target_folder, new_filename)
-                    file.save(file_path)
-                    input_files.append(new_filename)
-                    print(f"Saved image: {new_filename}")
-
-        if not input_files:
-            return render_template(
-                "create.html",
-                myid=myid,
-                error="Please upload at least one image (JPG, JPEG, or PNG).",
+        render_cache.reuse(cached_name, reel_name)
+    else:
+        create_reel(
+            folder,
+            reel_name,
+            text_overlay,
+            aspect_ratio,
+            filter_effect,
+            progress=progress,
+            threads=threads,
+            incremental=INCREMENTAL_RENDER if incremental is None else incremental,
+            stats=stats,
+            upload_folder=upload_folder,
+        )
+    render_cache.store(fingerprint, reel_name)
+
+    # Thumbnails are a nice-to-have; the reel itself is already done
+    progress("thumbnails", 0.0)
+    thumbnails = {}
+    try:
+        if cached_name:
+            thumbnails = reuse_thumbnails(cached_name, reel_name) or {}
+        if not thumbnails:
+            thumbnails = generate_thumbnails(reel_name)
+    except Exception as e:
+        logger.warning(
+            "Could not create thumbnails", extra={"reel": reel_name, "error": str(e)}
+        )
+
+    # Adaptive streaming is optional too; the MP4 is always there
+    if HLS_ENABLED:
+        progress("hls", 0.0)
+        try:
+            hls = (cached_name and reuse_hls(cached_name, reel_name)) or package_hls(
+                reel_name, threads=threads
+            )
+            thumbnails["hls"] = hls
+        except Exception as e:
+            logger.warning(
+                "Could not package HLS", extra={"reel": reel_name, "error": str(e)}
             )
 
-        print(f"Total images saved: {len(input_files)}")
-        if has_audio and input_files:
-            # Create input.txt for FFmpeg concat
-            input_txt_path = os.path.join(target_folder, "input.txt")
-            with open(input_txt_path, "w", encoding="utf-8") as f:
-                for fl in input_files:
-                    f.write(f"file '{fl}'\n")
-                    f.write(f"duration {duration}\n")
-                # Add the last file again without duration
-                f.write(f"file '{input_files[-1]}'\n")
-
-            print(f"Created input.txt with {len(input_files)} images")
-
-            # Save customization settings
-            settings_path = os.path.join(target_folder, "settings.txt")
-            with open(settings_path, "w", encoding="utf-8") as f:
-                f.write(f"text_overlay={text_overlay}\n")
-                f.write(f"aspect_ratio={aspect_ratio}\n")
-                f.write(f"filter_effect={filter_effect}\n")
-
-            # Ensure reels directory exists
-            reels_dir = os.path.join("static", "reels")
-            if not os.path.exists(reels_dir):
-                os.makedirs(reels_dir, exist_ok=True)
-
-            # Create metadata file for gallery
-            metadata_dir = os.path.join("static", "metadata")
-            if not os.path.exists(metadata_dir):
-                os.makedirs(metadata_dir, exist_ok=True)
-
-            # Create reel
-            if has_required_assets(str(rec_id)):
-                try:
-                    create_reel(
-                        str(rec_id),
-                        reel_name,
-                        text_overlay,
-                        aspect_ratio,
-                        filter_effect,
-                    )
-
-                    # Save metadata
-                    metadata = {
-                        "name": reel_name,
-                        "created_at": datetime.now().isoformat(),
-                        "image_count": len(input_files),
-                        "duration": duration,
-                        "text_overlay": text_overlay,
-                        "aspect_ratio": aspect_ratio,
-                        "filter_effect": filter_effect,
-                    }
-                    metadata_path = os.path.join(metadata_dir, f"{reel_name}.json")
-                    with open(metadata_path, "w", encoding="utf-8") as f:
-                        json.dump(metadata, f, indent=2)
-
-                    return render_template(
-                        "create.html",
-                        myid=myid,
-                        success=f"Reel '{reel_name}' created successfully with {len(input_files)} images! Go and watch it in the gallery section.",
-                        show_gallery_link=True,
-                    )
-                except Exception as e:
-                    print(f"Error creating reel: {e}")
-                    import traceback
-
-                    traceback.print_exc()
-                    return render_template(
-                        "create.html",
-                        myid=myid,
-                        error=f"Error creating reel: {str(e)}. Please check the console for details.",
-                    )
-            else:
-                return render_template(
-                    "create.html",
-                    myid=myid,
-                    error="Missing required assets for reel creation.",
-                )
+    metadata = {
+        "name": reel_name,
+        "created_at": datetime.now().isoformat(),
+        "image_count": image_count,
+        "duration": duration,
+        "text_overlay": text_overlay,
+        "aspect_ratio": aspect_ratio,
+        "filter_effect": filter_effect,
+        "fingerprint": fingerprint,
+        "cached_from": cached_name,
+        "upload_folder": folder,
+        "audio": audio_info(upload_dir),
+        "images": load_image_info(upload_dir),
+        **thumbnails,
+    }
+    if stats is not None and not cached_name:
+        metadata["profiling"] = stats.as_dict()
+    with METADATA_WRITE_SECONDS.time():
+        metadata_path = os.path.join("static", "metadata", f"{reel_name}.json")
+        with open(metadata_path, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, indent=2)
+        gallery_index.add(reel_name, metadata)
+
+    # A promoted preview's draft is no longer needed
+    draft_path = os.path.join("static", "drafts", f"{folder}.mp4")
+    if os.path.exists(draft_path):
+        os.remove(draft_path)
+
+    return metadata
+
+
+def render_preview_job(
+    folder,
+    reel_name,
+    text_overlay,
+    aspect_ratio,
+    filter_effect,
+    image_count,
+    duration,
+    progress=None,
+    threads=None,
+    upload_folder=UPLOAD_FOLDER,
+):
+    """
+    Render a low-resolution draft to ``static/drafts/<folder>.mp4``. It is
+    kept out of the gallery and the render cache; the job can then be
+    promoted to a final render of the same uploads.
+    """
+    create_reel(
+        folder,
+        folder,
+        text_overlay,
+        aspect_ratio,
+        filter_effect,
+        progress=progress,
+        quality="preview",
+        threads=threads,
+        upload_folder=upload_folder,
+    )
+    upload_dir = os.path.join(upload_folder, folder)
+    return {
+        "name": reel_name,
+        "quality": "preview",
+        "draft": f"drafts/{folder}.mp4",
+        "audio": audio_info(upload_dir),
+        "images": load_image_info(upload_dir),
+        "created_at": datetime.now().isoformat(),
+        "image_count": image_count,
+        "duration": duration,
+        "text_overlay": text_overlay,
+        "aspect_ratio": aspect_ratio,
+        "filter_effect": filter_effect,
+    }
+
+
+@views.route("/jobs")
+def list_jobs():
+    return jsonify({"jobs": job_manager.list()})
+
+
+@views.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get(secure_filename(job_id))
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify(job)
+
+
+@views.route("/jobs/<job_id>/promote", methods=["POST"])
+def promote_job(job_id):
+    """
+    Queue the final render of a finished preview, reusing its uploads.
+    The text overlay, aspect ratio and filter may be changed on the way.
+    """
+    job_id = secure_filename(job_id)
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    draft = job.get("metadata") or {}
+    if job["status"] != "done" or draft.get("quality") != "preview":
+        return (
+            jsonify(
+                {"success": False, "message": "Only finished previews can be promoted"}
+            ),
+            409,
+        )
+    # Restarts the retention clock before the uploads are checked, so a
+    # sweep in any process keeps them for the final render
+    job_manager.mark_used(job_id)
+    if not has_required_assets(job_id):
+        return jsonify({"success": False, "message": "The uploads are gone"}), 410
+
+    data = request.get_json(silent=True) or request.form
+    text_overlay = data.get("text_overlay", draft["text_overlay"]).strip()
+    aspect_ratio = data.get("aspect_ratio", draft["aspect_ratio"])
+    filter_effect = data.get("filter_effect", draft["filter_effect"])
+    error = unsupported_option(filter_effect, text_overlay)
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+    # Holds the slot, so a request racing for the last one cannot make
+    # submit() fail after the settings were rewritten
+    try:
+        job_manager.reserve(1)
+    except QueueFull as e:
+        return busy_response(e)
+    try:
+        write_settings(
+            os.path.join(current_app.config["UPLOAD_FOLDER"], job_id),
+            text_overlay,
+            aspect_ratio,
+            filter_effect,
+        )
+    except BaseException:
+        job_manager.release(1)
+        raise
+
+    job = job_manager.submit(
+        job_id,
+        render_job,
+        job_id,
+        draft["name"],
+        text_overlay,
+        aspect_ratio,
+        filter_effect,
+        draft["image_count"],
+        draft["duration"],
+        reel_name=draft["name"],
+        reserved=True,
+        progress=functools.partial(job_manager.report_progress, job_id),
+        threads=job_manager.thread_budget,
+        upload_folder=current_app.config["UPLOAD_FOLDER"],
+    )
+    return jsonify(job), 202
+
+
+@views.route("/api/reels/<reel_name>/edit", methods=["POST"])
+def edit_reel(reel_name):
+    """
+    Replace, insert, remove or move images of a finished reel, or change
+    their duration, and render it again from its uploads.
+
+    Takes JSON ``{"edits": [...]}``, or a form with an ``edits`` field and
+    the new images as file1, file2, ... Unchanged images reuse their
+    encoded segments.
+    """
+    reel_name = secure_filename(reel_name)
+    metadata_path = os.path.join("static", "metadata", f"{reel_name}.json")
+    if not os.path.exists(metadata_path):
+        return jsonify({"success": False, "message": "Reel not found"}), 404
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    folder = secure_filename(metadata.get("upload_folder") or "")
+    if folder:
+        # Keeps the uploads from expiring while they are being edited
+        job_manager.mark_used(folder)
+    if not folder or not has_required_assets(folder):
+        return jsonify({"success": False, "message": "The uploads are gone"}), 410
+    if job_is_active(folder):
+        return (
+            jsonify({"success": False, "message": "The reel is still rendering"}),
+            409,
+        )
+
+    target_folder = os.path.join(current_app.config["UPLOAD_FOLDER"], folder)
+    staging = os.path.join(
+        current_app.config["UPLOAD_FOLDER"], f".incoming-{uuid.uuid4()}"
+    )
+    try:
+        if request.is_json:
+            upload = {"images": [], "image_info": [], "digests": {}}
+            edits = parse_edits(request.get_json(silent=True))
         else:
-            return render_template(
-                "create.html", myid=myid, error="Please provide both audio and images."
+            upload = receive_upload(
+                request, staging, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, MAX_AUDIO_SIZE
+            )
+            UPLOAD_BYTES.inc(upload["bytes"], kind="edit")
+            edits = parse_edits(upload["form"].get("edits"))
+        entries = apply_edits(
+            parse_concat_list(os.path.join(target_folder, "input.txt")),
+            edits,
+            len(upload["images"]),
+        )
+        if not check_ffmpeg():
+            raise UploadRejected("FFmpeg is not installed on this server.", 503)
+        # Reserved before the edit is staged, so the re-render is always
+        # queued once input.txt has changed
+        job_manager.reserve(1)
+        try:
+            blob_store.adopt(staging, upload["digests"])
+            entries = stage_edit(target_folder, staging, upload, entries)
+            blob_store.reference(target_folder, upload["digests"].values())
+        except BaseException:
+            job_manager.release(1)
+            raise
+    except UploadRejected as e:
+        return jsonify({"success": False, "message": e.message}), e.status
+    except QueueFull as e:
+        return busy_response(e)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    logger.info(
+        "Reel edited",
+        extra={"reel": reel_name, "edits": len(edits), "images": len(entries)},
+    )
+    job = job_manager.submit(
+        folder,
+        render_job,
+        folder,
+        reel_name,
+        metadata["text_overlay"],
+        metadata["aspect_ratio"],
+        metadata["filter_effect"],
+        len(entries),
+        common_duration(entries),
+        reel_name=reel_name,
+        reserved=True,
+        progress=functools.partial(job_manager.report_progress, folder),
+        threads=job_manager.thread_budget,
+        upload_folder=current_app.config["UPLOAD_FOLDER"],
+        # Later edits of this reel then only encode the images they change
+        incremental=True,
+    )
+    return jsonify(job), 202
+
+
+@views.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    Stream a job's status and progress as Server-Sent Events until it
+    finishes. A comment line is sent every JOB_EVENTS_HEARTBEAT seconds
+    so proxies keep the connection open.
+    """
+    job_id = secure_filename(job_id)
+    if job_manager.get(job_id) is None:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+
+    def events():
+        version = None
+        last_sent = None
+        while True:
+            job, version = job_manager.wait_for_change(
+                job_id, version, JOB_EVENTS_HEARTBEAT
             )
+            if job is None:
+                return
+            payload = json.dumps(job)
+            if payload == last_sent:
+                yield ": heartbeat\n\n"
+            else:
+                last_sent = payload
+                yield f"event: {job['status']}\ndata: {payload}\n\n"
+            if job["status"] in ("done", "failed"):
+                return
 
-    return render_template("create.html", myid=myid)
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
-@app.route("/gallery")
-def gallery():
-    reels_dir = os.path.join("static", "reels")
-    metadata_dir = os.path.join("static", "metadata")
+def _pagination_args():
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = request.args.get("per_page", GALLERY_PAGE_SIZE, type=int)
+    return page, min(max(1, per_page), GALLERY_MAX_PAGE_SIZE)
 
-    if not os.path.exists(reels_dir):
-        os.makedirs(reels_dir, exist_ok=True)
-    if not os.path.exists(metadata_dir):
-        os.makedirs(metadata_dir, exist_ok=True)
 
-    reels = []
-    for filename in os.listdir(reels_dir):
-        if filename.endswith(".mp4"):
-            reel_info = {
-                "filename": filename,
-                "name": os.path.splitext(filename)[0],
-                "size": os.path.getsize(os.path.join(reels_dir, filename)),
-                "created_at": datetime.fromtimestamp(
-                    os.path.getctime(os.path.join(reels_dir, filename))
-                ).strftime("%Y-%m-%d %H:%M"),
-            }
+def _not_modified(etag):
+    """Return a 304 response if the client already has this version"""
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+    return None
+
 
-            # Load metadata if exists
-            metadata_path = os.path.join(
-                metadata_dir, f"{os.path.splitext(filename)[0]}.json"
+@views.route("/gallery")
+def gallery():
+    os.makedirs(os.path.join("static", "reels"), exist_ok=True)
+    os.makedirs(os.path.join("static", "metadata"), exist_ok=True)
+    gallery_index.ensure_reconciled()
+
+    page, per_page = _pagination_args()
+    # The template is part of the page, so a new deploy must change the tag
+    template_mtime = int(os.path.getmtime(GALLERY_TEMPLATE_PATH))
+    etag = f"gallery-{gallery_index.generation()}-{template_mtime}-{page}-{per_page}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    with GALLERY_RENDER_SECONDS.time(view="html"):
+        reels, total = gallery_index.page(page, per_page)
+        response = make_response(
+            render_template(
+                "gallery.html",
+                reels=reels,
+                total=total,
+                page=page,
+                pages=max(1, math.ceil(total / per_page)),
             )
-            if os.path.exists(metadata_path):
-                try:
-                    with open(metadata_path, "r", encoding="utf-8") as f:
-                        metadata = json.load(f)
-                        reel_info.update(metadata)
-                except:
-                    pass
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@views.route("/api/reels")
+def api_reels():
+    gallery_index.ensure_reconciled()
+
+    page, per_page = _pagination_args()
+    etag = f"reels-{gallery_index.generation()}-{page}-{per_page}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    with GALLERY_RENDER_SECONDS.time(view="api"):
+        reels, total = gallery_index.page(page, per_page)
+        response = jsonify(
+            {
+                "reels": reels,
+                "page": page,
+                "per_page": per_page,
+                "total": total,
+                "pages": max(1, math.ceil(total / per_page)),
+            }
+        )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
-            reels.append(reel_info)
 
-    # Sort by creation date (newest first)
-    reels.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+def _disk_usage():
+    return {
+        (path,): directory_size(path)
+        for path in (lifecycle.upload_folder, os.path.join("static", "reels"))
+    }
 
-    print("Gallery reels:", [r["filename"] for r in reels])
-    return render_template("gallery.html", reels=reels)
 
+def _jobs_by_status():
+    counts = {}
+    for job in job_manager.list():
+        counts[(job["status"],)] = counts.get((job["status"],), 0) + 1
+    return counts
 
-@app.route("/delete/<reel_name>", methods=["POST"])
-def delete_reel(reel_name):
-    try:
-        reel_path = os.path.join("static", "reels", secure_filename(reel_name))
-        metadata_path = os.path.join(
-            "static",
-            "metadata",
-            f"{os.path.splitext(secure_filename(reel_name))[0]}.json",
-        )
 
-        if os.path.exists(reel_path):
-            os.remove(reel_path)
+disk_usage = cached(DISK_USAGE_TTL, _disk_usage)
+blob_usage = cached(DISK_USAGE_TTL, blob_store.usage)
+registry.gauge(
+    "reel_disk_usage_bytes",
+    "Bytes used by uploads and finished reels",
+    ("path",),
+    callback=disk_usage,
+)
+registry.gauge(
+    "reel_jobs", "Render jobs known to this process", ("status",), _jobs_by_status
+)
+
+
+@views.route("/metrics")
+def metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@views.route("/api/capabilities")
+def capabilities():
+    """FFmpeg version, encoders, filters and which effects this server can render"""
+    return jsonify(ffmpeg_probe.get())
+
 
-        if os.path.exists(metadata_path):
-            os.remove(metadata_path)
+@views.route("/api/profiling")
+def profiling():
+    """Effects, aspect ratios and text overlays ranked by their render cost"""
+    return jsonify(profile_cache.report())
 
+
+@views.route("/reels/<path:filename>")
+def serve_reel(filename):
+    """Serve a reel with byte ranges; ``?v=`` URLs from the gallery are immutable"""
+    reels_dir = os.path.join("static", "reels")
+    response = send_reel(reels_dir, filename, request.args.get("v"))
+    # Served reels are the last to go when the quota is enforced
+    touch_access(os.path.join(reels_dir, secure_filename(filename)))
+    return response
+
+
+@views.route("/delete/<reel_name>", methods=["POST"])
+def delete_reel(reel_name):
+    try:
+        remove_reel(
+            os.path.splitext(secure_filename(reel_name))[0],
+            current_app.config["UPLOAD_FOLDER"],
+        )
         return jsonify({"success": True, "message": "Reel deleted successfully"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
-@app.route("/about")
+def remove_reel(name, upload_folder):
+    """Delete a reel with its metadata, thumbnails, HLS package and uploads"""
+    reel_path = os.path.join("static", "reels", f"{name}.mp4")
+    metadata_path = os.path.join("static", "metadata", f"{name}.json")
+
+    # Unlist the reel first so nothing links to files that are going away
+    gallery_index.remove(name)
+    render_cache.forget(name)
+
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+    if os.path.exists(reel_path):
+        os.remove(reel_path)
+
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+
+    remove_thumbnails(name)
+    remove_hls(name)
+
+    # The source images and audio are only needed to re-render. Blobs no
+    # other reel links to are freed with them
+    folder = secure_filename(metadata.get("upload_folder") or "")
+    if folder and not job_is_active(folder):
+        blob_store.remove_folder(os.path.join(upload_folder, folder))
+
+
+def job_is_active(job_id):
+    job = job_manager.get(job_id)
+    return job is not None and job["status"] in (QUEUED, RUNNING)
+
+
+@views.route("/api/storage")
+def storage():
+    """Disk usage and what the last lifecycle sweep reclaimed"""
+    return jsonify(
+        {
+            "usage": {path: size for (path,), size in disk_usage().items()},
+            "blobs": blob_usage(),
+            "last_sweep": lifecycle.last_report,
+        }
+    )
+
+
+@views.route("/about")
 def about():
     return render_template("about.html")
 
 
-@app.route("/help")
+@views.route("/help")
 def help():
     return render_template("help.html")
 
 
 def has_required_assets(folder: str) -> bool:
-    base = os.path.join(app.config["UPLOAD_FOLDER"], folder)
+    base = os.path.join(current_app.config["UPLOAD_FOLDER"], folder)
     audio_path = os.path.join(base, "audio.mp3")
     input_path = os.path.join(base, "input.txt")
 
     if not os.path.exists(audio_path):
-        print(f"Missing audio.mp3 for {folder}")
+        logger.warning("Missing audio.mp3", extra={"folder": folder})
         return False
     if not os.path.exists(input_path):
-        print(f"Missing input.txt for {folder}")
+        logger.warning("Missing input.txt", extra={"folder": folder})
         return False
 
     try:
         with open(input_path, "r", encoding="utf-8") as f:
             content = f.read().strip()
         if "file '" not in content:
-            print(f"input.txt has no image entries for {folder}")
+            logger.warning("input.txt has no image entries", extra={"folder": folder})
             return False
     except Exception as e:
-        print(f"Error reading input.txt for {folder}: {e}")
+        logger.warning(
+            "Could not read input.txt", extra={"folder": folder, "error": str(e)}
+        )
         return False
 
     return True
 
 
-def get_filter_string(filter_effect):
+def create_app(config=None, probe=True):
     """
-    Return FFmpeg filter string based on selected effect
+    Build the app from the environment, with ``config`` overrides, along
+    with the render job pool and storage lifecycle for its UPLOAD_FOLDER,
+    and prepare the storage folders and the FFmpeg probe. Jobs left
+    unfinished by an earlier server are marked as failed. Starts no
+    threads, so it is safe to run before forking; gunicorn runs it once in
+    the master (see gunicorn.conf.py) and each worker then calls
+    start_background().
     """
-    filters = {
-        # Basic Filters
-        "none": "",
-        "grayscale": "hue=s=0",
-        "sepia": "eq=gamma=1.0:saturation=1.2:contrast=1.0,colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131:0",
-        # Color Adjustments
-        "vibrant": "eq=saturation=1.6:contrast=1.2",
-        "warm": "colorbalance=rs=.3:gs=.1:bs=-.3,eq=saturation=1.1",
-        "cool": "colorbalance=rs=-.3:gs=-.1:bs=.3,eq=saturation=1.1",
-        "vintage": "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131,vignette=angle=PI/3",
-        # Dramatic Filters
-        "noir": "hue=s=0,eq=contrast=1.5:brightness=-0.05",
-        "dramatic": "eq=contrast=1.4:brightness=-0.1:saturation=0.8",
-        "cinematic": "eq=contrast=1.3:brightness=-0.05:saturation=1.1,colorbalance=rs=.1:gs=-.05:bs=.15",
-        # Bright & Light
-        "bright": "eq=brightness=0.1:contrast=1.1:saturation=1.2",
-        "soft": "eq=gamma=1.2:saturation=0.9,gblur=sigma=0.5",
-        "dream": "eq=gamma=1.3:saturation=0.8,gblur=sigma=1",
-        # Instagram-style Filters
-        "nashville": "colorchannelmixer=.6:.4:.15:0:.45:.45:.3:0:.2:.2:.15,eq=contrast=1.2:brightness=0.05",
-        "lofi": "eq=contrast=1.5:saturation=1.2,colorbalance=rs=.2:bs=-.1",
-        "xpro": "eq=contrast=1.3:saturation=1.2,colorbalance=rs=-.1:gs=.05:bs=.2,curves=all='0/0.1 0.5/0.58 1/0.9'",
-        # Modern Filters
-        "fade": "eq=saturation=0.7:contrast=0.9:brightness=0.05",
-        "sharp": "unsharp=5:5:1.0:5:5:0.0,eq=contrast=1.1",
-        "vignette": "vignette=angle=PI/3",
-        "blur_edges": "boxblur=luma_radius=3:luma_power=1,pad=iw:ih:0:0:color=black",
-    }
-
-    return filters.get(filter_effect, "")
-
-
-def create_reel(
-    folder, reel_name, text_overlay="", aspect_ratio="9:16", filter_effect="none"
-):
-    # Get the absolute path to the output file
-    original_dir = os.getcwd()
-    output_dir = os.path.join(original_dir, "static", "reels")
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, f"{reel_name}.mp4")
-
-    # Set dimensions based on aspect ratio
-    if aspect_ratio == "9:16":
-        width, height = 1080, 1920
-    elif aspect_ratio == "16:9":
-        width, height = 1920, 1080
-    elif aspect_ratio == "1:1":
-        width, height = 1080, 1080
-    else:
-        width, height = 1080, 1920
-
-    # Build single filter string (combine all filters)
-    vf_parts = [
-        f"scale={width}:{height}:force_original_aspect_ratio=decrease",
-        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black",
-    ]
-
-    # Add video filter effect
-    filter_string = get_filter_string(filter_effect)
-    if filter_string:
-        vf_parts.append(filter_string)
-
-    # Add text overlay if provided
-    if text_overlay:
-        text_clean = text_overlay.replace("'", "'\\''").replace(":", "\\:")
-        text_filter = f"drawtext=text='{text_clean}':fontsize=60:fontcolor=white:x=(w-text_w)/2:y=h-150:box=1:boxcolor=black@0.5:boxborderw=10"
-        vf_parts.append(text_filter)
-
-    vf_string = ",".join(vf_parts)
-
-    # Build FFmpeg command
-    command = [
-        "ffmpeg",
-        "-y",
-        "-f",
-        "concat",
-        "-safe",
-        "0",
-        "-i",
-        "input.txt",
-        "-i",
-        "audio.mp3",
-        "-vf",
-        vf_string,
-        "-c:v",
-        "libx264",
-        "-c:a",
-        "aac",
-        "-shortest",
-        "-r",
-        "30",
-        "-pix_fmt",
-        "yuv420p",
-        output_path,
-    ]
-
-    # Change working directory to process files correctly
-    target_dir = os.path.join(original_dir, "user_uploads", folder)
-
-    try:
-        os.chdir(target_dir)
-        print(f"Running FFmpeg command: {' '.join(command)}")
-
-        result = subprocess.run(
-            command, capture_output=True, text=True, encoding="utf-8", errors="replace"
-        )
+    global job_manager, lifecycle
+
+    app = Flask(__name__)
+    app.config.update(env_config())
+    app.config.update(config or {})
+    app.register_blueprint(views)
+
+    upload_folder = app.config["UPLOAD_FOLDER"]
+    job_manager = JobManager(
+        upload_folder, max_workers=RENDER_WORKERS, cpu_count=RENDER_CPUS
+    )
+    lifecycle = StorageLifecycle(
+        upload_folder,
+        # Only this process's jobs: a job.json left queued or running by a
+        # process that is gone must still expire by its age
+        is_active=job_manager.is_active,
+        remove_reel=functools.partial(remove_reel, upload_folder=upload_folder),
+        lock_path=LIFECYCLE_LOCK,
+        blob_store=blob_store,
+    )
+
+    for path in (
+        upload_folder,
+        os.path.join("static", "reels"),
+        os.path.join("static", "metadata"),
+    ):
+        os.makedirs(path, exist_ok=True)
+    # Jobs a crashed or restarted server left queued or running would
+    # otherwise stay that way
+    job_manager.recover()
+    if probe:
+        # Probed once here, the result is inherited by every forked worker
+        ffmpeg_probe.get()
+    return app
+
+
+def start_background():
+    """
+    Start the threads a serving process runs besides its requests: the log
+    writer and the lifecycle sweeper
+    """
+    configure_logging()
+    # Render workers start with the first job; sweeps are serialised across
+    # processes by LIFECYCLE_LOCK
+    lifecycle.start()
 
-        if result.returncode != 0:
-            print("FFmpeg STDOUT:", result.stdout)
-            print("FFmpeg STDERR:", result.stderr)
-            raise Exception(f"FFmpeg failed with return code {result.returncode}")
-
-        print(f"Successfully created reel: {reel_name}")
-    finally:
-        os.chdir(original_dir)
 
 if __name__ == "__main__":
-    # Create necessary directories
-    os.makedirs("user_uploads", exist_ok=True)
-    os.makedirs("static/reels", exist_ok=True)
-    os.makedirs("static/metadata", exist_ok=True)
-
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Development server; production runs gunicorn -c gunicorn.conf.py wsgi:app
+    app = create_app()
+    start_background()
+    app.run(
+        debug=os.environ.get("FLASK_DEBUG", "0") == "1",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "5000")),
+    )
@@ -0,0 +1,172 @@
+"""
+Delivery of finished reels: versioned URLs served with byte ranges and
+long-lived cache headers, plus optional HLS packaging for adaptive playback.
+"""
+
+import os
+import shutil
+import uuid
+
+from flask import send_from_directory
+
+from render_engine import GOP_SIZE, run_ffmpeg
+
+STATIC_DIR = "static"
+HLS_ENABLED = os.environ.get("HLS_ENABLED", "0") == "1"
+HLS_SEGMENT_SECONDS = 4
+REEL_MAX_AGE = 365 * 24 * 60 * 60
+
+# Renditions as a fraction of the reel's width and a target bitrate in kbit/s
+HLS_RENDITIONS = [
+    {"scale": 1.0, "bitrate": 4500},
+    {"scale": 2 / 3, "bitrate": 2500},
+    {"scale": 4 / 9, "bitrate": 1000},
+]
+
+
+def reel_version(path):
+    """Short token that changes whenever the file at ``path`` is replaced"""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def send_reel(reels_dir, filename, version=None):
+    """
+    Serve a reel with Range/206 support and a strong ETag.
+
+    A URL carrying the file's current ``version`` can never change, so it is
+    cached as immutable for a year; anything else must be revalidated.
+    Flask hands the file to the server's sendfile support, or to the front
+    server when USE_X_SENDFILE is set.
+    """
+    reels_dir = os.path.abspath(reels_dir)
+    response = send_from_directory(
+        reels_dir, filename, mimetype="video/mp4", conditional=True, etag=True
+    )
+    current = reel_version(os.path.join(reels_dir, filename))
+    response.cache_control.public = True
+    if version == current:
+        response.cache_control.max_age = REEL_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = 0
+        response.cache_control.no_cache = True
+    return response
+
+
+def hls_dir(reel_name):
+    return f"hls/{reel_name}"
+
+
+def hls_playlist(reel_name):
+    return f"{hls_dir(reel_name)}/master.m3u8"
+
+
+def _swap_dir(tmp_path, path):
+    # Replace a directory in two renames so readers never see a partial one
+    old_path = f"{path}.old-{uuid.uuid4().hex}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def package_hls(reel_name, static_dir=STATIC_DIR, threads=None):
+    """
+    Package ``static/reels/<reel_name>.mp4`` as HLS with one variant per
+    HLS_RENDITIONS entry, using at most ``threads`` encoder threads.
+    Returns the master playlist path relative to ``static_dir``.
+    """
+    video = os.path.abspath(os.path.join(static_dir, "reels", f"{reel_name}.mp4"))
+    path = os.path.join(static_dir, hls_dir(reel_name))
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_path)
+
+    count = len(HLS_RENDITIONS)
+    filters = [f"[0:v]split={count}" + "".join(f"[s{i}]" for i in range(count))]
+    maps = []
+    for i, rendition in enumerate(HLS_RENDITIONS):
+        scale = rendition["scale"]
+        filters.append(f"[s{i}]scale=trunc(iw*{scale:.4f}/2)*2:-2[v{i}]")
+        bitrate = rendition["bitrate"]
+        maps += [
+            "-map",
+            f"[v{i}]",
+            "-map",
+            "0:a:0",
+            f"-b:v:{i}",
+            f"{bitrate}k",
+            f"-maxrate:v:{i}",
+            f"{bitrate * 3 // 2}k",
+            f"-bufsize:v:{i}",
+            f"{bitrate * 3}k",
+        ]
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-i",
+        video,
+        "-filter_complex",
+        ";".join(filters),
+        *maps,
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-g",
+        str(GOP_SIZE),
+        "-keyint_min",
+        str(GOP_SIZE),
+        "-sc_threshold",
+        "0",
+        *(["-threads", str(threads)] if threads else []),
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_filename",
+        "v%v/segment_%03d.ts",
+        "-master_pl_name",
+        "master.m3u8",
+        "-var_stream_map",
+        " ".join(f"v:{i},a:{i}" for i in range(count)),
+        "v%v/index.m3u8",
+    ]
+    try:
+        run_ffmpeg(command, tmp_path, f"{reel_name} HLS")
+        _swap_dir(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return hls_playlist(reel_name)
+
+
+def reuse_hls(cached_name, reel_name, static_dir=STATIC_DIR):
+    """
+    Hard-link the HLS package of a cached reel to a new reel name. Returns
+    None if the cached reel has none.
+    """
+    source = os.path.join(static_dir, hls_dir(cached_name))
+    if not os.path.exists(os.path.join(static_dir, hls_playlist(cached_name))):
+        return None
+    if cached_name == reel_name:
+        return hls_playlist(reel_name)
+
+    path = os.path.join(static_dir, hls_dir(reel_name))
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    try:
+        shutil.copytree(source, tmp_path, copy_function=os.link)
+        _swap_dir(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return hls_playlist(reel_name)
+
+
+def remove_hls(reel_name, static_dir=STATIC_DIR):
+    shutil.rmtree(os.path.join(static_dir, hls_dir(reel_name)), ignore_errors=True)
@@ -0,0 +1,221 @@
+"""
+In-process counters, gauges and latency histograms rendered in the
+Prometheus text format for the /metrics endpoint.
+
+Each process keeps its own numbers; scrape every worker, or run one worker
+per metrics port.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; wide enough for both a gallery page and a long render
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DISK_USAGE_TTL = 30
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """A gauge that is either set directly or read from ``callback`` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        super().__init__(name, help_text, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.callback is not None:
+            # The callback returns a number, or {label values: number}
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(
+                key, {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            )
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state["buckets"][index] += 1
+            state["count"] += 1
+            state["sum"] += value
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state["count"] if state else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the ``with`` block, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = {
+                key: dict(state, buckets=list(state["buckets"]))
+                for key, state in self._values.items()
+            }
+        lines = self.header()
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state["buckets"]):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labels, key, [("le", _format_value(bound))]
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self._register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def directory_size(path):
+    """Total bytes of the regular files under ``path``"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def cached(ttl, fn):
+    """Wrap ``fn`` so it runs at most once per ``ttl`` seconds"""
+    lock = threading.Lock()
+    state = {"at": None, "value": None}
+
+    def wrapper():
+        with lock:
+            now = time.monotonic()
+            if state["at"] is None or now - state["at"] > ttl:
+                state["value"] = fn()
+                state["at"] = now
+            return state["value"]
+
+    return wrapper
@@ -0,0 +1,265 @@
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import BENCHMARK_ARGS, on_cache_hit, parse_benchmark
+
+PRECOMPOSE_CACHE_DIR = os.environ.get(
+    "PRECOMPOSE_CACHE_DIR", os.path.join("cache", "precomposed")
+)
+PRECOMPOSE_CACHE_MAX_BYTES = int(
+    os.environ.get("PRECOMPOSE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))
+)
+
+# Source image digests remembered in memory
+DIGEST_MEMO_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    SHA-256 of a file's contents.
+
+    Digests are remembered by inode, size and mtime, so the hard-linked
+    copies of a batch's images are only read once.
+    """
+    stat = os.stat(path)
+    identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if identity in _digests:
+            _digests.move_to_end(identity)
+            return _digests[identity]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    value = digest.hexdigest()
+    _remember(identity, value)
+    return value
+
+
+def _remember(identity, value):
+    with _digests_lock:
+        _digests[identity] = value
+        while len(_digests) > DIGEST_MEMO_SIZE:
+            _digests.popitem(last=False)
+
+
+def remember_digest(path, value):
+    """Record the digest of a file hashed elsewhere, e.g. while it was uploaded"""
+    stat = os.stat(path)
+    _remember((stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns), value)
+
+
+class FileCache:
+    """
+    Content-addressed cache of rendered files with size-bounded LRU
+    eviction.
+
+    Subclasses choose the key and how a missing entry is rendered. File
+    mtimes double as the LRU clock so several processes can share one cache
+    directory.
+    """
+
+    suffix = ""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        # Entries being rendered right now, so concurrent requests for the
+        # same entry wait for the first one instead of repeating it
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key):
+        return os.path.join(
+            os.path.abspath(self.cache_dir), key[:2], f"{key}{self.suffix}"
+        )
+
+    def fetch(self, key, render, on_hit=None):
+        """
+        Return the path of the entry for ``key``. On a miss ``render(tmp_path)``
+        writes it, and it is renamed into place once complete; on a hit
+        ``on_hit()`` is called.
+        """
+        path = self.path_for(key)
+
+        while True:
+            if os.path.exists(path):
+                os.utime(path)
+                with self._lock:
+                    self.hits += 1
+                if on_hit is not None:
+                    on_hit()
+                return path
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = threading.Event()
+                    break
+            # Another thread is rendering this entry; if it fails, try ourselves
+            pending.wait()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp{self.suffix}"
+        try:
+            render(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._pending.pop(key).set()
+
+        with self._lock:
+            self.misses += 1
+            if self._total_bytes is not None:
+                self._total_bytes += os.path.getsize(path)
+        self.evict()
+        return path
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.suffix) or ".tmp" in name:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            if self._total_bytes <= self.max_bytes:
+                return 0
+
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            freed = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                freed += size
+            self._total_bytes = total
+        return freed
+
+
+class StillCache(FileCache):
+    """
+    Pre-composed stills keyed by the hash of the source image bytes and the
+    filter chain applied to it. The chain already encodes the aspect ratio,
+    effect and text overlay, and editing an effect definition invalidates
+    its entries.
+    """
+
+    suffix = ".png"
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        super().__init__(
+            cache_dir or PRECOMPOSE_CACHE_DIR,
+            PRECOMPOSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+        )
+
+    def key(self, image_path, vf_string):
+        return hashlib.sha256(
+            f"{file_digest(image_path)}|{vf_string}".encode("utf-8")
+        ).hexdigest()
+
+    def get_or_create(self, image_path, vf_string, record=None):
+        """
+        Return the cached still for this image and filter chain, rendering
+        it on a miss. ``record`` gets the -benchmark stats of that render,
+        or CACHE_HIT.
+        """
+        return self.fetch(
+            self.key(image_path, vf_string),
+            lambda tmp_path: self._render(image_path, vf_string, tmp_path, record),
+            on_cache_hit(record),
+        )
+
+    def _render(self, image_path, vf_string, tmp_path, record=None):
+        command = [
+            "ffmpeg",
+            "-y",
+            *(BENCHMARK_ARGS if record is not None else []),
+            "-i",
+            os.path.abspath(image_path),
+            "-vf",
+            vf_string,
+            "-frames:v",
+            "1",
+            tmp_path,
+        ]
+        result = subprocess.run(
+            command, capture_output=True, text=True, encoding="utf-8", errors="replace"
+        )
+        if result.returncode != 0:
+            logger.error(
+                "Pre-composing failed",
+                extra={"image": image_path, "stderr": result.stderr[-4000:]},
+            )
+            raise Exception(
+                f"Pre-composing {os.path.basename(image_path)} failed with return code {result.returncode}"
+            )
+        if record is not None:
+            record(parse_benchmark(result.stderr))
+
+
+still_cache = StillCache()
+
+
+def precompose_entries(
+    target_dir, entries, vf_string, cache=None, workers=None, progress=None, record=None
+):
+    """
+    Render every image of a concat list through ``vf_string`` once.
+
+    Takes and returns [(filename, duration)]; the returned entries point at
+    the finished stills, so the encode that reads them needs no -vf chain.
+    ``progress`` is called with the fraction of stills done. ``record`` gets
+    the -benchmark stats of every still that had to be rendered.
+    """
+    cache = cache or still_cache
+    workers = workers or os.cpu_count() or 1
+    lock = threading.Lock()
+    done = 0
+
+    def compose(name):
+        nonlocal done
+        still = cache.get_or_create(os.path.join(target_dir, name), vf_string, record)
+        if progress is not None:
+            with lock:
+                done += 1
+                progress(done / len(entries))
+        return still
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stills = list(pool.map(compose, [name for name, _ in entries]))
+
+    return [(still, duration) for still, (_, duration) in zip(stills, entries)]
@@ -0,0 +1,328 @@
+"""
+Per-render cost profiles, and a report that ranks effects, aspect ratios
+and text overlays by what they cost to render.
+
+With RENDER_PROFILING=1 every FFmpeg process of a render runs with
+``-benchmark``, which prints its user and system CPU time and peak memory
+when it exits. A RenderStats collects those per stage ("audio",
+"precompose", "encode") next to the stage's wall time, and the reel's
+metadata keeps the result under "profiling".
+
+Stills, clips and soundtracks taken from their caches cost next to
+nothing, so they are counted as cache hits instead. The report only
+ranks the pre-compose and encode stages, and leaves out profiles with
+cache hits in either, so it reflects the settings and not the state of
+the caches.
+
+    python profiling.py                 # rank the reels in static/metadata
+    python profiling.py --json report.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+
+RENDER_PROFILING = os.environ.get("RENDER_PROFILING", "0") == "1"
+BENCHMARK_ARGS = ["-benchmark"]
+# Passed to a recorder instead of -benchmark stats for a cached step
+CACHE_HIT = {"cached": True}
+# Dimensions of a reel's settings the report groups by
+REPORT_DIMENSIONS = ("filter_effect", "aspect_ratio", "text_overlay")
+# Stages whose cost depends on those settings; the soundtrack is prepared
+# the same way for all of them
+SETTING_STAGES = ("precompose", "encode")
+
+_BENCH_TIMES = re.compile(
+    r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s", re.MULTILINE
+)
+# Newer FFmpeg prints KiB, older builds kB; both are 1024 bytes
+_BENCH_RSS = re.compile(r"bench: maxrss=(\d+)\s*(?:KiB|kB)", re.MULTILINE)
+
+
+def parse_benchmark(stderr):
+    """The CPU times in seconds and peak RSS in KiB from -benchmark output"""
+    bench = {}
+    times = _BENCH_TIMES.findall(stderr or "")
+    if times:
+        utime, stime, rtime = times[-1]
+        bench.update(utime=float(utime), stime=float(stime), rtime=float(rtime))
+    rss = _BENCH_RSS.findall(stderr or "")
+    if rss:
+        bench["maxrss_kb"] = int(rss[-1])
+    return bench
+
+
+def on_cache_hit(record):
+    """The ``on_hit`` callback of a cache lookup for ``record``, or None"""
+    if record is None:
+        return None
+    return lambda: record(CACHE_HIT)
+
+
+def _empty_stage():
+    return {
+        "seconds": 0.0,
+        "processes": 0,
+        "cache_hits": 0,
+        "utime": 0.0,
+        "stime": 0.0,
+        "rss_kb": 0,
+    }
+
+
+class RenderStats:
+    """
+    Cost of one render by stage. Recorders may be called from any thread;
+    a stage's wall time is measured once around all of its processes.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.frames = 0
+        self.video_seconds = 0.0
+        self.output_bytes = 0
+        self._lock = threading.Lock()
+
+    def recorder(self, stage):
+        """
+        A callable that adds one FFmpeg process's parse_benchmark(), or
+        one CACHE_HIT, to ``stage``
+        """
+
+        def record(bench):
+            with self._lock:
+                totals = self.stages.setdefault(stage, _empty_stage())
+                if bench.get("cached"):
+                    totals["cache_hits"] += 1
+                    return
+                totals["processes"] += 1
+                totals["utime"] += bench.get("utime", 0.0)
+                totals["stime"] += bench.get("stime", 0.0)
+                totals["rss_kb"] = max(totals["rss_kb"], bench.get("maxrss_kb", 0))
+
+        return record
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, _empty_stage())["seconds"] += seconds
+
+    def set_output(self, frames, video_seconds, output_path):
+        self.frames = frames
+        self.video_seconds = video_seconds
+        self.output_bytes = os.path.getsize(output_path)
+
+    def as_dict(self):
+        """
+        The profile stored with a reel: achieved fps and speed of the encode,
+        total CPU time and peak memory, output bitrate and each stage
+        """
+        stages = {
+            name: {
+                "seconds": round(totals["seconds"], 3),
+                "processes": totals["processes"],
+                "cache_hits": totals["cache_hits"],
+                "utime": round(totals["utime"], 3),
+                "stime": round(totals["stime"], 3),
+                "max_rss_mb": round(totals["rss_kb"] / 1024, 1),
+            }
+            for name, totals in self.stages.items()
+        }
+        encode_seconds = self.stages.get("encode", _empty_stage())["seconds"]
+        return {
+            "seconds": round(sum(stage["seconds"] for stage in stages.values()), 3),
+            "frames": self.frames,
+            "video_seconds": round(self.video_seconds, 3),
+            "fps": round(self.frames / encode_seconds, 1) if encode_seconds else None,
+            "speed": (
+                round(self.video_seconds / encode_seconds, 2)
+                if encode_seconds
+                else None
+            ),
+            "utime": round(sum(stage["utime"] for stage in stages.values()), 3),
+            "stime": round(sum(stage["stime"] for stage in stages.values()), 3),
+            "max_rss_mb": max(
+                (stage["max_rss_mb"] for stage in stages.values()), default=0.0
+            ),
+            "cache_hits": sum(stage["cache_hits"] for stage in stages.values()),
+            "output_bytes": self.output_bytes,
+            "output_bitrate_kbps": (
+                round(self.output_bytes * 8 / 1000 / self.video_seconds, 1)
+                if self.video_seconds
+                else None
+            ),
+            "stages": stages,
+        }
+
+
+def _read_profile(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(metadata, dict) and metadata.get("profiling"):
+        return metadata
+    return None
+
+
+def load_profiles(metadata_dir):
+    """Metadata of every reel in ``metadata_dir`` that was rendered with profiling"""
+    reels = []
+    for name in sorted(os.listdir(metadata_dir)):
+        if name.endswith(".json"):
+            metadata = _read_profile(os.path.join(metadata_dir, name))
+            if metadata is not None:
+                reels.append(metadata)
+    return reels
+
+
+class ProfileCache:
+    """
+    The profiled reels of a metadata folder, re-reading only the files
+    added or changed since the last call
+    """
+
+    def __init__(self, metadata_dir):
+        self.metadata_dir = metadata_dir
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def profiles(self):
+        metadata_dir = os.path.abspath(self.metadata_dir)
+        try:
+            entries = sorted(
+                (entry.path, entry.stat())
+                for entry in os.scandir(metadata_dir)
+                if entry.name.endswith(".json")
+            )
+        except OSError:
+            entries = []
+        with self._lock:
+            files = {}
+            for path, stat in entries:
+                signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                cached = self._files.get(path)
+                if cached is None or cached[0] != signature:
+                    cached = (signature, _read_profile(path))
+                files[path] = cached
+            self._files = files
+            return [metadata for _, metadata in files.values() if metadata is not None]
+
+    def report(self):
+        return rank_profiles(self.profiles())
+
+
+def _group_key(metadata, dimension):
+    value = metadata.get(dimension)
+    if dimension == "text_overlay":
+        return "text" if value else "none"
+    return value or "none"
+
+
+def _summarize(group, reels):
+    """Totals of a group's profiles, normalized by seconds of video rendered"""
+    profiles = [reel["profiling"] for reel in reels]
+    video = sum(profile["video_seconds"] for profile in profiles) or 1
+    frames = sum(profile["frames"] for profile in profiles)
+    encode_seconds = sum(
+        profile["stages"].get("encode", {}).get("seconds", 0) for profile in profiles
+    )
+
+    def stage_sum(key, stages=SETTING_STAGES):
+        return sum(
+            totals[key]
+            for profile in profiles
+            for name, totals in profile["stages"].items()
+            if name in stages
+        )
+
+    def cpu(stages=SETTING_STAGES):
+        return round(
+            (stage_sum("utime", stages) + stage_sum("stime", stages)) / video, 3
+        )
+
+    return {
+        "group": group,
+        "reels": len(reels),
+        "cpu_per_video_second": cpu(),
+        "precompose_cpu_per_video_second": cpu(("precompose",)),
+        "encode_cpu_per_video_second": cpu(("encode",)),
+        "wall_per_video_second": round(stage_sum("seconds") / video, 3),
+        "fps": round(frames / encode_seconds, 1) if encode_seconds else None,
+        "max_rss_mb": max(profile["max_rss_mb"] for profile in profiles),
+        "output_bitrate_kbps": round(
+            sum(profile["output_bytes"] for profile in profiles) * 8 / 1000 / video,
+            1,
+        ),
+    }
+
+
+def rank_profiles(reels):
+    """
+    Rank every effect, aspect ratio and text overlay (with or without) by
+    CPU seconds per second of video, most expensive first. Splitting the
+    CPU time into pre-composing and encoding shows whether a setting costs
+    in its filter chain or in libx264. Profiles with cache hits in those
+    stages are only counted, as "cached_reels".
+    """
+    measured = [
+        reel
+        for reel in reels
+        if not any(
+            reel["profiling"]["stages"].get(stage, {}).get("cache_hits")
+            for stage in SETTING_STAGES
+        )
+    ]
+    report = {"reels": len(measured), "cached_reels": len(reels) - len(measured)}
+    for dimension in REPORT_DIMENSIONS:
+        groups = {}
+        for metadata in measured:
+            groups.setdefault(_group_key(metadata, dimension), []).append(metadata)
+        report[dimension] = sorted(
+            (_summarize(group, members) for group, members in groups.items()),
+            key=lambda row: row["cpu_per_video_second"],
+            reverse=True,
+        )
+    return report
+
+
+def profiling_report(metadata_dir):
+    """rank_profiles() over the profiled reels in ``metadata_dir``"""
+    return rank_profiles(load_profiles(metadata_dir))
+
+
+def print_report(report, out=sys.stdout):
+    out.write(
+        f"{report['reels']} profiled reels, {report['cached_reels']} left out "
+        "for cache hits\n"
+    )
+    for dimension in REPORT_DIMENSIONS:
+        out.write(
+            f"\n{dimension:<16} {'reels':>5} {'cpu/s':>7} {'filter':>7} "
+            f"{'encode':>7} {'wall/s':>7} {'fps':>7} {'rss MB':>7} {'kbps':>7}\n"
+        )
+        for row in report[dimension]:
+            out.write(
+                f"{row['group']:<16} {row['reels']:>5} "
+                f"{row['cpu_per_video_second']:>7} "
+                f"{row['precompose_cpu_per_video_second']:>7} "
+                f"{row['encode_cpu_per_video_second']:>7} "
+                f"{row['wall_per_video_second']:>7} {row['fps'] or '-':>7} "
+                f"{row['max_rss_mb']:>7} {row['output_bitrate_kbps']:>7}\n"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--metadata-dir", default=os.path.join("static", "metadata"))
+    parser.add_argument("--json", help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = profiling_report(args.metadata_dir)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
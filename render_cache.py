@@ -0,0 +1,144 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from metrics import registry
+from precompose import file_digest
+from render_engine import parse_concat_list
+
+RENDER_CACHE_DB = os.environ.get(
+    "RENDER_CACHE_DB", os.path.join("cache", "render_cache.db")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS renders (
+    reel_name TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_fingerprint ON renders (fingerprint);
+"""
+
+LOOKUPS = registry.counter(
+    "reel_render_cache_lookups_total",
+    "Render cache lookups for submitted reels",
+    ("result",),
+)
+
+
+def render_fingerprint(target_dir):
+    """
+    Fingerprint of everything that determines a render: the image bytes in
+    concat order with their durations, the audio bytes and settings.txt
+    """
+    parts = []
+    for name, duration in parse_concat_list(os.path.join(target_dir, "input.txt")):
+        parts.append(f"image:{file_digest(os.path.join(target_dir, name))}:{duration}")
+    parts.append(f"audio:{file_digest(os.path.join(target_dir, 'audio.mp3'))}")
+
+    settings_path = os.path.join(target_dir, "settings.txt")
+    if os.path.exists(settings_path):
+        with open(settings_path, "r", encoding="utf-8") as f:
+            parts += sorted(f"setting:{line.rstrip()}" for line in f if line.strip())
+
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Maps render fingerprints to finished reels in ``reels_dir``.
+
+    Entries live exactly as long as their reel: they are dropped when the
+    reel is deleted, and lookups skip and forget reels whose MP4 is gone.
+    """
+
+    def __init__(self, db_path=None, reels_dir=None):
+        self.db_path = db_path or RENDER_CACHE_DB
+        self.reels_dir = reels_dir or os.path.join("static", "reels")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+            )
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _reel_path(self, reel_name):
+        return os.path.join(self.reels_dir, f"{reel_name}.mp4")
+
+    def lookup(self, fingerprint):
+        """Return the name of an existing reel with this fingerprint, or None"""
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "SELECT reel_name FROM renders WHERE fingerprint = ? "
+                    "ORDER BY created_at",
+                    (fingerprint,),
+                )
+                .fetchall()
+            )
+            for (reel_name,) in rows:
+                if os.path.exists(self._reel_path(reel_name)):
+                    self.hits += 1
+                    LOOKUPS.inc(result="hit")
+                    return reel_name
+                self._conn.execute(
+                    "DELETE FROM renders WHERE reel_name = ?", (reel_name,)
+                )
+            self.misses += 1
+            LOOKUPS.inc(result="miss")
+        return None
+
+    def store(self, fingerprint, reel_name):
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO renders (reel_name, fingerprint, created_at) "
+                "VALUES (?, ?, ?)",
+                (reel_name, fingerprint, time.time()),
+            )
+
+    def forget(self, reel_name):
+        """Drop the entry for a deleted reel"""
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM renders WHERE reel_name = ?", (reel_name,)
+            )
+
+    def reuse(self, cached_name, reel_name):
+        """
+        Publish the cached reel under ``reel_name``. Hard links share the
+        bytes on disk; a copy is made if linking is not possible.
+        """
+        source = self._reel_path(cached_name)
+        target = self._reel_path(reel_name)
+        if os.path.abspath(source) == os.path.abspath(target):
+            return target
+
+        # Link under a temporary name and rename over any old reel, so the
+        # old file's other hard links are left untouched
+        tmp_path = f"{target}.part"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, target)
+        return target
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+render_cache = RenderCache()
@@ -0,0 +1,815 @@
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from audio import prepare_audio
+from metrics import registry
+from precompose import precompose_entries
+from profiling import BENCHMARK_ARGS, parse_benchmark
+from segment_cache import segment_cache
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_SECONDS = registry.histogram(
+    "reel_ffmpeg_seconds",
+    "FFmpeg wall time per render stage",
+    ("stage", "aspect_ratio", "filter_effect", "quality"),
+)
+
+FRAME_RATE = 30
+GOP_SIZE = 2 * FRAME_RATE  # keyframe every 2 seconds
+
+# Reels with at least this many images are split into segments that are
+# encoded in parallel. See benchmarks/bench_segmented.py for the crossover.
+SEGMENT_MIN_IMAGES = int(os.environ.get("SEGMENT_MIN_IMAGES", "12"))
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", "6"))
+
+# New reels are encoded as a whole, single pass or segmented. Edited reels
+# always encode every image as its own cached clip; with INCREMENTAL_RENDER=1
+# new reels do too, so even their first edit only encodes what changed
+INCREMENTAL_RENDER = os.environ.get("INCREMENTAL_RENDER", "0") == "1"
+
+STDERR_TAIL_LINES = 200
+
+# Move the moov atom to the front so playback can start before the whole
+# file has downloaded
+FASTSTART_ARGS = ["-movflags", "+faststart"]
+
+# Apply the filter chain to each still once instead of to every output frame
+PRECOMPOSE = os.environ.get("PRECOMPOSE", "1") == "1"
+PRECOMPOSED_LIST = "input_precomposed.txt"
+PREVIEW_LIST = "input_preview.txt"
+
+# Full-size output frame for each aspect ratio
+ASPECT_RATIOS = {
+    "9:16": (1080, 1920),
+    "16:9": (1920, 1080),
+    "1:1": (1080, 1080),
+}
+
+# Named quality tiers. "preview" is a quick low-resolution proxy of the
+# first few images, rendered to static/drafts so it never reaches the gallery
+PREVIEW_MAX_IMAGES = int(os.environ.get("PREVIEW_MAX_IMAGES", "5"))
+QUALITY_PROFILES = {
+    "final": {
+        "scale": 1.0,
+        "frame_rate": FRAME_RATE,
+        "preset": None,
+        "crf": None,
+        "max_images": None,
+        "output_dir": "reels",
+    },
+    "preview": {
+        "scale": 1 / 3,
+        "frame_rate": 15,
+        "preset": "ultrafast",
+        "crf": 32,
+        "max_images": PREVIEW_MAX_IMAGES,
+        "output_dir": "drafts",
+    },
+}
+DEFAULT_QUALITY = "final"
+
+
+# Video filter effects by name. ffmpeg_probe checks every chain against the
+# installed FFmpeg build before it is offered to users
+FILTER_EFFECTS = {
+    # Basic Filters
+    "none": "",
+    "grayscale": "hue=s=0",
+    "sepia": "eq=gamma=1.0:saturation=1.2:contrast=1.0,colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131:0",
+    # Color Adjustments
+    "vibrant": "eq=saturation=1.6:contrast=1.2",
+    "warm": "colorbalance=rs=.3:gs=.1:bs=-.3,eq=saturation=1.1",
+    "cool": "colorbalance=rs=-.3:gs=-.1:bs=.3,eq=saturation=1.1",
+    "vintage": "colorchannelmixer=.393:.769:.189:0:.349:.686:.168:0:.272:.534:.131,vignette=angle=PI/3",
+    # Dramatic Filters
+    "noir": "hue=s=0,eq=contrast=1.5:brightness=-0.05",
+    "dramatic": "eq=contrast=1.4:brightness=-0.1:saturation=0.8",
+    "cinematic": "eq=contrast=1.3:brightness=-0.05:saturation=1.1,colorbalance=rs=.1:gs=-.05:bs=.15",
+    # Bright & Light
+    "bright": "eq=brightness=0.1:contrast=1.1:saturation=1.2",
+    "soft": "eq=gamma=1.2:saturation=0.9,gblur=sigma=0.5",
+    "dream": "eq=gamma=1.3:saturation=0.8,gblur=sigma=1",
+    # Instagram-style Filters
+    "nashville": "colorchannelmixer=.6:.4:.15:0:.45:.45:.3:0:.2:.2:.15,eq=contrast=1.2:brightness=0.05",
+    "lofi": "eq=contrast=1.5:saturation=1.2,colorbalance=rs=.2:bs=-.1",
+    "xpro": "eq=contrast=1.3:saturation=1.2,colorbalance=rs=-.1:gs=.05:bs=.2,curves=all='0/0.1 0.5/0.58 1/0.9'",
+    # Modern Filters
+    "fade": "eq=saturation=0.7:contrast=0.9:brightness=0.05",
+    "sharp": "unsharp=5:5:1.0:5:5:0.0,eq=contrast=1.1",
+    "vignette": "vignette=angle=PI/3",
+    "blur_edges": "boxblur=luma_radius=3:luma_power=1,pad=iw:ih:0:0:color=black",
+}
+
+
+def get_filter_string(filter_effect):
+    """
+    Return FFmpeg filter string based on selected effect
+    """
+    return FILTER_EFFECTS.get(filter_effect, "")
+
+
+def get_quality_profile(quality):
+    """Return the named quality profile, falling back to the final render"""
+    return QUALITY_PROFILES.get(quality, QUALITY_PROFILES[DEFAULT_QUALITY])
+
+
+def get_dimensions(aspect_ratio, scale=1.0):
+    """Return the output (width, height) for an aspect ratio, scaled to even sizes"""
+    width, height = ASPECT_RATIOS.get(aspect_ratio, ASPECT_RATIOS["9:16"])
+    return 2 * round(width * scale / 2), 2 * round(height * scale / 2)
+
+
+def build_video_filter(width, height, filter_effect="none", text_overlay="", scale=1.0):
+    """
+    Build the -vf chain: fit and pad to the frame, then the effect and the
+    optional text overlay, sized by ``scale`` to match the frame
+    """
+    vf_parts = [
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black",
+    ]
+
+    # Add video filter effect
+    filter_string = get_filter_string(filter_effect)
+    if filter_string:
+        vf_parts.append(filter_string)
+
+    # Add text overlay if provided
+    if text_overlay:
+        text_clean = text_overlay.replace("'", "'\\''").replace(":", "\\:")
+        text_filter = f"drawtext=text='{text_clean}':fontsize={round(60 * scale)}:fontcolor=white:x=(w-text_w)/2:y=h-{round(150 * scale)}:box=1:boxcolor=black@0.5:boxborderw={round(10 * scale)}"
+        vf_parts.append(text_filter)
+
+    return ",".join(vf_parts)
+
+
+def video_filter_args(vf_string):
+    """-vf arguments, or nothing when the stills are already pre-composed"""
+    return ["-vf", vf_string] if vf_string else []
+
+
+def video_encoder_args(profile=None, threads=None):
+    """
+    Encoder settings shared by single-pass and segmented renders. ``threads``
+    caps libx264's threads; by default it uses every core.
+    """
+    profile = profile or get_quality_profile(DEFAULT_QUALITY)
+    args = [
+        "-c:v",
+        "libx264",
+        "-r",
+        str(profile["frame_rate"]),
+        "-g",
+        str(2 * profile["frame_rate"]),
+    ]
+    if profile["preset"]:
+        args += ["-preset", profile["preset"]]
+    if profile["crf"] is not None:
+        args += ["-crf", str(profile["crf"])]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args + ["-pix_fmt", "yuv420p"]
+
+
+def audio_codec_args(audio_path):
+    """Stream-copy a prepared AAC track; transcode anything else"""
+    if audio_path.endswith(".m4a"):
+        return ["-c:a", "copy"]
+    return ["-c:a", "aac"]
+
+
+def _parse_progress_seconds(key, value):
+    """Encoded position in seconds from an FFmpeg -progress line, or None"""
+    # out_time_ms is also in microseconds; it is what older FFmpeg builds emit
+    if key in ("out_time_us", "out_time_ms") and value.lstrip("-").isdigit():
+        return max(0, int(value)) / 1_000_000
+    return None
+
+
+def run_ffmpeg(command, cwd, label, on_progress=None, record=None):
+    """
+    Run an FFmpeg command in ``cwd`` and raise if it fails.
+
+    FFmpeg's machine-readable ``-progress`` output is read as it is written
+    and ``on_progress`` is called with the encoded position in seconds.
+    Only the last STDERR_TAIL_LINES lines of stderr are kept. They are
+    printed on failure and returned on success. With ``record``, FFmpeg
+    runs with -benchmark and ``record`` gets its parse_benchmark() stats.
+    """
+    benchmark = BENCHMARK_ARGS if record is not None else []
+    command = [command[0], "-progress", "pipe:1", "-nostats", *benchmark, *command[1:]]
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        cwd=cwd,
+    )
+
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    drain = threading.Thread(target=stderr_tail.extend, args=(process.stderr,))
+    drain.daemon = True
+    drain.start()
+
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        seconds = _parse_progress_seconds(key, value)
+        if seconds is not None and on_progress is not None:
+            on_progress(seconds)
+
+    returncode = process.wait()
+    drain.join()
+    stderr = "".join(stderr_tail)
+
+    if returncode != 0:
+        logger.error(
+            "FFmpeg failed",
+            extra={"label": label, "returncode": returncode, "stderr_tail": stderr},
+        )
+        raise Exception(f"FFmpeg failed with return code {returncode}")
+
+    if record is not None:
+        record(parse_benchmark(stderr))
+    return stderr
+
+
+def parse_concat_list(path):
+    """
+    Read an FFmpeg concat list into [(filename, duration)], dropping the
+    trailing repeat of the last image
+    """
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("file '") and line.endswith("'"):
+                entries.append([line[len("file '") : -1], None])
+            elif line.startswith("duration ") and entries:
+                entries[-1][1] = float(line.split(" ", 1)[1])
+    return [(name, duration) for name, duration in entries if duration is not None]
+
+
+def write_concat_list(path, entries):
+    """Write [(filename, duration)] as an FFmpeg concat list"""
+    with open(path, "w", encoding="utf-8") as f:
+        for name, duration in entries:
+            f.write(f"file '{name}'\n")
+            f.write(f"duration {duration}\n")
+        # Add the last file again without duration
+        f.write(f"file '{entries[-1][0]}'\n")
+
+
+def split_segments(entries, segment_seconds=SEGMENT_SECONDS, frame_rate=FRAME_RATE):
+    """
+    Group images into chunks of roughly ``segment_seconds``.
+
+    A chunk is closed on an image boundary once it is long enough and its
+    frame count is a whole number of GOPs, so every segment starts on the
+    keyframe a single-pass encode would have put there. Chunks that never
+    line up with the GOP are closed at twice the target length.
+    """
+    target_frames = int(segment_seconds * frame_rate)
+    gop_size = 2 * frame_rate
+    segments = []
+    current = []
+    frames = 0
+
+    for name, duration in entries:
+        current.append((name, duration))
+        frames += round(duration * frame_rate)
+        aligned = frames % gop_size == 0
+        if (frames >= target_frames and aligned) or frames >= 2 * target_frames:
+            segments.append(current)
+            current = []
+            frames = 0
+
+    if current:
+        segments.append(current)
+    return segments
+
+
+def should_segment(image_count, threads=None):
+    return image_count >= SEGMENT_MIN_IMAGES and (threads or os.cpu_count() or 1) > 1
+
+
+def _encode_segment(
+    target_dir,
+    index,
+    entries,
+    vf_string,
+    threads,
+    profile,
+    on_progress=None,
+    record=None,
+):
+    list_name = f"segment_{index:03d}.txt"
+    segment_name = f"segment_{index:03d}.mp4"
+    write_concat_list(os.path.join(target_dir, list_name), entries)
+    frame_rate = profile["frame_rate"]
+    frame_count = sum(round(duration * frame_rate) for _, duration in entries)
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        list_name,
+        *video_filter_args(vf_string),
+        "-an",
+        *video_encoder_args(profile, threads),
+        "-frames:v",
+        str(frame_count),
+        segment_name,
+    ]
+    run_ffmpeg(
+        command,
+        target_dir,
+        f"{os.path.basename(target_dir)} {segment_name}",
+        on_progress,
+        record,
+    )
+    return segment_name
+
+
+def create_reel_segmented(
+    target_dir,
+    output_path,
+    vf_string,
+    list_name="input.txt",
+    workers=None,
+    on_progress=None,
+    profile=None,
+    threads=None,
+    audio_path="audio.mp3",
+    record=None,
+):
+    """
+    Encode the reel in GOP-aligned chunks on separate cores, join them with
+    stream copy and mux the audio once at the end.
+
+    ``on_progress`` receives the seconds encoded so far across all segments.
+    ``threads`` is the total thread budget shared by the segment encoders.
+    """
+    profile = profile or get_quality_profile(DEFAULT_QUALITY)
+    entries = parse_concat_list(os.path.join(target_dir, list_name))
+    segments = split_segments(entries, frame_rate=profile["frame_rate"])
+    cores = threads or os.cpu_count() or 1
+    workers = min(workers or cores, len(segments))
+    threads = max(1, cores // workers)
+    encoded = [0.0] * len(segments)
+    lock = threading.Lock()
+
+    def segment_progress(index):
+        def report(seconds):
+            with lock:
+                encoded[index] = seconds
+                total = sum(encoded)
+            on_progress(total)
+
+        return report if on_progress is not None else None
+
+    logger.info(
+        "Encoding segments", extra={"segments": len(segments), "workers": workers}
+    )
+
+    # Each segment is its own FFmpeg process, so threads are enough to keep
+    # every core busy
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            segment_names = list(
+                pool.map(
+                    lambda item: _encode_segment(
+                        target_dir,
+                        item[0],
+                        item[1],
+                        vf_string,
+                        threads,
+                        profile,
+                        segment_progress(item[0]),
+                        record,
+                    ),
+                    enumerate(segments),
+                )
+            )
+
+        join_segments(target_dir, output_path, segment_names, audio_path, record)
+    finally:
+        leftovers = ["segments.txt"]
+        for index in range(len(segments)):
+            leftovers += [f"segment_{index:03d}.txt", f"segment_{index:03d}.mp4"]
+        for name in leftovers:
+            path = os.path.join(target_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def join_segments(target_dir, output_path, segment_paths, audio_path, record=None):
+    """Concatenate encoded clips with stream copy and mux the audio once"""
+    with open(os.path.join(target_dir, "segments.txt"), "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            f.write(f"file '{path}'\n")
+
+    command = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        "segments.txt",
+        "-i",
+        audio_path,
+        "-map",
+        "0:v",
+        "-map",
+        "1:a",
+        "-c:v",
+        "copy",
+        *audio_codec_args(audio_path),
+        "-shortest",
+        *FASTSTART_ARGS,
+        "-f",
+        "mp4",
+        output_path,
+    ]
+    run_ffmpeg(command, target_dir, os.path.basename(target_dir), record=record)
+
+
+def encode_incremental(
+    target_dir,
+    output_path,
+    vf_string,
+    entries,
+    on_progress=None,
+    profile=None,
+    threads=None,
+    audio_path="audio.mp3",
+    cache=None,
+    record=None,
+):
+    """
+    Encode each image as its own clip through the segment cache, then join
+    the clips with stream copy and mux the audio.
+
+    Clips already in the cache are reused, so re-rendering an edited reel
+    only encodes its new or changed images. Every clip starts on a
+    keyframe. ``on_progress`` receives the seconds of the reel that are
+    ready. Returns the number of clips that had to be encoded.
+    """
+    cache = cache or segment_cache
+    profile = profile or get_quality_profile(DEFAULT_QUALITY)
+    frame_rate = profile["frame_rate"]
+    cores = threads or os.cpu_count() or 1
+    workers = min(cores, len(entries))
+    encoder_args = video_encoder_args(profile, max(1, cores // workers))
+    lock = threading.Lock()
+    ready = 0.0
+    encoded = 0
+
+    def encode(entry):
+        nonlocal ready, encoded
+        name, duration = entry
+        image_path = os.path.join(target_dir, name)
+        frames = round(duration * frame_rate)
+        key = cache.key(image_path, frames, vf_string, encoder_args)
+        fresh = not os.path.exists(cache.path_for(key))
+        path = cache.get_or_create(
+            image_path, frames, frame_rate, vf_string, encoder_args, record
+        )
+        with lock:
+            ready += duration
+            encoded += fresh
+            seconds = ready
+        if on_progress is not None:
+            on_progress(seconds)
+        return path
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            segment_paths = list(pool.map(encode, entries))
+        logger.info(
+            "Segments ready",
+            extra={"segments": len(entries), "encoded": encoded},
+        )
+        join_segments(target_dir, output_path, segment_paths, audio_path, record)
+    finally:
+        list_path = os.path.join(target_dir, "segments.txt")
+        if os.path.exists(list_path):
+            os.remove(list_path)
+    return encoded
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    """
+    Everything one render needs, with absolute paths.
+
+    A render reads only its spec and passes ``cwd=`` to FFmpeg, never
+    relying on the process-wide working directory, so many renders can run
+    on threads of one process. Renders of different upload folders are
+    independent; the job queues run one render per folder at a time.
+    """
+
+    upload_dir: str
+    output_path: str
+    text_overlay: str = ""
+    aspect_ratio: str = "9:16"
+    filter_effect: str = "none"
+    quality: str = DEFAULT_QUALITY
+    threads: Optional[int] = None
+    segmented: Optional[bool] = None
+    precompose: Optional[bool] = None
+    incremental: bool = False
+
+    def __post_init__(self):
+        for name in ("upload_dir", "output_path"):
+            if not os.path.isabs(getattr(self, name)):
+                raise ValueError(f"RenderSpec.{name} must be an absolute path")
+
+    @classmethod
+    def for_folder(
+        cls,
+        folder,
+        reel_name,
+        base_dir=None,
+        quality=DEFAULT_QUALITY,
+        upload_folder="user_uploads",
+        **options,
+    ):
+        """
+        The spec for ``<upload_folder>/<folder>`` rendered to
+        ``<base_dir>/static/<reels or drafts>/<reel_name>.mp4``. A relative
+        ``upload_folder`` is taken from ``base_dir``, which defaults to the
+        current directory, read once here.
+        """
+        base_dir = os.path.abspath(base_dir or os.getcwd())
+        output_dir = get_quality_profile(quality)["output_dir"]
+        return cls(
+            upload_dir=os.path.join(base_dir, upload_folder, folder),
+            output_path=os.path.join(
+                base_dir, "static", output_dir, f"{reel_name}.mp4"
+            ),
+            quality=quality,
+            **options,
+        )
+
+
+def create_reel(
+    folder,
+    reel_name,
+    text_overlay="",
+    aspect_ratio="9:16",
+    filter_effect="none",
+    segmented=None,
+    precompose=None,
+    progress=None,
+    quality=DEFAULT_QUALITY,
+    threads=None,
+    incremental=False,
+    stats=None,
+    upload_folder="user_uploads",
+):
+    """
+    Render ``<upload_folder>/<folder>`` to ``static/reels/<reel_name>.mp4``.
+
+    ``segmented`` forces the parallel segmented encode on or off; by default
+    it is used for reels with at least SEGMENT_MIN_IMAGES images.
+    ``precompose`` overrides the PRECOMPOSE setting.
+    ``progress`` is called as ``progress(stage, fraction)`` while rendering,
+    with stage "precompose", "audio" or "encode".
+    ``quality`` names a QUALITY_PROFILES entry; "preview" renders a small
+    proxy of the first PREVIEW_MAX_IMAGES images to ``static/drafts``.
+    ``threads`` caps the CPU threads every FFmpeg step may use; by default
+    each uses all cores.
+    ``incremental`` encodes every image as a cached clip and joins them
+    (see encode_incremental) instead of encoding the sequence as a whole.
+    ``stats``, a profiling.RenderStats, collects the cost of every stage.
+
+    Returns the path of the rendered MP4.
+    """
+    spec = RenderSpec.for_folder(
+        folder,
+        reel_name,
+        quality=quality,
+        upload_folder=upload_folder,
+        text_overlay=text_overlay,
+        aspect_ratio=aspect_ratio,
+        filter_effect=filter_effect,
+        threads=threads,
+        segmented=segmented,
+        precompose=precompose,
+        incremental=incremental,
+    )
+    return render(spec, progress, stats)
+
+
+def render(spec, progress=None, stats=None):
+    """
+    Render ``spec`` and return the path of the MP4. Safe to call from
+    several threads at once.
+
+    ``progress`` is called as ``progress(stage, fraction)`` while rendering,
+    with stage "precompose", "audio" or "encode". With ``stats``, a
+    profiling.RenderStats, every FFmpeg process runs with -benchmark and
+    the wall time, CPU time and peak memory of each stage are recorded.
+    """
+    report = progress or (lambda stage, fraction: None)
+
+    def recorder(stage):
+        return stats.recorder(stage) if stats is not None else None
+
+    def stage_timer(stage, started):
+        if stats is not None:
+            stats.add_time(stage, time.perf_counter() - started)
+
+    profile = get_quality_profile(spec.quality)
+    labels = {
+        "aspect_ratio": (
+            spec.aspect_ratio if spec.aspect_ratio in ASPECT_RATIOS else "9:16"
+        ),
+        "filter_effect": (
+            spec.filter_effect if spec.filter_effect in FILTER_EFFECTS else "none"
+        ),
+        "quality": (
+            spec.quality if spec.quality in QUALITY_PROFILES else DEFAULT_QUALITY
+        ),
+    }
+    threads = spec.threads
+    started = time.perf_counter()
+
+    output_path = spec.output_path
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Set dimensions based on aspect ratio and quality
+    width, height = get_dimensions(spec.aspect_ratio, profile["scale"])
+    vf_string = build_video_filter(
+        width, height, spec.filter_effect, spec.text_overlay, profile["scale"]
+    )
+
+    # FFmpeg runs with cwd= the upload folder, so the concat lists can name
+    # images relative to it
+    target_dir = spec.upload_dir
+
+    list_name = "input.txt"
+    entries = parse_concat_list(os.path.join(target_dir, list_name))
+    if profile["max_images"] and len(entries) > profile["max_images"]:
+        entries = entries[: profile["max_images"]]
+        list_name = PREVIEW_LIST
+        write_concat_list(os.path.join(target_dir, list_name), entries)
+
+    # Cut the soundtrack to the reel and transcode it once; the encode
+    # then only copies it
+    total_seconds = sum(duration for _, duration in entries) or 1
+    report("audio", 0.0)
+    audio_started = time.perf_counter()
+    with FFMPEG_SECONDS.time(stage="audio", **labels):
+        audio_path = prepare_audio(target_dir, total_seconds, record=recorder("audio"))
+    stage_timer("audio", audio_started)
+
+    if PRECOMPOSE if spec.precompose is None else spec.precompose:
+        # Filter each still once; the encode then only has finished frames
+        precompose_started = time.perf_counter()
+        with FFMPEG_SECONDS.time(stage="precompose", **labels):
+            stills = precompose_entries(
+                target_dir,
+                entries,
+                vf_string,
+                workers=threads,
+                progress=lambda fraction: report("precompose", fraction),
+                record=recorder("precompose"),
+            )
+        stage_timer("precompose", precompose_started)
+        list_name = PRECOMPOSED_LIST
+        write_concat_list(os.path.join(target_dir, list_name), stills)
+        vf_string = None
+
+    segmented = spec.segmented
+    if spec.incremental:
+        segmented = False
+    elif segmented is None:
+        segmented = should_segment(len(entries), threads)
+
+    # Encode to a temporary name and rename into place at the end, so the
+    # gallery never sees a half-written file and hard links to an older reel
+    # of the same name are not overwritten in place
+    part_path = f"{output_path}.part"
+
+    def encode_progress(seconds):
+        report("encode", min(1.0, seconds / total_seconds))
+
+    try:
+        report("encode", 0.0)
+        encode_started = time.perf_counter()
+        if spec.incremental:
+            encode_incremental(
+                target_dir,
+                part_path,
+                vf_string,
+                parse_concat_list(os.path.join(target_dir, list_name)),
+                encode_progress,
+                profile,
+                threads,
+                audio_path,
+                record=recorder("encode"),
+            )
+        elif segmented:
+            create_reel_segmented(
+                target_dir,
+                part_path,
+                vf_string,
+                list_name,
+                on_progress=encode_progress,
+                profile=profile,
+                threads=threads,
+                audio_path=audio_path,
+                record=recorder("encode"),
+            )
+        else:
+            encode_single_pass(
+                target_dir,
+                part_path,
+                vf_string,
+                list_name,
+                encode_progress,
+                profile,
+                threads,
+                audio_path,
+                recorder("encode"),
+            )
+        FFMPEG_SECONDS.observe(
+            time.perf_counter() - encode_started, stage="encode", **labels
+        )
+        stage_timer("encode", encode_started)
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    if stats is not None:
+        frames = sum(round(duration * profile["frame_rate"]) for _, duration in entries)
+        stats.set_output(frames, total_seconds, output_path)
+
+    logger.info(
+        "Reel created",
+        extra={
+            "reel": os.path.splitext(os.path.basename(output_path))[0],
+            "images": len(entries),
+            "segmented": segmented,
+            "incremental": spec.incremental,
+            "seconds": round(time.perf_counter() - started, 3),
+            **labels,
+        },
+    )
+    return output_path
+
+
+def encode_single_pass(
+    target_dir,
+    output_path,
+    vf_string,
+    list_name="input.txt",
+    on_progress=None,
+    profile=None,
+    threads=None,
+    audio_path="audio.mp3",
+    record=None,
+):
+    """Encode the whole concat list and mux the audio with one FFmpeg process"""
+    # Build FFmpeg command
+    command = [
+        "ffmpeg",
+        "-y",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        list_name,
+        "-i",
+        audio_path,
+        *video_filter_args(vf_string),
+        *audio_codec_args(audio_path),
+        "-shortest",
+        *video_encoder_args(profile, threads),
+        *FASTSTART_ARGS,
+        "-f",
+        "mp4",
+        output_path,
+    ]
+
+    logger.debug("Running FFmpeg", extra={"command": " ".join(command)})
+    run_ffmpeg(command, target_dir, os.path.basename(target_dir), on_progress, record)
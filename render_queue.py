@@ -0,0 +1,230 @@
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+DEAD = "dead"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    folder TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    available_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_available ON jobs (status, available_at);
+"""
+
+
+class RenderQueue:
+    """
+    Durable render queue backed by SQLite.
+
+    Every upload folder has one row. Jobs move from ``pending`` to
+    ``running`` when a worker claims them and end up ``done``, or ``dead``
+    once they have failed ``max_attempts`` times. Failed jobs are retried
+    with exponential backoff starting at ``retry_delay`` seconds.
+    """
+
+    def __init__(self, db_path="render_queue.db", max_attempts=3, retry_delay=30):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def enqueue(self, folder):
+        """Add a folder to the queue. Returns False if it is already known."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO jobs "
+                "(folder, status, created_at, updated_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (folder, PENDING, now, now, now),
+            )
+        added = cursor.rowcount > 0
+        if added:
+            self._wakeup.set()
+        return added
+
+    def requeue(self, folder):
+        """Move a dead or finished job back to pending with a fresh attempt count"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, last_error = NULL, "
+                "updated_at = ?, available_at = ? WHERE folder = ?",
+                (PENDING, now, now, folder),
+            )
+        if cursor.rowcount:
+            self._wakeup.set()
+        return cursor.rowcount > 0
+
+    def claim(self):
+        """Mark the oldest due pending job as running and return it, or None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT folder FROM jobs WHERE status = ? AND available_at <= ? "
+                    "ORDER BY available_at LIMIT 1",
+                    (PENDING, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE folder = ?",
+                    (RUNNING, now, row["folder"]),
+                )
+                job = self._conn.execute(
+                    "SELECT * FROM jobs WHERE folder = ?", (row["folder"],)
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(job)
+
+    def complete(self, folder):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, last_error = NULL, updated_at = ? "
+                "WHERE folder = ?",
+                (DONE, time.time(), folder),
+            )
+
+    def fail(self, folder, error):
+        """
+        Record a failed attempt. The job is retried later, or moved to the
+        dead-letter state once it has used up its attempts.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT attempts FROM jobs WHERE folder = ?", (folder,)
+            ).fetchone()
+            if row is None:
+                return None
+            attempts = row["attempts"]
+            if attempts >= self.max_attempts:
+                status = DEAD
+                available_at = now
+            else:
+                status = PENDING
+                available_at = now + self.retry_delay * 2 ** (attempts - 1)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, updated_at = ?, "
+                "available_at = ? WHERE folder = ?",
+                (status, str(error), now, available_at, folder),
+            )
+        return status
+
+    def recover(self):
+        """Return jobs left running by a crashed worker to the pending state"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, available_at = ? "
+                "WHERE status = ?",
+                (PENDING, now, now, RUNNING),
+            )
+        return cursor.rowcount
+
+    def get(self, folder):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE folder = ?", (folder,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list(self, status=None):
+        with self._lock:
+            if status is None:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs ORDER BY created_at"
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at",
+                    (status,),
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        """Return the number of jobs in each state"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def next_due_in(self):
+        """Seconds until the next pending job becomes due, or None if there is none"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(available_at) AS due FROM jobs WHERE status = ?",
+                (PENDING,),
+            ).fetchone()
+        if row["due"] is None:
+            return None
+        return max(0.0, row["due"] - time.time())
+
+    def wait_for_work(self, timeout):
+        """Sleep until something is enqueued in this process or ``timeout`` passes"""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def compact(self, gone):
+        """
+        Delete finished and dead-lettered rows whose folder ``gone(folder)``
+        says no longer exists. Returns the number of rows removed.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT folder FROM jobs WHERE status IN (?, ?)", (DONE, DEAD)
+            ).fetchall()
+            folders = [(row["folder"],) for row in rows if gone(row["folder"])]
+            if folders:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("DELETE FROM jobs WHERE folder = ?", folders)
+                self._conn.execute("COMMIT")
+        return len(folders)
+
+    def import_done_file(self, done_file="done.txt"):
+        """One-off migration of folders recorded in the legacy done.txt"""
+        if not os.path.exists(done_file):
+            return 0
+
+        now = time.time()
+        with open(done_file, "r", encoding="utf-8") as f:
+            folders = {line.strip() for line in f if line.strip()}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs "
+                "(folder, status, created_at, updated_at, available_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(folder, DONE, now, now, now) for folder in folders],
+            )
+            self._conn.execute("COMMIT")
+        return len(folders)
@@ -0,0 +1,126 @@
+"""
+Encoded per-image segments for incremental renders.
+
+Every image of a reel is encoded on its own as a short H.264 clip with no
+audio, keyed by the image bytes, its frame count, the filter chain and the
+encoder settings other than ``-threads``. A reel is then the stream-copy join of its images' clips,
+so after an edit only the images that are new or changed are encoded.
+"""
+
+import hashlib
+import logging
+import os
+import subprocess
+
+from precompose import FileCache, file_digest
+from profiling import BENCHMARK_ARGS, on_cache_hit, parse_benchmark
+
+SEGMENT_CACHE_DIR = os.environ.get(
+    "SEGMENT_CACHE_DIR", os.path.join("cache", "segments")
+)
+SEGMENT_CACHE_MAX_BYTES = int(
+    os.environ.get("SEGMENT_CACHE_MAX_BYTES", str(4 * 1024 * 1024 * 1024))
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _without_threads(encoder_args):
+    args = list(encoder_args)
+    while "-threads" in args:
+        index = args.index("-threads")
+        del args[index : index + 2]
+    return args
+
+
+class SegmentCache(FileCache):
+    """One-image H.264 clips keyed by image, length, filter chain and encoder"""
+
+    suffix = ".mp4"
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        super().__init__(
+            cache_dir or SEGMENT_CACHE_DIR,
+            SEGMENT_CACHE_MAX_BYTES if max_bytes is None else max_bytes,
+        )
+
+    def key(self, image_path, frames, vf_string, encoder_args):
+        # The thread count follows the core budget and the number of images,
+        # but libx264 at a fixed preset and CRF writes the same clip with any
+        # of them, so an edit that adds an image still reuses the others
+        return hashlib.sha256(
+            "|".join(
+                [
+                    file_digest(image_path),
+                    str(frames),
+                    vf_string or "",
+                    *_without_threads(encoder_args),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def get_or_create(
+        self, image_path, frames, frame_rate, vf_string, encoder_args, record=None
+    ):
+        """
+        Return the clip showing ``image_path`` for ``frames`` frames.
+        ``record`` gets the -benchmark stats of an encode on a miss, or
+        CACHE_HIT.
+        """
+        return self.fetch(
+            self.key(image_path, frames, vf_string, encoder_args),
+            lambda tmp_path: self._render(
+                image_path,
+                frames,
+                frame_rate,
+                vf_string,
+                encoder_args,
+                tmp_path,
+                record,
+            ),
+            on_cache_hit(record),
+        )
+
+    def _render(
+        self,
+        image_path,
+        frames,
+        frame_rate,
+        vf_string,
+        encoder_args,
+        tmp_path,
+        record=None,
+    ):
+        command = [
+            "ffmpeg",
+            "-y",
+            *(BENCHMARK_ARGS if record is not None else []),
+            "-loop",
+            "1",
+            "-framerate",
+            str(frame_rate),
+            "-i",
+            os.path.abspath(image_path),
+            *(["-vf", vf_string] if vf_string else []),
+            "-an",
+            *encoder_args,
+            "-frames:v",
+            str(frames),
+            tmp_path,
+        ]
+        result = subprocess.run(
+            command, capture_output=True, text=True, encoding="utf-8", errors="replace"
+        )
+        if result.returncode != 0:
+            logger.error(
+                "Segment encode failed",
+                extra={"image": image_path, "stderr": result.stderr[-4000:]},
+            )
+            raise Exception(
+                f"Encoding {os.path.basename(image_path)} failed with return code {result.returncode}"
+            )
+        if record is not None:
+            record(parse_benchmark(result.stderr))
+
+
+segment_cache = SegmentCache()
@@ -1,10 +1,23 @@
+import io
+import json
+import struct
+import subprocess
+
 import pytest
-from main import app
-from flask import url_for
+import main
+import render_engine
+from gallery_index import GalleryIndex
+from ingest import ChunkedUploads
+from render_cache import RenderCache
 import os
 
 @pytest.fixture
-def client():
+def app():
+    return main.create_app(probe=False)
+
+
+@pytest.fixture
+def client(app):
     with app.test_client() as client:
         yield client
 
@@ -35,4 +48,755 @@ def test_create_reel_no_name(client):
     data = {}
     response = client.post('/create', data=data)
     assert response.status_code == 200
-    assert b"Please provide a name for your reel." in response.data
\ No newline at end of file
+    assert b"Please provide a name for your reel." in response.data
+
+def _png(width, height):
+    """The signature and IHDR chunk of an RGB PNG."""
+    ihdr = struct.pack(">I4sIIBBBBB", 13, b"IHDR", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + ihdr
+
+
+# Smallest headers the upload validation accepts
+JPEG = b"\xff\xd8\xff\xc0\x00\x11\x08\x00\x10\x00\x10\x03" + b"\x01\x22\x00" * 3
+PNG = _png(16, 16)
+
+
+def _reel_form(**overrides):
+    """Build a minimal valid /create form with one image and an MP3."""
+    data = {
+        "uuid": "8c7fea50-f769-4144-ac06-e828afd18c14",
+        "reel_name": "test_reel",
+        "image_duration": "1",
+        "aspect_ratio": "9:16",
+        "filter_effect": "none",
+        "audio": (io.BytesIO(b"ID3fake-mp3"), "song.mp3"),
+        "file1": (io.BytesIO(JPEG + b"fake-jpeg"), "photo.jpg"),
+    }
+    data.update(overrides)
+    return data
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the app inside an empty directory with FFmpeg mocked out."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "check_ffmpeg", lambda: True)
+    monkeypatch.setattr(main, "render_cache", RenderCache())
+    monkeypatch.setattr(main, "gallery_index", GalleryIndex())
+    monkeypatch.setattr(
+        main,
+        "generate_thumbnails",
+        lambda name: {"poster": f"posters/{name}.jpg", "preview": f"previews/{name}.mp4"},
+    )
+    (tmp_path / "static" / "reels").mkdir(parents=True)
+    (tmp_path / "static" / "metadata").mkdir(parents=True)
+    return tmp_path
+
+
+def test_create_returns_job_without_rendering_inline(client, workdir, monkeypatch):
+    """POST /create queues a render job and its status is reported by /jobs/<id>."""
+    rendered = []
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: rendered.append(args))
+
+    response = client.post(
+        '/create', data=_reel_form(), content_type='multipart/form-data'
+    )
+    assert response.status_code == 202
+    assert b"jobStatus" in response.data
+
+    job_id = "8c7fea50-f769-4144-ac06-e828afd18c14"
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert job["status"] == "done"
+    assert job["metadata"]["image_count"] == 1
+    assert rendered[0][:2] == (job_id, "test_reel")
+
+    response = client.get(f'/jobs/{job_id}')
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "done"
+    assert (workdir / "user_uploads" / job_id / "job.json").exists()
+
+
+def test_failed_render_is_reported_on_job(client, workdir, monkeypatch):
+    """A render error marks the job as failed instead of breaking the request."""
+    def fail(*args, **kwargs):
+        raise Exception("FFmpeg failed with return code 1")
+
+    monkeypatch.setattr(main, "create_reel", fail)
+
+    response = client.post(
+        '/create',
+        data=_reel_form(uuid="3236c179-7e9e-4bc7-874b-6f744bddd967"),
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 202
+
+    job = main.job_manager.wait("3236c179-7e9e-4bc7-874b-6f744bddd967", timeout=10)
+    assert job["status"] == "failed"
+    assert "return code 1" in job["error"]
+
+
+def test_folder_is_claimed_before_the_watcher_could_take_it(client, workdir, monkeypatch):
+    """job.json exists by the time audio.mp3 and input.txt are both in place."""
+    import generate_process
+    ready = []
+    write_settings = main.write_settings
+
+    def check(folder, *args):
+        ready.append(generate_process.is_ready(os.path.basename(folder)))
+        ready.append(json.loads(open(os.path.join(folder, "job.json")).read())["id"])
+        write_settings(folder, *args)
+
+    monkeypatch.setattr(main, "write_settings", check)
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "0e6f3b8a-2c1d-4a7e-9b5f-8d4c2a1e6f30"
+    client.post('/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data')
+
+    assert (workdir / "user_uploads" / job_id / "input.txt").exists()
+    assert ready == [False, job_id]
+    assert main.job_manager.wait(job_id, timeout=10)["status"] == "done"
+
+
+def test_reused_upload_id_is_refused(client, workdir, monkeypatch):
+    """A second /create with the same uuid gets 409 and leaves the first job's files alone."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "9e4b2d7a-1f3c-4e68-8a5d-2c7f0b9e1d46"
+    first = client.post('/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data')
+    assert first.status_code == 202
+    folder = workdir / "user_uploads" / job_id
+    before = (folder / "input.txt").read_text()
+
+    second = client.post('/create', data=_reel_form(
+        uuid=job_id, reel_name="other", image_duration="3",
+    ), content_type='multipart/form-data')
+
+    assert second.status_code == 409
+    assert b"already submitted" in second.data
+    assert (folder / "input.txt").read_text() == before
+    assert main.job_manager.wait(job_id, timeout=10)["reel_name"] == "test_reel"
+    assert [p.name for p in (workdir / "user_uploads").iterdir()] == [job_id]
+
+
+def test_job_events_stream_progress(client, workdir, monkeypatch):
+    """/jobs/<id>/events streams progress as Server-Sent Events until the job is done."""
+    def fake_create_reel(folder, reel_name, *args, progress=None, **kwargs):
+        progress("encode", 0.5)
+        (workdir / "static" / "reels" / f"{reel_name}.mp4").write_bytes(b"mp4")
+
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+    job_id = "5f0c1f58-0f3c-4a4e-9f59-0a3b9b8e2d11"
+    client.post('/create', data=_reel_form(uuid=job_id, reel_name="live"),
+                content_type='multipart/form-data')
+
+    response = client.get(f'/jobs/{job_id}/events')
+    assert response.mimetype == "text/event-stream"
+    events = [
+        json.loads(line[len("data: "):])
+        for line in response.get_data(as_text=True).splitlines()
+        if line.startswith("data: ")
+    ]
+    assert events[-1]["status"] == "done"
+    assert events[-1]["progress"] == {"stage": "done", "fraction": 1.0}
+    assert client.get('/jobs/nope/events').status_code == 404
+
+
+def test_preview_job_can_be_promoted(client, workdir, monkeypatch):
+    """A preview renders a draft only; promoting it renders the same uploads for the gallery."""
+    rendered = []
+
+    def fake_create_reel(folder, reel_name, text_overlay, aspect_ratio,
+                         filter_effect, progress=None, quality="final", **kwargs):
+        rendered.append((quality, filter_effect))
+        out_dir = workdir / "static" / ("drafts" if quality == "preview" else "reels")
+        out_dir.mkdir(exist_ok=True)
+        (out_dir / f"{reel_name}.mp4").write_bytes(b"mp4")
+
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+    job_id = "0d4a3b8e-2c51-4d0e-a0f6-51d7a6f0a5a1"
+    client.post('/create', data=_reel_form(uuid=job_id, reel_name="draft", quality="preview"),
+                content_type='multipart/form-data')
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert job["metadata"]["draft"] == f"drafts/{job_id}.mp4"
+    assert main.gallery_index.count() == 0
+
+    response = client.post(f'/jobs/{job_id}/promote', json={"filter_effect": "noir"})
+    assert response.status_code == 202
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert job["status"] == "done"
+    assert rendered == [("preview", "none"), ("final", "noir")]
+    assert (workdir / "static" / "reels" / "draft.mp4").exists()
+    assert not (workdir / "static" / "drafts" / f"{job_id}.mp4").exists()
+    assert client.post(f'/jobs/{job_id}/promote').status_code == 409
+
+
+def test_unsupported_effect_is_rejected(client, workdir, monkeypatch):
+    """Effects the FFmpeg probe marked unsupported are refused and hidden from the form."""
+    monkeypatch.setattr(main.ffmpeg_probe, "get", lambda: {
+        "available": True,
+        "effects": {"noir": {"supported": False, "reason": "missing filter hue"}},
+        "text_overlay": {"supported": True, "reason": None},
+    })
+
+    response = client.post('/create', data=_reel_form(filter_effect="noir"),
+                           content_type='multipart/form-data')
+    assert b"filter is not available on this server" in response.data
+    assert '"noir"' in client.get('/create').get_data(as_text=True)
+    assert client.get('/api/capabilities').get_json()["available"] is True
+
+
+def test_metrics_report_stage_timings(client, workdir, monkeypatch):
+    """/metrics exposes upload, validation, metadata, gallery and disk usage figures."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "6a1d7c0e-3f0b-4a55-9d55-2f4b8f0a7c31"
+    client.post('/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data')
+    main.job_manager.wait(job_id, timeout=10)
+    client.get('/gallery')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'reel_upload_bytes_total{kind="form"}' in text
+    assert 'reel_validation_seconds_count{outcome="queued"}' in text
+    assert "reel_job_queue_wait_seconds_count" in text
+    assert "reel_metadata_write_seconds_count" in text
+    assert 'reel_gallery_render_seconds_count{view="html"}' in text
+    assert 'reel_disk_usage_bytes{path="user_uploads"}' in text
+    assert 'reel_http_request_seconds_count{endpoint="create",method="POST",status="202"}' in text
+
+
+def test_full_render_queue_returns_429(client, workdir, monkeypatch):
+    """When the backlog is full, /create and /batches answer 429 with Retry-After."""
+    monkeypatch.setattr(main.job_manager, "max_queue_depth", 0)
+
+    response = client.post('/create', data=_reel_form(), content_type='multipart/form-data')
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert b"The server is busy" in response.data
+
+    response = client.post(
+        '/batches',
+        data={
+            "manifest": json.dumps([{"reel_name": "a"}]),
+            "audio": (io.BytesIO(b"ID3fake-mp3"), "song.mp3"),
+            "file1": (io.BytesIO(JPEG + b"fake-jpeg"), "photo.jpg"),
+        },
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 429
+    assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
+    assert os.listdir(workdir / "user_uploads") == []
+
+
+def test_unknown_job_returns_404(client):
+    """Unknown job ids return a JSON 404."""
+    response = client.get('/jobs/does-not-exist')
+    assert response.status_code == 404
+
+
+def test_identical_resubmission_reuses_render(client, workdir, monkeypatch):
+    """A second upload with the same content links the existing MP4 instead of rendering."""
+    rendered = []
+
+    def fake_create_reel(folder, reel_name, *args, **kwargs):
+        rendered.append(reel_name)
+        (workdir / "static" / "reels" / f"{reel_name}.mp4").write_bytes(b"mp4")
+
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+
+    first = "1bb5893a-c359-496d-839a-8cfd39b6f78d"
+    second = "393f7e58-397f-4341-85da-5ff9180dade6"
+    client.post('/create', data=_reel_form(uuid=first, reel_name="original"),
+                content_type='multipart/form-data')
+    main.job_manager.wait(first, timeout=10)
+    client.post('/create', data=_reel_form(uuid=second, reel_name="again"),
+                content_type='multipart/form-data')
+    job = main.job_manager.wait(second, timeout=10)
+
+    assert rendered == ["original"]
+    assert job["metadata"]["cached_from"] == "original"
+    assert (workdir / "static" / "reels" / "again.mp4").read_bytes() == b"mp4"
+    assert main.render_cache.stats() == {"hits": 1, "misses": 1}
+    assert 'reel_render_cache_lookups_total{result="hit"}' in client.get('/metrics').text
+
+    client.post('/delete/original.mp4')
+    client.post('/delete/again.mp4')
+    assert main.render_cache.lookup(job["metadata"]["fingerprint"]) is None
+
+
+def test_batch_renders_every_variant_from_one_upload(client, workdir, monkeypatch):
+    """POST /batches stores the assets once and reports a job per variant."""
+    rendered = []
+
+    def fake_create_reel(folder, reel_name, *args, **kwargs):
+        rendered.append(reel_name)
+        (workdir / "static" / "reels" / f"{reel_name}.mp4").write_bytes(reel_name.encode())
+
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+    manifest = [
+        {"reel_name": "tall", "aspect_ratio": "9:16", "duration": 2},
+        {"reel_name": "wide", "aspect_ratio": "16:9", "filter_effect": "warm"},
+        {"reel_name": "tall_slow", "aspect_ratio": "9:16", "duration": 3},
+    ]
+    response = client.post(
+        '/batches',
+        data={
+            "manifest": json.dumps(manifest),
+            "audio": (io.BytesIO(b"ID3fake-mp3"), "song.mp3"),
+            "file1": (io.BytesIO(JPEG + b"fake-jpeg"), "photo.jpg"),
+        },
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 202
+    batch = response.get_json()
+    # Variants with the same filter chain are queued together
+    assert [v["reel_name"] for v in batch["variants"]] == ["tall", "tall_slow", "wide"]
+    for variant in batch["variants"]:
+        assert main.job_manager.wait(variant["job_id"], timeout=10)["status"] == "done"
+
+    batch = client.get(f'/batches/{batch["id"]}').get_json()
+    assert batch["status"] == "done" and batch["counts"] == {"done": 3}
+    assert sorted(rendered) == ["tall", "tall_slow", "wide"]
+    tall = next(v for v in batch["variants"] if v["reel_name"] == "tall")
+    assert tall["job"]["batch_id"] == batch["id"]
+    assert tall["job"]["metadata"]["duration"] == 2
+
+    # Every variant folder shares the batch's copy of each file
+    shared = workdir / "user_uploads" / batch["id"] / "img_000.jpg"
+    variant_image = workdir / "user_uploads" / tall["job_id"] / "img_000.jpg"
+    assert os.path.samefile(shared, variant_image)
+
+
+def test_edit_rerenders_reel_from_changed_uploads(client, workdir, monkeypatch):
+    """Edits rewrite the upload folder in order and queue a render of the same reel."""
+    rendered = []
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: rendered.append(kwargs))
+    job_id = "5f0e8a61-3c1f-4a57-9a3e-7d0c2b9e4f10"
+    data = _reel_form(uuid=job_id, reel_name="trip")
+    data["file2"] = (io.BytesIO(JPEG + b"two"), "two.jpg")
+    data["file3"] = (io.BytesIO(JPEG + b"three"), "three.jpg")
+    client.post('/create', data=data, content_type='multipart/form-data')
+    main.job_manager.wait(job_id, timeout=10)
+
+    edits = [
+        {"op": "replace", "index": 1, "upload": 0},
+        {"op": "move", "index": 2, "to": 0},
+        {"op": "duration", "index": 0, "duration": 2.5},
+    ]
+    response = client.post(
+        '/api/reels/trip/edit',
+        data={"edits": json.dumps(edits), "file1": (io.BytesIO(PNG + b"new"), "new.png")},
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 202
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert job["status"] == "done"
+    assert rendered[-1]["incremental"] is True
+
+    folder = workdir / "user_uploads" / job_id
+    entries = main.parse_concat_list(str(folder / "input.txt"))
+    assert entries == [("img_002.jpg", 2.5), ("img_000.jpg", 1.0), ("img_003.png", 1.0)]
+    assert (folder / "img_003.png").read_bytes().endswith(b"new")
+    assert not (folder / "img_001.jpg").exists()
+    assert [image["name"] for image in job["metadata"]["images"]] == [
+        "img_002.jpg", "img_000.jpg", "img_003.png"
+    ]
+    assert job["metadata"]["duration"] is None
+
+    response = client.post('/api/reels/trip/edit', json={"edits": [{"op": "remove", "index": 7}]})
+    assert response.status_code == 400
+    assert main.parse_concat_list(str(folder / "input.txt")) == entries
+
+
+def test_edit_keeps_its_queue_slot_against_a_racing_request(client, workdir, monkeypatch):
+    """A request taking the last slot mid-edit is refused; the edited reel still renders."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "3a7c1e9f-5d2b-4f80-b6e4-9c1d7a3f2e58"
+    client.post('/create', data=_reel_form(uuid=job_id, reel_name="race"),
+                content_type='multipart/form-data')
+    main.job_manager.wait(job_id, timeout=10)
+    monkeypatch.setattr(main.job_manager, "max_queue_depth", 1)
+
+    racers = []
+    submit = main.job_manager.submit
+
+    def racing_submit(*args, **kwargs):
+        with pytest.raises(main.QueueFull):
+            submit("racer", lambda: None)
+        racers.append("refused")
+        return submit(*args, **kwargs)
+
+    monkeypatch.setattr(main.job_manager, "submit", racing_submit)
+    response = client.post(
+        '/api/reels/race/edit', json={"edits": [{"op": "duration", "index": 0, "duration": 2}]}
+    )
+    assert response.status_code == 202
+    assert racers == ["refused"]
+    assert main.job_manager.wait(job_id, timeout=10)["status"] == "done"
+
+    def fail(*args):
+        raise main.UploadRejected("Could not store the images.", 400)
+
+    monkeypatch.setattr(main, "stage_edit", fail)
+    response = client.post(
+        '/api/reels/race/edit', json={"edits": [{"op": "duration", "index": 0, "duration": 3}]}
+    )
+    assert response.status_code == 400
+    main.job_manager.admit()
+
+
+def test_batch_with_invalid_manifest_is_rejected(client, workdir):
+    """A bad variant rejects the whole batch and keeps nothing on disk."""
+    response = client.post(
+        '/batches',
+        data={
+            "manifest": json.dumps([{"reel_name": "a", "aspect_ratio": "4:3"}]),
+            "audio": (io.BytesIO(b"ID3fake-mp3"), "song.mp3"),
+            "file1": (io.BytesIO(JPEG + b"fake-jpeg"), "photo.jpg"),
+        },
+        content_type='multipart/form-data',
+    )
+    assert response.status_code == 400
+    assert "4:3" in response.get_json()["message"]
+    assert os.listdir(workdir / "user_uploads") == []
+    assert client.get('/batches/unknown').status_code == 404
+
+
+def test_delete_removes_source_uploads(client, workdir, monkeypatch):
+    """Deleting a reel also removes the images and audio it was rendered from."""
+    monkeypatch.setattr(
+        main,
+        "create_reel",
+        lambda folder, name, *args, **kwargs: (
+            workdir / "static" / "reels" / f"{name}.mp4"
+        ).write_bytes(b"mp4"),
+    )
+    job_id = "0f0c6f1e-7d5c-4a59-8f62-2b9c0f3a8e11"
+    client.post('/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data')
+    assert main.job_manager.wait(job_id, timeout=10)["metadata"]["upload_folder"] == job_id
+    assert (workdir / "user_uploads" / job_id).exists()
+
+    assert client.post('/delete/test_reel.mp4').get_json()["success"]
+    assert not (workdir / "user_uploads" / job_id).exists()
+    assert not (workdir / "static" / "reels" / "test_reel.mp4").exists()
+
+
+def test_reels_api_is_paginated_and_cacheable(client, workdir):
+    """/api/reels pages through the index newest first and answers 304 for a known ETag."""
+    for i in range(3):
+        (workdir / "static" / "reels" / f"reel{i}.mp4").write_bytes(b"x" * (i + 1))
+        (workdir / "static" / "metadata" / f"reel{i}.json").write_text(
+            json.dumps({"name": f"reel{i}", "created_at": f"2025-01-0{i + 1}T00:00:00"})
+        )
+
+    response = client.get('/api/reels?per_page=2')
+    data = response.get_json()
+    assert data["total"] == 3
+    assert data["pages"] == 2
+    assert [reel["name"] for reel in data["reels"]] == ["reel2", "reel1"]
+
+    etag = response.headers["ETag"]
+    cached = client.get('/api/reels?per_page=2', headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+
+    client.post('/delete/reel2.mp4')
+    response = client.get('/api/reels?per_page=2', headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [reel["name"] for reel in response.get_json()["reels"]] == ["reel1", "reel0"]
+
+    page = client.get('/gallery?page=2&per_page=1')
+    assert b"Page 2 of 2" in page.data
+
+
+def test_reels_are_served_with_ranges_and_immutable_urls(client, workdir):
+    """Versioned reel URLs answer byte ranges, carry a strong ETag and are cached for good."""
+    (workdir / "static" / "reels" / "ranged.mp4").write_bytes(bytes(range(100)))
+    reels = client.get('/api/reels').get_json()["reels"]
+    version = reels[0]["version"]
+
+    response = client.get(f'/reels/ranged.mp4?v={version}', headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == bytes(range(10, 20))
+    assert response.headers["Content-Range"] == "bytes 10-19/100"
+    assert "immutable" in response.headers["Cache-Control"]
+    assert not response.headers["ETag"].startswith("W/")
+
+    stale = client.get('/reels/ranged.mp4?v=old')
+    assert "no-cache" in stale.headers["Cache-Control"]
+    etag = stale.headers["ETag"]
+    assert client.get('/reels/ranged.mp4', headers={"If-None-Match": etag}).status_code == 304
+
+    hls = workdir / "static" / "hls" / "ranged"
+    hls.mkdir(parents=True)
+    (hls / "master.m3u8").write_text("#EXTM3U\n")
+    client.post('/delete/ranged.mp4')
+    assert not hls.exists()
+    assert client.get('/reels/ranged.mp4').status_code == 404
+
+
+def test_gallery_shows_posters_instead_of_videos(client, workdir, monkeypatch):
+    """Rendered reels get a poster in their metadata and the gallery lazy-loads the video."""
+    def fake_create_reel(folder, reel_name, *args, **kwargs):
+        (workdir / "static" / "reels" / f"{reel_name}.mp4").write_bytes(b"mp4")
+
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+    job_id = "b8505e3c-bfb7-4c57-b8a4-2629424791b1"
+    client.post('/create', data=_reel_form(uuid=job_id, reel_name="posted"),
+                content_type='multipart/form-data')
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert job["metadata"]["poster"] == "posters/posted.jpg"
+
+    page = client.get('/gallery')
+    assert b'src="/static/posters/posted.jpg"' in page.data
+    assert b'loading="lazy"' in page.data
+    assert b'data-preview="/static/previews/posted.mp4"' in page.data
+
+
+def test_oversized_image_is_rejected_while_streaming(client, workdir, monkeypatch):
+    """An image over MAX_FILE_SIZE aborts the upload and leaves no folder behind."""
+    monkeypatch.setattr(main, "MAX_FILE_SIZE", 16)
+    big = io.BytesIO(b"\xff\xd8\xff\xe0" + b"x" * 64)
+
+    response = client.post('/create', data=_reel_form(file1=(big, "big.jpg")),
+                           content_type='multipart/form-data')
+    assert b"One or more images are too large" in response.data
+    assert os.listdir(workdir / "user_uploads") == []
+
+
+def test_mislabelled_image_is_rejected(client, workdir):
+    """A file whose bytes are not a JPG or PNG is refused despite its extension."""
+    fake = io.BytesIO(b"GIF89a-not-really-a-jpeg")
+    response = client.post('/create', data=_reel_form(file1=(fake, "cat.jpg")),
+                           content_type='multipart/form-data')
+    assert b"is not a valid JPG or PNG image" in response.data
+
+
+def test_images_keep_numeric_form_order(client, workdir, monkeypatch):
+    """file2 comes before file10 in the concat list."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "e2043064-13bd-4204-b8dc-eeee137a5a60"
+    data = _reel_form(uuid=job_id)
+    del data["file1"]
+    data["file10"] = (io.BytesIO(PNG + b"ten"), "ten.png")
+    data["file2"] = (io.BytesIO(JPEG + b"two"), "two.jpg")
+
+    client.post('/create', data=data, content_type='multipart/form-data')
+    main.job_manager.wait(job_id, timeout=10)
+    folder = workdir / "user_uploads" / job_id
+    assert (folder / "img_000.jpg").read_bytes().endswith(b"two")
+    assert (folder / "img_001.png").read_bytes().endswith(b"ten")
+
+
+def test_image_headers_are_validated_and_recorded(client, workdir, monkeypatch):
+    """Images are named by their real format and their sizes reach the metadata."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    job_id = "0b7c3a52-8f0e-4b8e-a0d6-2f6f1d1c9c55"
+    data = _reel_form(uuid=job_id, file1=(io.BytesIO(_png(1080, 1920)), "shot.jpg"))
+
+    client.post('/create', data=data, content_type='multipart/form-data')
+    job = main.job_manager.wait(job_id, timeout=10)
+    assert (workdir / "user_uploads" / job_id / "img_000.png").exists()
+    image = job["metadata"]["images"][0]
+    assert image["name"] == "img_000.png"
+    assert (image["format"], image["width"], image["height"]) == ("png", 1080, 1920)
+
+
+def test_image_over_pixel_limit_is_rejected(client, workdir):
+    """A 20000x20000 PNG is refused from its header and nothing is kept."""
+    huge = io.BytesIO(_png(20000, 20000) + b"\x00" * 1024)
+    response = client.post('/create', data=_reel_form(file1=(huge, "huge.png")),
+                           content_type='multipart/form-data')
+    assert b"megapixels" in response.data
+    assert os.listdir(workdir / "user_uploads") == []
+
+
+def test_resumable_audio_upload(client, workdir, monkeypatch):
+    """Audio sent in chunks can resume after a stale offset and is used by /create."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    monkeypatch.setattr(main, "chunked_uploads", ChunkedUploads())
+    audio = b"ID3" + b"a" * 20
+
+    started = client.post('/uploads', json={"filename": "song.mp3", "size": len(audio)})
+    assert started.status_code == 201
+    upload_id = started.get_json()["upload_id"]
+
+    response = client.patch(f'/uploads/{upload_id}', data=audio[:10],
+                            headers={"Upload-Offset": "0"})
+    assert response.get_json()["offset"] == 10
+
+    # A retried chunk with an old offset is refused with the real offset
+    response = client.patch(f'/uploads/{upload_id}', data=audio[:10],
+                            headers={"Upload-Offset": "0"})
+    assert response.status_code == 409
+    assert response.headers["Upload-Offset"] == "10"
+
+    response = client.patch(f'/uploads/{upload_id}', data=audio[10:],
+                            headers={"Upload-Offset": "10"})
+    assert response.get_json()["complete"] is True
+
+    job_id = "ba8d94e9-00bc-42aa-a0b3-618a7738c2c7"
+    data = _reel_form(uuid=job_id, audio_upload_id=upload_id)
+    del data["audio"]
+    response = client.post('/create', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    assert (workdir / "user_uploads" / job_id / "audio.mp3").read_bytes() == audio
+    assert main.job_manager.wait(job_id, timeout=10)["status"] == "done"
+
+
+def test_stalled_chunk_does_not_block_other_uploads(workdir):
+    """Only the upload being received is held; others append and claim freely."""
+    import threading
+    from ingest import UploadRejected
+    uploads = ChunkedUploads()
+    slow = uploads.create("slow.mp3", 10)["upload_id"]
+    fast = uploads.create("fast.mp3", 10)["upload_id"]
+    release = threading.Event()
+
+    class StalledStream:
+        def __init__(self):
+            self.chunks = [b"ID3aa"]
+
+        def read(self, size):
+            if not self.chunks:
+                release.wait(10)
+                return b""
+            return self.chunks.pop()
+
+    receiving = threading.Thread(target=uploads.append, args=(slow, 0, StalledStream()))
+    receiving.start()
+    try:
+        assert uploads.append(fast, 0, io.BytesIO(b"ID3" + b"b" * 7))["complete"]
+        assert uploads.claim(fast, str(workdir / "fast.mp3"))
+        with pytest.raises(UploadRejected) as rejected:
+            uploads.append(slow, 0, io.BytesIO(b"ID3aa"))
+        assert rejected.value.status == 409
+    finally:
+        release.set()
+        receiving.join()
+    assert uploads.status(slow)["offset"] == 5
+
+
+def test_create_app_applies_config_and_prepares_folders(workdir, monkeypatch):
+    """The factory builds an app for its UPLOAD_FOLDER and probes FFmpeg once."""
+    probes = []
+    specs = []
+
+    def fake_render(spec, progress=None, stats=None):
+        specs.append(spec)
+        with open(spec.output_path, "wb") as f:
+            f.write(b"mp4")
+        return spec.output_path
+
+    probe = main.ffmpeg_probe.get
+    monkeypatch.setattr(main.ffmpeg_probe, "get", lambda: probes.append(1) or probe())
+    monkeypatch.setattr(render_engine, "render", fake_render)
+    monkeypatch.setenv("MAX_CONTENT_LENGTH", "1234")
+
+    served = main.create_app({"UPLOAD_FOLDER": "uploads_elsewhere"})
+    assert served is not main.create_app(probe=False)
+    served = main.create_app({"UPLOAD_FOLDER": "uploads_elsewhere"}, probe=False)
+
+    assert served.config["MAX_CONTENT_LENGTH"] == 1234
+    assert (workdir / "uploads_elsewhere").is_dir()
+    assert probes == [1]
+
+    job_id = "7d2c9e41-5a8b-4f36-b0e7-1c4a9d3f8e25"
+    response = served.test_client().post(
+        '/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data'
+    )
+    assert response.status_code == 202
+    assert main.job_manager.wait(job_id, timeout=10)["status"] == "done"
+    folder = workdir / "uploads_elsewhere" / job_id
+    assert specs[0].upload_dir == str(folder)
+    assert (folder / "job.json").exists()
+    assert (workdir / "static" / "reels" / "test_reel.mp4").read_bytes() == b"mp4"
+    assert not (workdir / "user_uploads" / job_id).exists()
+
+
+def test_profiled_render_is_stored_and_ranked(client, workdir, monkeypatch):
+    """With RENDER_PROFILING the render's cost lands in its metadata and the report."""
+    def fake_create_reel(folder, reel_name, *args, stats=None, **kwargs):
+        stats.recorder("encode")({"utime": 3.0, "stime": 1.0, "maxrss_kb": 2048})
+        stats.add_time("encode", 2.0)
+        output = workdir / "static" / "reels" / f"{reel_name}.mp4"
+        output.write_bytes(b"x" * 1000)
+        stats.set_output(60, 2.0, str(output))
+
+    monkeypatch.setattr(main, "RENDER_PROFILING", True)
+    monkeypatch.setattr(main, "create_reel", fake_create_reel)
+    job_id = "5b0c2d7e-1a44-4b8e-9a61-0f3c4d2e1b90"
+    client.post('/create', data=_reel_form(uuid=job_id), content_type='multipart/form-data')
+    profile = main.job_manager.wait(job_id, timeout=10)["metadata"]["profiling"]
+
+    assert (profile["fps"], profile["speed"], profile["max_rss_mb"]) == (30.0, 1.0, 2.0)
+    assert profile["output_bitrate_kbps"] == 4.0
+    report = client.get('/api/profiling').get_json()
+    assert report["reels"] == 1
+    assert report["filter_effect"][0]["cpu_per_video_second"] == 2.0
+
+
+def test_uploads_share_blobs_until_their_last_reel_is_deleted(client, workdir, monkeypatch):
+    """Identical uploads are stored once and freed when no reel uses them."""
+    monkeypatch.setattr(main, "create_reel", lambda *args, **kwargs: None)
+    first = "9a3e1c52-6b7d-4f08-8e21-3c5d7a9b0f14"
+    second = "2d8f4b61-0c3a-4e95-b7d2-6f1e8a4c3b27"
+    client.post('/create', data=_reel_form(uuid=first, reel_name="first"),
+                content_type='multipart/form-data')
+    main.job_manager.wait(first, timeout=10)
+    client.post('/create', data=_reel_form(
+        uuid=second, reel_name="second",
+        file2=(io.BytesIO(PNG + b"other"), "other.png"),
+    ), content_type='multipart/form-data')
+    main.job_manager.wait(second, timeout=10)
+
+    uploads = workdir / "user_uploads"
+    for name in ("audio.mp3", "img_000.jpg"):
+        assert os.path.samefile(uploads / first / name, uploads / second / name)
+    (info, other) = json.loads((uploads / second / "images.json").read_text())
+    blob = workdir / "cache" / "blobs" / other["sha256"][:2] / other["sha256"]
+    assert blob.read_bytes() == PNG + b"other"
+    assert main.blob_store.usage() == {"blobs": 3, "bytes": blob.stat().st_size
+                                       + len(JPEG + b"fake-jpeg") + len(b"ID3fake-mp3"),
+                                       "references": 5}
+
+    client.post('/delete/second.mp4')
+    assert not blob.exists()
+    assert main.blob_store.usage()["blobs"] == 2
+    client.post('/delete/first.mp4')
+    assert main.blob_store.usage()["blobs"] == 0
+
+
+def test_job_left_running_by_a_gone_process_expires(app, workdir):
+    """A stale queued job.json keeps its folder only for the orphan age."""
+    folder = workdir / "user_uploads" / "6a1d9e3c-4b2f-4e8a-9c7d-1f0e5b3a2d48"
+    folder.mkdir(parents=True)
+    (folder / "job.json").write_text(json.dumps({"id": folder.name, "status": "running"}))
+    then = os.path.getmtime(folder / "job.json") - 48 * 3600
+    for path in (folder / "job.json", folder):
+        os.utime(path, (then, then))
+
+    main.lifecycle.expire_uploads({})
+
+    assert not folder.exists()
+
+
+def test_jobs_interrupted_by_a_restart_are_marked_failed(workdir):
+    """Jobs whose process is gone are failed at startup; live processes keep theirs."""
+    gone = subprocess.Popen(["true"])
+    gone.wait()
+    jobs = {
+        "1c9e4f2a-7b3d-4a85-8e60-2d5f1a9c7b34": {"status": "running", "pid": gone.pid},
+        "4e2a8d1f-9c6b-4f37-a0d5-7b3e6c1f9a82": {"status": "queued"},
+        "8b5f3c7e-2a9d-4e16-b4c0-6f1a8d2e5c93": {"status": "running", "pid": os.getppid()},
+    }
+    for job_id, record in jobs.items():
+        folder = workdir / "user_uploads" / job_id
+        folder.mkdir(parents=True)
+        (folder / "job.json").write_text(json.dumps(dict(record, id=job_id)))
+
+    client = main.create_app(probe=False).test_client()
+
+    interrupted, claimed, live = (
+        client.get(f"/jobs/{job_id}").get_json() for job_id in jobs
+    )
+    assert interrupted["status"] == claimed["status"] == "failed"
+    assert interrupted["error"] == "Interrupted by a server restart"
+    assert live["status"] == "running"
+    response = client.get(f"/jobs/{claimed['id']}/events")
+    assert response.get_data(as_text=True).startswith("event: failed")
@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+from blobs import BlobStore
+
+
+def _file(folder, name, data):
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / name).write_bytes(data)
+    return {name: hashlib.sha256(data).hexdigest()}
+
+
+def test_identical_files_are_stored_once(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    a, b = tmp_path / "a", tmp_path / "b"
+    digests = _file(a, "audio.mp3", b"song")
+
+    assert store.adopt(a, digests) == 0
+    assert store.adopt(b, _file(b, "audio.mp3", b"song")) == 4
+    assert os.path.samefile(a / "audio.mp3", b / "audio.mp3")
+    assert store.referenced(b) == list(digests.values())
+    assert store.usage() == {"blobs": 1, "bytes": 4, "references": 2}
+
+
+def test_blobs_are_freed_with_their_last_folder(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    a, b = tmp_path / "a", tmp_path / "b"
+    store.adopt(a, {**_file(a, "img_000.jpg", b"shared"), **_file(a, "x.jpg", b"a")})
+    store.adopt(b, _file(b, "img_000.jpg", b"shared"))
+
+    assert store.remove_folder(a) == 1
+    assert not a.exists() and (b / "img_000.jpg").read_bytes() == b"shared"
+    assert store.remove_folder(b) == 6
+    assert store.usage()["blobs"] == 0
+
+
+def test_freeing_a_blob_never_loses_linked_bytes(tmp_path):
+    """A folder that linked a blob keeps its file when the blob is freed."""
+    store = BlobStore(str(tmp_path / "blobs"))
+    a, b = tmp_path / "a", tmp_path / "b"
+    digests = _file(a, "audio.mp3", b"song")
+    store.adopt(a, digests)
+    os.remove(a / "audio.mp3")
+
+    assert store.collect() == 4
+    assert store.adopt(b, _file(b, "audio.mp3", b"song")) == 0
+    assert os.path.samefile(b / "audio.mp3", store.path_for(digests["audio.mp3"]))
+    assert store.collect() == 0
+
+
+def test_store_falls_back_to_copies_without_hard_links(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+
+    def no_links(source, target):
+        raise PermissionError("hard links are not allowed here")
+
+    monkeypatch.setattr(os, "link", no_links)
+    a = tmp_path / "a"
+    assert store.adopt(a, _file(a, "audio.mp3", b"song")) == 0
+    assert (a / "audio.mp3").read_bytes() == b"song"
+    assert not store.enabled
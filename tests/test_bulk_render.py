@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import bulk_render
+from bulk_render import ProjectError, load_manifest, load_project, run
+
+
+def _project(root, name, images=3, settings=None):
+    folder = root / name
+    folder.mkdir()
+    for i in range(images):
+        (folder / f"photo {i} it's.jpeg").write_bytes(b"image %d" % i)
+    (folder / "thumbnail.jpeg").write_bytes(b"thumb")
+    (folder / "music.mp3").write_bytes(b"music")
+    if settings:
+        (folder / "settings.txt").write_text(
+            "".join(f"{key}={value}\n" for key, value in settings.items())
+        )
+    return folder
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Replace FFmpeg with a fake render that records what it was given."""
+    calls = []
+
+    def fake_render(spec, progress=None):
+        with open(os.path.join(spec.upload_dir, "input.txt"), encoding="utf-8") as f:
+            concat = f.read()
+        calls.append((spec, sorted(os.listdir(spec.upload_dir)), concat))
+        with open(spec.output_path, "wb") as f:
+            f.write(b"reel")
+        return spec.output_path
+
+    monkeypatch.setattr(bulk_render, "render", fake_render)
+    return calls
+
+
+def test_project_is_staged_as_an_upload_folder(tmp_path, renders):
+    """Images in name order, not the thumbnail, and music.mp3 as the audio."""
+    project = load_project(
+        _project(tmp_path, "laila-majnu", settings={"duration": "2"}),
+        {"aspect_ratio": "1:1"},
+    )
+    summary = run([project], tmp_path / "out", work_dir=tmp_path / "work")
+
+    spec, staged, concat = renders[0]
+    assert summary["rendered"] == ["laila-majnu"]
+    assert spec.output_path == str(tmp_path / "out" / "laila-majnu.mp4")
+    assert (spec.aspect_ratio, spec.threads) == ("1:1", os.cpu_count() or 1)
+    assert staged == [
+        "audio.mp3",
+        "img_000.jpeg",
+        "img_001.jpeg",
+        "img_002.jpeg",
+        "input.txt",
+    ]
+    assert concat.count("duration 2.0") == 3
+    assert os.listdir(tmp_path / "work") == []
+    assert summary["images"] == 3 and summary["video_seconds"] == 6
+
+
+def test_up_to_date_projects_are_skipped(tmp_path, renders):
+    """Unchanged inputs are skipped; touched files are hashed, edited ones render."""
+    folder = _project(tmp_path, "reel")
+    out = tmp_path / "out"
+
+    def build(**kwargs):
+        return run([load_project(folder)], out, work_dir=tmp_path / "work", **kwargs)
+
+    assert build()["rendered"] == ["reel"]
+    assert build()["skipped"] == ["reel"]
+
+    later = time.time() + 10
+    os.utime(folder / "photo 0 it's.jpeg", (later, later))
+    assert build()["skipped"] == ["reel"]
+
+    (folder / "photo 1 it's.jpeg").write_bytes(b"edited")
+    assert build()["rendered"] == ["reel"]
+    assert build(force=True)["rendered"] == ["reel"]
+
+    (out / "reel.mp4").unlink()
+    assert build()["rendered"] == ["reel"]
+    assert len(renders) == 4
+
+
+def test_projects_render_in_parallel_and_failures_are_reported(tmp_path, monkeypatch):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_render(spec, progress=None):
+        with lock:
+            running.append(spec)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(spec)
+        if "broken" in spec.output_path:
+            raise Exception("FFmpeg failed with return code 1")
+        open(spec.output_path, "wb").close()
+
+    monkeypatch.setattr(bulk_render, "render", fake_render)
+    projects = [load_project(_project(tmp_path, f"p{i}")) for i in range(6)]
+    projects.append(load_project(_project(tmp_path, "broken")))
+
+    summary = run(projects, tmp_path / "out", jobs=4, work_dir=tmp_path / "work")
+
+    assert max(peak) == 4
+    assert sorted(summary["rendered"]) == [f"p{i}" for i in range(6)]
+    assert summary["failed"] == {"broken": "FFmpeg failed with return code 1"}
+    state = json.loads((tmp_path / "out" / ".bulk_render.json").read_text())
+    assert sorted(state) == [f"p{i}" for i in range(6)]
+
+
+def test_manifest_sets_order_name_and_settings(tmp_path):
+    _project(tmp_path, "a", images=2)
+    _project(tmp_path, "b")
+    manifest = tmp_path / "projects.json"
+    manifest.write_text(
+        json.dumps(
+            [
+                "a",
+                {
+                    "path": "b",
+                    "name": "b vertical",
+                    "images": ["photo 2 it's.jpeg", "photo 0 it's.jpeg"],
+                    "filter_effect": "vintage",
+                },
+            ]
+        )
+    )
+
+    a, b = load_manifest(manifest, {"quality": "preview"})
+
+    assert (a["name"], len(a["images"])) == ("a", 2)
+    assert a["settings"]["quality"] == "preview"
+    assert b["name"] == "b_vertical"
+    assert b["images"] == ["photo 2 it's.jpeg", "photo 0 it's.jpeg"]
+    assert b["settings"]["filter_effect"] == "vintage"
+
+
+@pytest.mark.parametrize(
+    "options, message",
+    [
+        ({"aspect_ratio": "2:1"}, "unknown aspect ratio"),
+        ({"duration": "60"}, "image duration"),
+        ({"images": ["missing.jpg"]}, "no image named"),
+    ],
+)
+def test_invalid_projects_are_rejected(tmp_path, options, message):
+    with pytest.raises(ProjectError, match=message):
+        load_project(_project(tmp_path, "bad"), **options)
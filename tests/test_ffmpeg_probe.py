@@ -0,0 +1,69 @@
+import subprocess
+
+import ffmpeg_probe
+from ffmpeg_probe import FFmpegProbe
+
+VERSION = """ffmpeg version 6.1.1 Copyright (c) 2000-2023 the FFmpeg developers
+configuration: --enable-gpl --enable-libx264
+"""
+ENCODERS = """Encoders:
+ V..... = Video
+ ------
+ V....D libx264              libx264 H.264 / AVC
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+FILTERS = """Filters:
+  T.. = Timeline support
+  ------
+ TSC eq                V->V       Adjust brightness, contrast, gamma, and saturation.
+ ... hue               V->V       Adjust the hue and saturation of the input video.
+ ... scale             V->V       Scale the input video size and/or convert the image format.
+ ... pad               V->V       Pad the input video.
+ ... drawtext          V->V       Draw text on top of video frames using libfreetype library.
+"""
+
+
+def _fake_ffmpeg(calls):
+    def fake_run(command, **kwargs):
+        calls.append(command)
+        args = command[2:]
+        if args == ["-version"]:
+            return subprocess.CompletedProcess(command, 0, VERSION, "")
+        if args == ["-encoders"]:
+            return subprocess.CompletedProcess(command, 0, ENCODERS, "")
+        if args == ["-filters"]:
+            return subprocess.CompletedProcess(command, 0, FILTERS, "")
+        vf = args[args.index("-vf") + 1]
+        if "drawtext" in vf:
+            return subprocess.CompletedProcess(command, 1, "", "Cannot find a valid font\n")
+        return subprocess.CompletedProcess(command, 0, "", "")
+
+    return fake_run
+
+
+def test_filter_names_ignore_quoted_options():
+    """Commas inside quoted option values don't split a filter chain."""
+    chain = "eq=contrast=1.3,curves=all='0/0.1 0.5/0.58,1/0.9',hue=s=0"
+    assert ffmpeg_probe.filter_names(chain) == ["eq", "curves", "hue"]
+
+
+def test_probe_validates_effects_once_and_caches(tmp_path, monkeypatch):
+    """Effects are checked against the build once; later probes read the cache file."""
+    calls = []
+    monkeypatch.setattr(ffmpeg_probe.subprocess, "run", _fake_ffmpeg(calls))
+    monkeypatch.setattr(ffmpeg_probe.shutil, "which", lambda name: __file__)
+
+    probe = FFmpegProbe(cache_path=str(tmp_path / "probe.json"))
+    result = probe.get()
+    assert result["version"] == "6.1.1"
+    assert "libx264" in result["encoders"]
+    assert probe.supports_effect("noir")
+    assert not probe.supports_effect("xpro")
+    assert result["effects"]["xpro"]["reason"] == "missing filter colorbalance"
+    assert not probe.supports_text_overlay()
+    assert "none" not in probe.unsupported_effects()
+
+    probe.get()
+    first_probe = len(calls)
+    assert FFmpegProbe(cache_path=str(tmp_path / "probe.json")).get() == result
+    assert len(calls) == first_probe
@@ -0,0 +1,82 @@
+import struct
+import time
+
+import pytest
+
+from imageinfo import InvalidImage, parse_image_header
+
+
+def _png(width, height, color_type=6):
+    ihdr = struct.pack(
+        ">I4sIIBBBBB", 13, b"IHDR", width, height, 8, color_type, 0, 0, 0
+    )
+    return b"\x89PNG\r\n\x1a\n" + ihdr + b"\x00" * 4
+
+
+def _exif(orientation):
+    """An APP1 segment holding a big-endian IFD with just the orientation tag."""
+    tiff = b"MM\x00*" + struct.pack(">I", 8)
+    tiff += struct.pack(">HHHIHH", 1, 0x0112, 3, 1, orientation, 0) + b"\x00" * 4
+    payload = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _jpeg(width, height, orientation=None, marker=0xC0):
+    app0 = b"\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    frame = struct.pack(">BBHBHHB", 0xFF, marker, 17, 8, height, width, 3)
+    frame += b"\x01\x22\x00\x02\x11\x01\x03\x11\x01"
+    exif = _exif(orientation) if orientation else b""
+    return b"\xff\xd8" + app0 + exif + frame + b"\xff\xda\x00\x0c" + b"\x00" * 64
+
+
+def test_png_header():
+    info = parse_image_header(_png(1080, 1920))
+    assert (info["format"], info["width"], info["height"]) == ("png", 1080, 1920)
+    assert info["color_type"] == "rgba"
+    assert (info["display_width"], info["display_height"]) == (1080, 1920)
+
+
+def test_jpeg_header_reads_exif_orientation():
+    """A portrait phone photo stored sideways reports its displayed size."""
+    info = parse_image_header(_jpeg(4032, 3024, orientation=6, marker=0xC2))
+    assert (info["format"], info["width"], info["height"]) == ("jpeg", 4032, 3024)
+    assert info["orientation"] == 6
+    assert info["progressive"] is True
+    assert (info["display_width"], info["display_height"]) == (3024, 4032)
+
+
+def test_partial_header_needs_more_bytes():
+    data = _jpeg(640, 480, orientation=3)
+    for cut in (1, 4, 20, 40):
+        assert parse_image_header(data[:cut]) is None
+    assert parse_image_header(data)["orientation"] == 3
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"GIF89a\x01\x00\x01\x00",
+        b"\xff\xd8\xff\xda\x00\x0c" + b"\x00" * 16,
+        b"\x89PNG\r\n\x1a\n" + b"\x00" * 24,
+        _png(0, 100),
+        _png(20000, 20000),
+    ],
+)
+def test_invalid_or_oversized_headers_are_rejected(data):
+    with pytest.raises(InvalidImage):
+        parse_image_header(data)
+
+
+def test_pixel_limit_is_configurable():
+    assert parse_image_header(_png(2000, 1000), max_pixels=2_000_000)
+    with pytest.raises(InvalidImage):
+        parse_image_header(_png(2001, 1000), max_pixels=2_000_000)
+
+
+def test_hundred_headers_parse_in_milliseconds():
+    headers = [_jpeg(4000 + i, 3000, orientation=6) for i in range(50)]
+    headers += [_png(1080, 1920 + i) for i in range(50)]
+    started = time.perf_counter()
+    infos = [parse_image_header(head) for head in headers]
+    assert time.perf_counter() - started < 0.05
+    assert len({info["width"] * info["height"] for info in infos}) == 100
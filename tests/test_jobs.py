@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+from jobs import INTERRUPTED, JobManager, QueueFull
+
+
+def _block(manager):
+    """Occupy the only worker until the returned event is set."""
+    started = threading.Event()
+    release = threading.Event()
+    manager.submit("blocker", lambda: (started.set(), release.wait(5)))
+    started.wait(5)
+    return release
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(str(tmp_path), max_workers=1, max_queue_depth=3, cpu_count=8)
+    yield manager
+    manager.shutdown()
+
+
+def test_interactive_jobs_overtake_bulk_jobs(manager):
+    """Queued jobs run by priority, then in submission order."""
+    release = _block(manager)
+    order = []
+    for job_id, priority in (("bulk", "bulk"), ("normal", "normal"), ("preview", "interactive")):
+        manager.submit(job_id, order.append, job_id, priority=priority)
+    release.set()
+
+    manager.wait("bulk", timeout=5)
+    assert order == ["preview", "normal", "bulk"]
+    assert manager.get("preview")["priority"] == "interactive"
+
+
+def test_full_queue_refuses_work_with_retry_after(manager):
+    """Past max_queue_depth, submit raises QueueFull instead of queueing."""
+    release = _block(manager)
+    for i in range(3):
+        manager.submit(f"queued{i}", lambda: None)
+
+    with pytest.raises(QueueFull) as error:
+        manager.submit("one-too-many", lambda: None)
+    assert error.value.retry_after >= 1
+    assert manager.get("one-too-many") is None
+    release.set()
+
+
+def test_reserved_slots_keep_a_batch_whole(manager):
+    """Room reserved for a batch is not taken by other submissions."""
+    release = _block(manager)
+    manager.reserve(2)
+    manager.submit("other", lambda: None)
+    with pytest.raises(QueueFull):
+        manager.submit("late", lambda: None)
+    with pytest.raises(QueueFull):
+        manager.reserve(1)
+
+    manager.submit("variant0", lambda: None, reserved=True)
+    manager.release(1)
+    manager.submit("after", lambda: None)
+    release.set()
+    manager.wait("after", timeout=5)
+    assert manager.get("variant0")["status"] == "done"
+
+
+def test_thread_budget_splits_cores_between_workers(tmp_path):
+    """Each worker gets an equal share of the cores, at least one thread."""
+    assert JobManager(str(tmp_path), max_workers=2, cpu_count=8).thread_budget == 4
+    assert JobManager(str(tmp_path), max_workers=4, cpu_count=2).thread_budget == 1
+
+
+def test_progress_is_followed_from_another_process(tmp_path):
+    """A second manager on the same folder sees the job's progress through job.json."""
+    running = JobManager(str(tmp_path), max_workers=1)
+    watching = JobManager(str(tmp_path), max_workers=1)
+    (tmp_path / "job").mkdir()
+    reported = threading.Event()
+    release = threading.Event()
+
+    def render():
+        running.report_progress("job", "encode", 0.5)
+        reported.set()
+        release.wait(5)
+
+    running.submit("job", render)
+    reported.wait(5)
+    job, version = watching.wait_for_change("job")
+    assert job["progress"] == {"stage": "encode", "fraction": 0.5}
+
+    release.set()
+    job, _ = watching.wait_for_change("job", version, timeout=5)
+    assert job["status"] == "done"
+    running.shutdown()
+
+
+
+def test_shutdown_can_fail_queued_jobs_and_finish_running_ones(manager):
+    """A leaving worker finishes what is running and gives up what is queued."""
+    release = _block(manager)
+    manager.submit("queued", lambda: None)
+    stopping = threading.Thread(
+        target=manager.shutdown, kwargs={"cancel_queued": True}
+    )
+    stopping.start()
+
+    queued = manager.wait("queued", timeout=5)
+    assert (queued["status"], queued["error"]) == ("failed", INTERRUPTED)
+    assert manager.get("blocker")["status"] == "running"
+    release.set()
+    stopping.join(5)
+    assert manager.get("blocker")["status"] == "done"
@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from blobs import BlobStore
+from lifecycle import StorageLifecycle
+from render_queue import RenderQueue
+
+
+def _age(path, hours):
+    """Backdate a file or folder's mtime and atime by ``hours``."""
+    then = time.time() - hours * 3600
+    os.utime(path, (then, then))
+
+
+def _upload(root, name, job=None, size=100):
+    folder = root / "user_uploads" / name
+    folder.mkdir(parents=True)
+    (folder / "img_000.jpg").write_bytes(b"x" * size)
+    if job is not None:
+        (folder / "job.json").write_text(json.dumps(job))
+    return folder
+
+
+@pytest.fixture
+def lifecycle(tmp_path):
+    return StorageLifecycle(
+        str(tmp_path / "user_uploads"),
+        static_dir=str(tmp_path / "static"),
+        retention_hours=24,
+        orphan_hours=6,
+        quota_bytes=0,
+        chunk_folder=str(tmp_path / "upload_chunks"),
+        queue_db=str(tmp_path / "queue.db"),
+        done_file=str(tmp_path / "done.txt"),
+    )
+
+
+def test_finished_uploads_expire_after_retention(tmp_path, lifecycle):
+    """Uploads go once their render is older than the retention; others stay."""
+    old = (datetime.now() - timedelta(hours=30)).isoformat()
+    recent = datetime.now().isoformat()
+    _upload(tmp_path, "old", {"status": "done", "finished_at": old})
+    _upload(tmp_path, "recent", {"status": "done", "finished_at": recent})
+    _upload(tmp_path, "active", {"status": "done", "finished_at": old})
+    lifecycle.is_active = lambda folder: folder == "active"
+    drafts = tmp_path / "static" / "drafts"
+    drafts.mkdir(parents=True)
+    (drafts / "old.mp4").write_bytes(b"d" * 10)
+
+    report = lifecycle.sweep()
+
+    assert sorted(os.listdir(tmp_path / "user_uploads")) == ["active", "recent"]
+    assert not (drafts / "old.mp4").exists()
+    assert (
+        report["uploads"]
+        == 100 + len(json.dumps({"status": "done", "finished_at": old})) + 10
+    )
+    assert lifecycle.last_report is report
+
+
+def test_edited_or_promoted_uploads_are_kept(tmp_path, lifecycle):
+    """Retention counts from the last edit or promotion recorded in job.json."""
+    from jobs import JobManager
+    old = (datetime.now() - timedelta(hours=30)).isoformat()
+    _upload(tmp_path, "edited", {"status": "done", "finished_at": old})
+    _upload(tmp_path, "idle", {"status": "done", "finished_at": old})
+    JobManager(str(tmp_path / "user_uploads")).mark_used("edited")
+
+    lifecycle.sweep()
+
+    assert os.listdir(tmp_path / "user_uploads") == ["edited"]
+    job = json.loads((tmp_path / "user_uploads" / "edited" / "job.json").read_text())
+    assert job["finished_at"] == old and job["last_used_at"] > old
+
+
+def test_orphans_are_swept(tmp_path, lifecycle):
+    """Stale staging folders, unknown folders, chunk sessions and .part files go."""
+    staging = _upload(tmp_path, ".incoming-abc")
+    unknown = _upload(tmp_path, "unknown")
+    fresh = _upload(tmp_path, ".incoming-new")
+    chunks = tmp_path / "upload_chunks"
+    chunks.mkdir()
+    (chunks / "abc.part").write_bytes(b"y" * 50)
+    reels = tmp_path / "static" / "reels"
+    reels.mkdir(parents=True)
+    (reels / "reel.mp4.part").write_bytes(b"z" * 5)
+    for path in (staging, unknown, chunks / "abc.part", reels / "reel.mp4.part"):
+        _age(path, 7)
+
+    report = lifecycle.sweep()
+
+    assert os.listdir(tmp_path / "user_uploads") == [fresh.name]
+    assert os.listdir(chunks) == [] and os.listdir(reels) == []
+    assert report["orphans"] == 100 + 100 + 50 + 5
+
+
+def test_quota_evicts_least_recently_served_reels(tmp_path, lifecycle):
+    """Over quota, the reels served longest ago are removed first."""
+    reels = tmp_path / "static" / "reels"
+    reels.mkdir(parents=True)
+    for name, hours in (("old", 30), ("served", 1), ("new", 0)):
+        (reels / f"{name}.mp4").write_bytes(b"v" * 100)
+        _age(reels / f"{name}.mp4", hours)
+    # Hard-linked copy of "new" shares its bytes
+    os.link(reels / "new.mp4", reels / "copy.mp4")
+
+    removed = []
+
+    def remove_reel(name):
+        removed.append(name)
+        os.remove(reels / f"{name}.mp4")
+
+    lifecycle.quota_bytes = 200
+    lifecycle.remove_reel = remove_reel
+    report = lifecycle.sweep()
+
+    assert removed == ["old"]
+    assert report["reels"] == 100
+
+
+def test_processed_records_are_compacted(tmp_path, lifecycle):
+    """Queue rows and done.txt lines are dropped once their folder is gone."""
+    queue = RenderQueue(str(tmp_path / "queue.db"))
+    for folder in ("gone", "kept", "pending"):
+        queue.enqueue(folder)
+    queue.claim()
+    queue.complete("gone")
+    queue.claim()
+    queue.complete("kept")
+    _upload(tmp_path, "kept")
+    (tmp_path / "done.txt").write_text("gone\nkept\n")
+
+    report = lifecycle.sweep()
+
+    assert report["queue_rows"] == 1 and report["done_lines"] == 1
+    assert [job["folder"] for job in queue.list()] == ["kept", "pending"]
+    assert (tmp_path / "done.txt").read_text() == "kept\n"
+    queue.close()
+
+
+def test_sweep_is_skipped_while_another_process_sweeps(tmp_path, lifecycle):
+    """Only the server process holding the lifecycle lock sweeps storage."""
+    fcntl = pytest.importorskip("fcntl")
+    lock = tmp_path / "cache" / "lifecycle.lock"
+    lock.parent.mkdir()
+    _upload(tmp_path, "old", {"status": "done", "finished_at": "2000-01-01T00:00:00"})
+    lifecycle.lock_path = str(lock)
+
+    with open(lock, "a") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        assert lifecycle.sweep() is None
+        assert (tmp_path / "user_uploads" / "old").exists()
+
+    assert lifecycle.sweep()["uploads"] > 0
+    assert not (tmp_path / "user_uploads" / "old").exists()
+
+
+def test_blobs_of_expired_uploads_are_freed(tmp_path, lifecycle):
+    """Blobs are freed once the last upload folder linking to them is gone."""
+    old = (datetime.now() - timedelta(hours=30)).isoformat()
+    lifecycle.blob_store = store = BlobStore(str(tmp_path / "blobs"))
+    for name, finished_at in (("old", old), ("recent", datetime.now().isoformat())):
+        folder = _upload(tmp_path, name, {"status": "done", "finished_at": finished_at})
+        store.adopt(str(folder), {"img_000.jpg": "ab" * 32})
+
+    report = lifecycle.sweep()
+    assert not (tmp_path / "user_uploads" / "old").exists()
+    assert report["blobs"] == 0 and store.usage()["blobs"] == 1
+
+    shutil.rmtree(tmp_path / "user_uploads" / "recent")
+    report = lifecycle.sweep()
+    assert report["blobs"] == report["reclaimed_bytes"] == 100
+    assert store.usage()["blobs"] == 0
@@ -0,0 +1,38 @@
+import io
+import json
+import logging
+
+from logs import JsonFormatter
+from metrics import Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Histogram buckets are cumulative and include +Inf, sum and count."""
+    registry = Registry()
+    histogram = registry.histogram("render_seconds", "Render time", ("aspect_ratio",), buckets=(1, 5))
+    for value in (0.5, 2, 10):
+        histogram.observe(value, aspect_ratio="9:16")
+    registry.counter("uploads_total", "Uploads").inc(2)
+
+    text = registry.render()
+    assert 'render_seconds_bucket{aspect_ratio="9:16",le="1"} 1' in text
+    assert 'render_seconds_bucket{aspect_ratio="9:16",le="5"} 2' in text
+    assert 'render_seconds_bucket{aspect_ratio="9:16",le="+Inf"} 3' in text
+    assert 'render_seconds_sum{aspect_ratio="9:16"} 12.5' in text
+    assert "uploads_total 2" in text
+
+
+def test_json_formatter_includes_extra_fields():
+    """Fields passed with extra= become keys of the JSON log line."""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("test_metrics.json")
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.warning("Reel created", extra={"reel": "demo", "seconds": 1.5})
+
+    entry = json.loads(stream.getvalue())
+    assert entry["message"] == "Reel created"
+    assert entry["level"] == "warning"
+    assert (entry["reel"], entry["seconds"]) == ("demo", 1.5)
@@ -0,0 +1,181 @@
+import json
+import os
+import subprocess
+
+import audio
+import precompose
+import render_engine
+import profiling
+from profiling import (
+    CACHE_HIT,
+    ProfileCache,
+    RenderStats,
+    parse_benchmark,
+    profiling_report,
+)
+
+BENCH = (
+    "frame=  60 fps=0.0 q=-1.0 Lsize=  12kB\n"
+    "bench: utime=1.250s stime=0.250s rtime=0.900s\n"
+    "bench: maxrss=51200KiB\n"
+)
+
+
+def test_benchmark_output_is_parsed():
+    assert parse_benchmark(BENCH) == {
+        "utime": 1.25,
+        "stime": 0.25,
+        "rtime": 0.9,
+        "maxrss_kb": 51200,
+    }
+    assert parse_benchmark("bench: maxrss=1024kB\n") == {"maxrss_kb": 1024}
+    assert parse_benchmark("") == {}
+
+
+class BenchPopen:
+    """Pretend FFmpeg encoded a clip and printed its -benchmark lines."""
+
+    commands = []
+
+    def __init__(self, command, **kwargs):
+        self.commands.append(command)
+        with open(os.path.join(kwargs["cwd"], command[-1]), "wb") as f:
+            f.write(b"v" * 3000)
+        self.stdout = iter(["out_time_us=2000000\n"])
+        self.stderr = iter(BENCH.splitlines(keepends=True))
+
+    def wait(self):
+        return 0
+
+
+def test_profiled_render_records_every_stage(tmp_path, monkeypatch):
+    """Every FFmpeg process runs with -benchmark and its cost is kept per stage."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        precompose, "still_cache", precompose.StillCache(str(tmp_path / "stills"))
+    )
+    monkeypatch.setattr(audio, "audio_cache", audio.AudioCache(str(tmp_path / "audio")))
+    upload = tmp_path / "user_uploads" / "job"
+    upload.mkdir(parents=True)
+    for name in ("a.jpg", "b.jpg"):
+        (upload / name).write_bytes(name.encode())
+    (upload / "audio.mp3").write_bytes(b"ID3fake-mp3")
+    render_engine.write_concat_list(
+        str(upload / "input.txt"), [("a.jpg", 1), ("b.jpg", 1)]
+    )
+
+    runs = []
+
+    def run(command, **kwargs):
+        runs.append(command)
+        open(command[-1], "wb").close()
+        return subprocess.CompletedProcess(command, 0, stdout="", stderr=BENCH)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(subprocess, "Popen", BenchPopen)
+    BenchPopen.commands = []
+    stats = RenderStats()
+    render_engine.create_reel("job", "reel", segmented=False, stats=stats)
+
+    assert all("-benchmark" in command for command in runs + BenchPopen.commands)
+    profile = stats.as_dict()
+    assert {name: stage["processes"] for name, stage in profile["stages"].items()} == {
+        "audio": 1,
+        "precompose": 2,
+        "encode": 1,
+    }
+    assert profile["utime"] == 5.0 and profile["max_rss_mb"] == 50.0
+    assert (profile["frames"], profile["video_seconds"]) == (60, 2)
+    assert profile["output_bitrate_kbps"] == 12.0
+    assert profile["fps"] == round(60 / stats.stages["encode"]["seconds"], 1)
+
+    runs.clear()
+    BenchPopen.commands = []
+    render_engine.create_reel("job", "plain", segmented=False)
+    assert not any("-benchmark" in command for command in BenchPopen.commands)
+
+
+def _metadata(
+    folder, name, effect, aspect_ratio, precompose_cpu, encode_cpu, cache_hits=0
+):
+    stage = {"seconds": 1.0, "processes": 1, "stime": 0.0, "max_rss_mb": 10.0}
+    profile = {
+        "seconds": 2.0,
+        "frames": 300,
+        "video_seconds": 10.0,
+        "max_rss_mb": 10.0,
+        "output_bytes": 125_000,
+        "stages": {
+            "audio": dict(stage, utime=5.0, cache_hits=1),
+            "precompose": dict(stage, utime=precompose_cpu, cache_hits=cache_hits),
+            "encode": dict(stage, utime=encode_cpu),
+        },
+    }
+    (folder / f"{name}.json").write_text(
+        json.dumps(
+            {
+                "name": name,
+                "filter_effect": effect,
+                "aspect_ratio": aspect_ratio,
+                "text_overlay": "",
+                "profiling": profile,
+            }
+        )
+    )
+
+
+def test_report_ranks_settings_by_cpu_per_video_second(tmp_path):
+    _metadata(tmp_path, "a", "none", "9:16", 1.0, 10.0)
+    _metadata(tmp_path, "b", "vintage", "9:16", 9.0, 11.0)
+    _metadata(tmp_path, "c", "vintage", "1:1", 7.0, 9.0)
+    (tmp_path / "unprofiled.json").write_text(json.dumps({"name": "unprofiled"}))
+
+    report = profiling_report(str(tmp_path))
+
+    assert (report["reels"], report["cached_reels"]) == (3, 0)
+    vintage, none = report["filter_effect"]
+    assert (vintage["group"], vintage["reels"]) == ("vintage", 2)
+    assert vintage["precompose_cpu_per_video_second"] == 0.8
+    assert vintage["cpu_per_video_second"] == 1.8
+    assert none["cpu_per_video_second"] == 1.1
+    assert [row["group"] for row in report["aspect_ratio"]] == ["1:1", "9:16"]
+    assert report["text_overlay"][0]["group"] == "none"
+    assert none["fps"] == 300 and none["output_bitrate_kbps"] == 100.0
+
+
+def test_cache_hits_are_counted_apart_and_left_out_of_the_ranking(tmp_path):
+    """A still taken from the cache costs nothing and must not make a setting look cheap."""
+    stats = RenderStats()
+    stats.recorder("precompose")({"utime": 2.0, "stime": 0.0, "maxrss_kb": 1024})
+    stats.recorder("precompose")(CACHE_HIT)
+    profile = stats.as_dict()
+    assert profile["stages"]["precompose"]["processes"] == 1
+    assert profile["stages"]["precompose"]["cache_hits"] == profile["cache_hits"] == 1
+
+    _metadata(tmp_path, "a", "none", "9:16", 1.0, 10.0)
+    _metadata(tmp_path, "b", "vintage", "9:16", 0.0, 11.0, cache_hits=2)
+    report = profiling_report(str(tmp_path))
+
+    assert (report["reels"], report["cached_reels"]) == (1, 1)
+    assert [row["group"] for row in report["filter_effect"]] == ["none"]
+
+
+def test_profile_cache_only_rereads_changed_files(tmp_path, monkeypatch):
+    _metadata(tmp_path, "a", "none", "9:16", 1.0, 10.0)
+    _metadata(tmp_path, "b", "vintage", "9:16", 9.0, 11.0)
+    cache = ProfileCache(str(tmp_path))
+    assert cache.report()["reels"] == 2
+
+    reads = []
+    read_profile = profiling._read_profile
+    monkeypatch.setattr(
+        profiling, "_read_profile", lambda path: reads.append(path) or read_profile(path)
+    )
+    assert cache.report()["reels"] == 2
+    assert reads == []
+
+    _metadata(tmp_path, "c", "vintage", "1:1", 7.0, 9.0)
+    (tmp_path / "a.json").unlink()
+    report = cache.report()
+    assert reads == [str(tmp_path / "c.json")]
+    assert [row["group"] for row in report["filter_effect"]] == ["vintage"]
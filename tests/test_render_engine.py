@@ -0,0 +1,436 @@
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import audio
+import precompose
+import render_engine
+import segment_cache
+
+
+def _completed(command):
+    """Pretend FFmpeg succeeded and wrote its output file."""
+    if command[-1].endswith((".part", ".png", ".m4a", ".mp4")):
+        with open(command[-1], "wb") as f:
+            f.write(b"output")
+    return subprocess.CompletedProcess(command, 0, stdout="", stderr="")
+
+
+class FakePopen:
+    """Pretend FFmpeg encoded a 2 second clip, reporting -progress on stdout."""
+
+    commands = []
+
+    def __init__(self, command, **kwargs):
+        self.cwd = kwargs["cwd"]
+        self.commands.append(command)
+        _completed(command)
+        self.stdout = iter(
+            ["out_time_us=N/A\n", "out_time_us=1000000\n", "out_time_us=2000000\n"]
+        )
+        self.stderr = iter(["frame=60\n"])
+
+    def wait(self):
+        return 0
+
+
+def _upload(tmp_path, entries):
+    """An upload folder "job" with a concat list and an MP3."""
+    folder = tmp_path / "user_uploads" / "job"
+    folder.mkdir(parents=True)
+    render_engine.write_concat_list(str(folder / "input.txt"), entries)
+    (folder / "audio.mp3").write_bytes(b"ID3fake-mp3")
+    return folder
+
+
+def test_concat_list_round_trip(tmp_path):
+    """Concat lists are parsed back without the trailing repeated image."""
+    path = tmp_path / "input.txt"
+    entries = [("img_000.jpg", 1.0), ("img_001.png", 2.5)]
+    render_engine.write_concat_list(str(path), entries)
+    assert render_engine.parse_concat_list(str(path)) == entries
+
+
+def test_segments_close_on_gop_boundaries():
+    """Segments are cut on image boundaries that land on a keyframe."""
+    entries = [(f"img_{i:03d}.jpg", 1.5) for i in range(12)]
+    segments = render_engine.split_segments(entries, segment_seconds=4)
+
+    assert sum(len(segment) for segment in segments) == 12
+    for segment in segments[:-1]:
+        frames = sum(round(d * render_engine.FRAME_RATE) for _, d in segment)
+        assert frames % render_engine.GOP_SIZE == 0
+
+
+def test_segmented_render_joins_with_stream_copy(tmp_path, monkeypatch):
+    """Segments are encoded without audio and joined with -c:v copy plus one audio mux."""
+    monkeypatch.chdir(tmp_path)
+    folder = _upload(tmp_path, [(f"img_{i:03d}.jpg", 2) for i in range(6)])
+
+    commands = FakePopen.commands = []
+    progress = []
+    monkeypatch.setattr(subprocess, "run", lambda command, **kwargs: _completed(command))
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+    render_engine.create_reel(
+        "job",
+        "reel",
+        segmented=True,
+        precompose=False,
+        progress=lambda stage, fraction: progress.append((stage, fraction)),
+    )
+
+    *segment_commands, join_command = commands
+    assert all("-progress" in command for command in commands)
+    assert len(segment_commands) > 1
+    assert all("-an" in command for command in segment_commands)
+    assert join_command[join_command.index("-c:v") + 1] == "copy"
+    assert join_command[join_command.index("-c:a") + 1] == "copy"
+    assert sum(arg.endswith(".m4a") for arg in join_command) == 1
+    assert join_command[join_command.index("-movflags") + 1] == "+faststart"
+    assert not list(folder.glob("segment_*"))
+    fractions = [fraction for stage, fraction in progress if stage == "encode"]
+    assert fractions == sorted(fractions) and fractions[-1] > 0
+
+
+def test_thread_budget_caps_every_encoder(tmp_path, monkeypatch):
+    """With a budget of 4 threads, segment encoders share it instead of each using all cores."""
+    monkeypatch.chdir(tmp_path)
+    _upload(tmp_path, [(f"img_{i:03d}.jpg", 2) for i in range(12)])
+    commands = FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", lambda command, **kwargs: _completed(command))
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+
+    render_engine.create_reel("job", "reel", segmented=True, precompose=False, threads=4)
+    *segment_commands, _ = commands
+    assert len(segment_commands) == 4
+    assert all(command[command.index("-threads") + 1] == "1" for command in segment_commands)
+
+    commands.clear()
+    render_engine.create_reel("job", "reel", segmented=False, precompose=False, threads=4)
+    assert commands[0][commands[0].index("-threads") + 1] == "4"
+
+
+def test_precomposed_stills_are_cached_by_content(tmp_path, monkeypatch):
+    """Each still is filtered once, reused across reels, and the encode drops -vf."""
+    monkeypatch.chdir(tmp_path)
+    cache = precompose.StillCache(str(tmp_path / "cache"), max_bytes=10**6)
+    monkeypatch.setattr(precompose, "still_cache", cache)
+
+    for folder in ("first", "second"):
+        upload = tmp_path / "user_uploads" / folder
+        upload.mkdir(parents=True)
+        (upload / "a.jpg").write_bytes(b"same image")
+        (upload / "audio.mp3").write_bytes(b"ID3fake-mp3")
+        render_engine.write_concat_list(str(upload / "input.txt"), [("a.jpg", 1)])
+
+    commands = FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", lambda command, **kwargs: _completed(command))
+    monkeypatch.setattr(subprocess, "Popen", FakePopen)
+    render_engine.create_reel("first", "one", filter_effect="dream", segmented=False)
+    render_engine.create_reel("second", "two", filter_effect="dream", segmented=False)
+
+    assert (cache.misses, cache.hits) == (1, 1)
+    encodes = [command for command in commands if command[-1].endswith(".part")]
+    assert all("-vf" not in command for command in encodes)
+    assert all(render_engine.PRECOMPOSED_LIST in command for command in encodes)
+
+
+def test_incremental_render_only_encodes_changed_images(tmp_path, monkeypatch):
+    """After one image of a reel changes, only that image's segment is encoded again."""
+    monkeypatch.chdir(tmp_path)
+    cache = segment_cache.SegmentCache(str(tmp_path / "segments"), max_bytes=10**6)
+    monkeypatch.setattr(render_engine, "segment_cache", cache)
+    folder = _upload(tmp_path, [(f"img_{i:03d}.jpg", 2) for i in range(8)])
+    for i in range(8):
+        (folder / f"img_{i:03d}.jpg").write_bytes(f"image {i}".encode())
+
+    runs = []
+
+    def run(command, **kwargs):
+        runs.append(command)
+        return _completed(command)
+
+    commands = FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+    render_engine.create_reel("job", "reel", precompose=False, incremental=True)
+
+    def segment_runs():
+        return [command for command in runs if "-loop" in command]
+
+    assert len(segment_runs()) == 8
+    (join_command,) = commands
+    assert join_command[join_command.index("-c:v") + 1] == "copy"
+    assert join_command[join_command.index("-c:a") + 1] == "copy"
+
+    runs.clear()
+    (folder / "img_005.jpg").write_bytes(b"a different photo")
+    render_engine.create_reel("job", "reel", precompose=False, incremental=True)
+    (command,) = segment_runs()
+    assert command[command.index("-frames:v") + 1] == "60"
+    assert command[command.index("-i") + 1].endswith("img_005.jpg")
+    assert not (folder / "segments.txt").exists()
+
+
+def test_added_image_reuses_segments_encoded_with_other_thread_counts(tmp_path, monkeypatch):
+    """Going from 3 to 4 images changes -threads per clip but reuses the 3 clips."""
+    monkeypatch.chdir(tmp_path)
+    cache = segment_cache.SegmentCache(str(tmp_path / "segments"), max_bytes=10**6)
+    monkeypatch.setattr(render_engine, "segment_cache", cache)
+    folder = _upload(tmp_path, [(f"img_{i:03d}.jpg", 1) for i in range(3)])
+    for i in range(4):
+        (folder / f"img_{i:03d}.jpg").write_bytes(f"image {i}".encode())
+
+    runs = []
+
+    def run(command, **kwargs):
+        runs.append(command)
+        return _completed(command)
+
+    FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+    render_engine.create_reel("job", "reel", precompose=False, incremental=True, threads=12)
+    assert [command[command.index("-threads") + 1] for command in runs if "-loop" in command] == ["4"] * 3
+
+    runs.clear()
+    render_engine.write_concat_list(
+        str(folder / "input.txt"), [(f"img_{i:03d}.jpg", 1) for i in range(4)]
+    )
+    render_engine.create_reel("job", "reel", precompose=False, incremental=True, threads=12)
+    (command,) = [command for command in runs if "-loop" in command]
+    assert command[command.index("-i") + 1].endswith("img_003.jpg")
+    assert command[command.index("-threads") + 1] == "3"
+
+
+def test_preview_profile_renders_small_draft(tmp_path, monkeypatch):
+    """The preview tier encodes the first few images small and fast into static/drafts."""
+    monkeypatch.chdir(tmp_path)
+    folder = _upload(tmp_path, [(f"img_{i:03d}.jpg", 1) for i in range(20)])
+
+    commands = FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", lambda command, **kwargs: _completed(command))
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+    output = render_engine.create_reel(
+        "job", "job", text_overlay="hi", precompose=False, quality="preview"
+    )
+
+    assert output == str(tmp_path / "static" / "drafts" / "job.mp4")
+    (command,) = commands
+    assert command[command.index("-preset") + 1] == "ultrafast"
+    assert command[command.index("-r") + 1] == "15"
+    assert "scale=360:640" in command[command.index("-vf") + 1]
+    assert "fontsize=20" in command[command.index("-vf") + 1]
+    entries = render_engine.parse_concat_list(
+        str(folder / render_engine.PREVIEW_LIST)
+    )
+    assert len(entries) == render_engine.PREVIEW_MAX_IMAGES
+
+
+def test_audio_is_trimmed_once_and_copied(tmp_path, monkeypatch):
+    """The soundtrack is cut to the reel, transcoded once per length and muxed with -c:a copy."""
+    monkeypatch.chdir(tmp_path)
+    _upload(tmp_path, [(f"img_{i:03d}.jpg", 2) for i in range(3)])
+    cache = audio.AudioCache(str(tmp_path / "audio"), max_bytes=10**6)
+    monkeypatch.setattr(audio, "audio_cache", cache)
+    transcodes = []
+
+    def fake_run(command, **kwargs):
+        transcodes.append(command)
+        return _completed(command)
+
+    commands = FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FakePopen)
+    render_engine.create_reel("job", "one", segmented=False, precompose=False)
+    render_engine.create_reel("job", "two", segmented=False, precompose=False)
+
+    (transcode,) = transcodes
+    assert transcode[transcode.index("-t") + 1] == "6.000"
+    assert transcode.index("-t") < transcode.index("-i")
+    assert (cache.misses, cache.hits) == (1, 1)
+    for command in commands:
+        assert command[command.index("-c:a") + 1] == "copy"
+        assert cache.path_for(cache.key(str(tmp_path / "user_uploads" / "job" / "audio.mp3"), 6)) in command
+
+
+def test_audio_probe_is_stored_with_the_upload(tmp_path, monkeypatch):
+    """ffprobe runs once per upload; later calls read audio.json."""
+    (tmp_path / "audio.mp3").write_bytes(b"ID3fake-mp3")
+    probes = []
+
+    def fake_run(command, **kwargs):
+        probes.append(command)
+        stdout = json.dumps({
+            "streams": [{"codec_name": "mp3", "sample_rate": "44100", "channels": 2}],
+            "format": {"duration": "3600.5", "bit_rate": "128000"},
+        })
+        return subprocess.CompletedProcess(command, 0, stdout=stdout, stderr="")
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    expected = {
+        "duration": 3600.5,
+        "bit_rate": 128000,
+        "sample_rate": 44100,
+        "channels": 2,
+        "codec": "mp3",
+    }
+    assert audio.audio_info(str(tmp_path)) == expected
+    assert audio.audio_info(str(tmp_path)) == expected
+    assert len(probes) == 1
+
+
+def test_concurrent_renders_do_not_cross_talk(tmp_path, monkeypatch):
+    """Many renders on threads each read their own folder and write their own reel, with no chdir."""
+    elsewhere = tmp_path / "elsewhere"
+    (elsewhere / "static" / "metadata").mkdir(parents=True)
+    monkeypatch.chdir(elsewhere)
+    monkeypatch.setattr(
+        precompose, "still_cache", precompose.StillCache(str(tmp_path / "stills"))
+    )
+    monkeypatch.setattr(audio, "audio_cache", audio.AudioCache(str(tmp_path / "audio")))
+
+    class TaggingPopen(FakePopen):
+        """Writes the name of the folder FFmpeg ran in into the output."""
+
+        def __init__(self, command, **kwargs):
+            super().__init__(command, **kwargs)
+            if command[-1].endswith(".part"):
+                with open(command[-1], "w") as f:
+                    f.write(os.path.basename(kwargs["cwd"]))
+
+    FakePopen.commands = []
+    monkeypatch.setattr(subprocess, "run", lambda command, **kwargs: _completed(command))
+    monkeypatch.setattr(render_engine.subprocess, "Popen", TaggingPopen)
+
+    specs = []
+    for i in range(16):
+        folder = tmp_path / "user_uploads" / f"job{i}"
+        folder.mkdir(parents=True)
+        entries = [(f"img_{j:03d}.jpg", 1) for j in range(3 + i % 4)]
+        for name, _ in entries:
+            (folder / name).write_bytes(f"job{i} {name}".encode())
+        (folder / "audio.mp3").write_bytes(f"ID3 job{i}".encode())
+        render_engine.write_concat_list(str(folder / "input.txt"), entries)
+        specs.append(
+            render_engine.RenderSpec.for_folder(
+                f"job{i}",
+                f"reel{i}",
+                base_dir=str(tmp_path),
+                aspect_ratio=("9:16", "16:9", "1:1")[i % 3],
+                segmented=i % 2 == 0,
+                threads=2,
+            )
+        )
+
+    # A request handler opening relative paths the whole time
+    stop = threading.Event()
+    handled = []
+
+    def requests():
+        while not stop.is_set():
+            with open(os.path.join("static", "metadata", "probe.json"), "w") as f:
+                f.write("{}")
+            handled.append(os.getcwd())
+
+    handler = threading.Thread(target=requests)
+    handler.start()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            outputs = list(pool.map(render_engine.render, specs))
+    finally:
+        stop.set()
+        handler.join()
+
+    assert set(handled) == {str(elsewhere)}
+    for i, output in enumerate(outputs):
+        assert output == str(tmp_path / "static" / "reels" / f"reel{i}.mp4")
+        with open(output) as f:
+            assert f.read() == f"job{i}"
+    # Each reel was muxed with the soundtrack prepared from its own upload
+    for command in FakePopen.commands:
+        if command[-1].endswith(".part"):
+            i = int(os.path.basename(command[-1])[len("reel") : -len(".mp4.part")])
+            own_audio = audio.audio_cache.path_for(
+                audio.audio_cache.key(
+                    str(tmp_path / "user_uploads" / f"job{i}" / "audio.mp3"), 3 + i % 4
+                )
+            )
+            assert own_audio in command
+    assert not list((tmp_path / "user_uploads").glob("*/segment_*"))
+
+
+def test_render_spec_needs_absolute_paths():
+    with pytest.raises(ValueError):
+        render_engine.RenderSpec("user_uploads/job", "/tmp/reel.mp4")
+
+
+def test_failed_ffmpeg_keeps_stderr_tail(tmp_path, monkeypatch, caplog):
+    """A failing FFmpeg run raises and logs only the last lines of stderr."""
+    class FailingPopen(FakePopen):
+        def __init__(self, command, **kwargs):
+            super().__init__(command, **kwargs)
+            self.stderr = iter(f"line {i}\n" for i in range(1000))
+
+        def wait(self):
+            return 1
+
+    monkeypatch.setattr(render_engine.subprocess, "Popen", FailingPopen)
+    seen = []
+    try:
+        render_engine.run_ffmpeg(["ffmpeg", "-i", "x"], str(tmp_path), "x", seen.append)
+    except Exception as e:
+        assert "return code 1" in str(e)
+    else:
+        raise AssertionError("run_ffmpeg did not raise")
+
+    (record,) = [r for r in caplog.records if r.getMessage() == "FFmpeg failed"]
+    assert "line 999" in record.stderr_tail and "line 0\n" not in record.stderr_tail
+    assert seen == [1.0, 2.0]
+
+
+def test_still_cache_evicts_least_recently_used(tmp_path):
+    """The cache drops the oldest stills once it grows past max_bytes."""
+    cache = precompose.StillCache(str(tmp_path), max_bytes=10)
+    paths = []
+    for i, key in enumerate(("aa11", "bb22", "cc33")):
+        path = cache.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * 5)
+        os.utime(path, (i, i))
+        paths.append(path)
+
+    assert cache.evict() == 5
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+
+
+def test_concurrent_requests_for_one_still_render_it_once(tmp_path, monkeypatch):
+    """Renders sharing a still wait for the first one instead of running FFmpeg again."""
+    cache = precompose.StillCache(str(tmp_path / "cache"), max_bytes=10**6)
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"shared image")
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def slow_run(command, **kwargs):
+        runs.append(command)
+        started.set()
+        release.wait(5)
+        return _completed(command)
+
+    monkeypatch.setattr(subprocess, "run", slow_run)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(cache.get_or_create, str(image), "hue=s=0")
+        started.wait(5)
+        second = pool.submit(cache.get_or_create, str(image), "hue=s=0")
+        release.set()
+        assert first.result() == second.result()
+
+    assert len(runs) == 1
+    assert (cache.misses, cache.hits) == (1, 1)
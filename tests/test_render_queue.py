@@ -0,0 +1,62 @@
+import pytest
+
+from render_queue import RenderQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = RenderQueue(str(tmp_path / "queue.db"), max_attempts=2, retry_delay=0)
+    yield q
+    q.close()
+
+
+def test_enqueue_is_idempotent(queue):
+    """A folder is only queued once."""
+    assert queue.enqueue("a") is True
+    assert queue.enqueue("a") is False
+    assert queue.counts() == {"pending": 1}
+
+
+def test_claim_and_complete(queue):
+    """Claiming marks the job running and counts the attempt."""
+    queue.enqueue("a")
+    job = queue.claim()
+    assert job["folder"] == "a"
+    assert job["status"] == "running"
+    assert job["attempts"] == 1
+    assert queue.claim() is None
+
+    queue.complete("a")
+    assert queue.get("a")["status"] == "done"
+
+
+def test_failures_end_in_dead_letter(queue):
+    """A job that keeps failing stops being retried after max_attempts."""
+    queue.enqueue("broken")
+
+    queue.claim()
+    assert queue.fail("broken", "bad input") == "pending"
+    queue.claim()
+    assert queue.fail("broken", "still bad") == "dead"
+
+    assert queue.claim() is None
+    job = queue.get("broken")
+    assert job["attempts"] == 2
+    assert job["last_error"] == "still bad"
+
+    assert queue.requeue("broken") is True
+    assert queue.claim()["attempts"] == 1
+
+
+def test_recover_and_done_file_import(queue, tmp_path):
+    """Running jobs are recovered and legacy done.txt entries are imported."""
+    queue.enqueue("a")
+    queue.claim()
+    assert queue.recover() == 1
+    assert queue.get("a")["status"] == "pending"
+
+    done_file = tmp_path / "done.txt"
+    done_file.write_text("old1\nold2\n\n", encoding="utf-8")
+    assert queue.import_done_file(str(done_file)) == 2
+    assert queue.get("old1")["status"] == "done"
+    assert queue.enqueue("old2") is False
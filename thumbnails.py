@@ -0,0 +1,196 @@
+"""
+Poster images and short low-bitrate previews for the gallery.
+
+Run ``python thumbnails.py`` to backfill thumbnails for reels that were
+rendered before they existed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from gallery_index import gallery_index
+from logs import configure_logging
+
+STATIC_DIR = "static"
+POSTER_WIDTH = 480
+PREVIEW_WIDTH = 320
+PREVIEW_SECONDS = 6
+PREVIEW_FPS = 15
+
+logger = logging.getLogger(__name__)
+
+
+def poster_path(reel_name):
+    return f"posters/{reel_name}.jpg"
+
+
+def preview_path(reel_name):
+    return f"previews/{reel_name}.mp4"
+
+
+def _run(command):
+    result = subprocess.run(
+        command, capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    if result.returncode != 0:
+        logger.error("FFmpeg failed", extra={"stderr": result.stderr[-4000:]})
+        raise Exception(f"FFmpeg failed with return code {result.returncode}")
+
+
+def generate_thumbnails(reel_name, static_dir=STATIC_DIR):
+    """
+    Render the poster JPEG and looping preview for ``static/reels/<reel_name>.mp4``.
+
+    Returns the paths relative to ``static_dir`` as stored in the metadata.
+    """
+    video = os.path.join(static_dir, "reels", f"{reel_name}.mp4")
+    thumbnails = {"poster": poster_path(reel_name), "preview": preview_path(reel_name)}
+    poster = os.path.join(static_dir, thumbnails["poster"])
+    preview = os.path.join(static_dir, thumbnails["preview"])
+    for path in (poster, preview):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unlink first: the old file may be hard-linked to another reel's
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Take the poster half a second in, past any fade from black
+    _run(
+        [
+            "ffmpeg",
+            "-y",
+            "-ss",
+            "0.5",
+            "-i",
+            video,
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale={POSTER_WIDTH}:-2",
+            "-q:v",
+            "4",
+            poster,
+        ]
+    )
+    _run(
+        [
+            "ffmpeg",
+            "-y",
+            "-i",
+            video,
+            "-t",
+            str(PREVIEW_SECONDS),
+            "-vf",
+            f"scale={PREVIEW_WIDTH}:-2,fps={PREVIEW_FPS}",
+            "-an",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            "32",
+            "-pix_fmt",
+            "yuv420p",
+            "-movflags",
+            "+faststart",
+            preview,
+        ]
+    )
+    return thumbnails
+
+
+def reuse_thumbnails(cached_name, reel_name, static_dir=STATIC_DIR):
+    """
+    Hard-link the thumbnails of a cached reel to a new reel name. Returns
+    None if the cached reel has no thumbnails.
+    """
+    thumbnails = {"poster": poster_path(reel_name), "preview": preview_path(reel_name)}
+    sources = {"poster": poster_path(cached_name), "preview": preview_path(cached_name)}
+    if not all(os.path.exists(os.path.join(static_dir, p)) for p in sources.values()):
+        return None
+
+    for key, source in sources.items():
+        source = os.path.join(static_dir, source)
+        target = os.path.join(static_dir, thumbnails[key])
+        if os.path.abspath(source) == os.path.abspath(target):
+            continue
+        tmp_path = f"{target}.part"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        os.link(source, tmp_path)
+        os.replace(tmp_path, target)
+    return thumbnails
+
+
+def remove_thumbnails(reel_name, static_dir=STATIC_DIR):
+    for path in (poster_path(reel_name), preview_path(reel_name)):
+        path = os.path.join(static_dir, path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def record_thumbnails(reel_name, thumbnails, static_dir=STATIC_DIR):
+    """Merge thumbnail paths into the reel's metadata JSON"""
+    metadata_path = os.path.join(static_dir, "metadata", f"{reel_name}.json")
+    metadata = {"name": reel_name}
+    if os.path.exists(metadata_path):
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    metadata.update(thumbnails)
+
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    with open(metadata_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def missing_thumbnails(static_dir=STATIC_DIR):
+    """Names of reels without a poster or preview"""
+    reels_dir = os.path.join(static_dir, "reels")
+    if not os.path.isdir(reels_dir):
+        return []
+    names = [f[: -len(".mp4")] for f in os.listdir(reels_dir) if f.endswith(".mp4")]
+    return [
+        name
+        for name in sorted(names)
+        if not os.path.exists(os.path.join(static_dir, poster_path(name)))
+        or not os.path.exists(os.path.join(static_dir, preview_path(name)))
+    ]
+
+
+def backfill(workers=None, static_dir=STATIC_DIR):
+    """Generate thumbnails for every reel that lacks them"""
+    names = missing_thumbnails(static_dir)
+
+    def process(name):
+        try:
+            thumbnails = generate_thumbnails(name, static_dir)
+            record_thumbnails(name, thumbnails, static_dir)
+            gallery_index.add(name)
+            return True
+        except Exception as e:
+            logger.warning(
+                "Could not create thumbnails", extra={"reel": name, "error": str(e)}
+            )
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        results = list(pool.map(process, names))
+
+    logger.info(
+        "Backfilled thumbnails", extra={"created": sum(results), "missing": len(names)}
+    )
+    return sum(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill gallery posters and previews"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    configure_logging()
+    backfill(args.workers)